@@ -0,0 +1,138 @@
+import json
+import statistics
+import subprocess
+import time
+from pathlib import Path
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.utils import timezone
+
+from core.services.cartoes_sinteticos import AUGMENTACOES, conferir_leitura, gerar_corpus
+from core.services.omr_scanner import OMRScanner
+
+
+class Command(BaseCommand):
+    help = (
+        "Mede o leitor de cartões (OMRScanner) num lote de fotos sintéticas com gabarito conhecido: "
+        "cartões por segundo, tempo por etapa e precisão/revocação por bolinha. Grava um JSON para comparar execuções."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--cartoes', type=int, default=100, help="Tamanho do lote sintético.")
+        parser.add_argument('--questoes', type=int, default=20, help="Questões por cartão (máx. 30 no layout atual).")
+        parser.add_argument('--semente', type=int, default=0, help="Mesma semente = mesmo lote (compare antes/depois).")
+        parser.add_argument('--px-por-ponto', type=int, default=4, help="Resolução da foto (4 ≈ 1,6 MP; 8 ≈ 6 MP).")
+        parser.add_argument('--sem', nargs='*', default=[], choices=AUGMENTACOES, help="Defeitos a desligar.")
+        parser.add_argument('--salvar-corpus', default=None, help="Pasta para gravar as fotos e a verdade (JSON).")
+        parser.add_argument('--saida', default=None, help="Arquivo JSON (padrão: benchmark_omr_<data>.json).")
+
+    def handle(self, *args, **opts):
+        augmentacoes = tuple(a for a in AUGMENTACOES if a not in opts['sem'])
+        self.stdout.write(f"Gerando {opts['cartoes']} cartões ({', '.join(augmentacoes) or 'sem defeitos'})...")
+        corpus = list(gerar_corpus(opts['cartoes'], opts['questoes'], opts['semente'], augmentacoes, opts['px_por_ponto']))
+        if opts['salvar_corpus']:
+            self.salvar_corpus(Path(opts['salvar_corpus']), corpus)
+
+        scanner = OMRScanner(debug_mode=False)
+        scanner.processar_cartao(corpus[0]['jpg'], qtd_questoes=opts['questoes'])  # aquecimento
+
+        total = {'questoes': 0, 'certas': 0, 'vp': 0, 'fp': 0, 'fn': 0}
+        etapas, tempos, metodos, falhas, por_defeito = {}, [], {}, [], {}
+        inicio = time.perf_counter()
+        for item in corpus:
+            t0 = time.perf_counter()
+            leitura = scanner.processar_cartao(item['jpg'], qtd_questoes=opts['questoes'])
+            tempos.append((time.perf_counter() - t0) * 1000)
+            for etapa, ms in scanner.tempos.items():
+                etapas.setdefault(etapa, []).append(ms)
+
+            metodo = leitura.get('metodo') or ('contornos' if leitura.get('sucesso') else 'falhou')
+            metodos[metodo] = metodos.get(metodo, 0) + 1
+            conferencia = conferir_leitura(item['verdade'], leitura.get('respostas'), opts['questoes'])
+            for chave in total:
+                total[chave] += conferencia[chave]
+            if leitura.get('qr_code') != item['qr'] or conferencia['certas'] < conferencia['questoes']:
+                falhas.append({'indice': item['indice'], 'metodo': metodo, 'erro': leitura.get('erro'),
+                               'certas': conferencia['certas'], 'parametros': item['parametros']})
+            for defeito in self.defeitos(item):
+                grupo = por_defeito.setdefault(defeito, {'cartoes': 0, 'questoes': 0, 'certas': 0})
+                grupo['cartoes'] += 1
+                grupo['questoes'] += conferencia['questoes']
+                grupo['certas'] += conferencia['certas']
+        duracao = time.perf_counter() - inicio
+
+        relatorio = {
+            'gerado_em': timezone.now().isoformat(),
+            'commit': self.commit_atual(),
+            'lote': {'cartoes': len(corpus), 'questoes': opts['questoes'], 'semente': opts['semente'],
+                     'px_por_ponto': opts['px_por_ponto'], 'augmentacoes': list(augmentacoes)},
+            'cartoes_por_segundo': round(len(corpus) / duracao, 2),
+            'cartao_ms': self.resumo(tempos),
+            'etapas_ms': {etapa: self.resumo(valores) for etapa, valores in etapas.items()},
+            'metodos': metodos,
+            'acerto_questoes': round(total['certas'] / max(total['questoes'], 1), 4),
+            'precisao_bolinhas': round(total['vp'] / max(total['vp'] + total['fp'], 1), 4),
+            'revocacao_bolinhas': round(total['vp'] / max(total['vp'] + total['fn'], 1), 4),
+            'por_defeito': {d: {**g, 'acerto': round(g['certas'] / max(g['questoes'], 1), 4)} for d, g in sorted(por_defeito.items())},
+            'falhas': falhas,
+        }
+
+        self.stdout.write(f"{len(corpus)} cartões em {duracao:.1f}s: {relatorio['cartoes_por_segundo']} cartões/s "
+                          f"(mediana {relatorio['cartao_ms']['mediana']:.0f} ms, p95 {relatorio['cartao_ms']['p95']:.0f} ms)")
+        for etapa, resumo in relatorio['etapas_ms'].items():
+            self.stdout.write(f"  {etapa:<12} média {resumo['media']:>7.1f} ms | p95 {resumo['p95']:>7.1f} ms | {resumo['n']} cartões")
+        self.stdout.write(f"Métodos: {metodos}")
+        self.stdout.write(
+            f"Questões certas: {relatorio['acerto_questoes']:.2%} | bolinhas: precisão {relatorio['precisao_bolinhas']:.2%}, "
+            f"revocação {relatorio['revocacao_bolinhas']:.2%}"
+        )
+        for defeito, grupo in relatorio['por_defeito'].items():
+            self.stdout.write(f"  com {defeito:<12} {grupo['cartoes']:>4} cartões | acerto {grupo['acerto']:.2%}")
+
+        saida = Path(opts['saida'] or f"benchmark_omr_{timezone.now():%Y%m%d_%H%M%S}.json")
+        saida.write_text(json.dumps(relatorio, indent=2, ensure_ascii=False), encoding='utf-8')
+        self.stdout.write(self.style.SUCCESS(f"Resultados gravados em {saida}"))
+
+    def defeitos(self, item):
+        """Defeitos presentes neste cartão, para o acerto por defeito."""
+        p = item['parametros']
+        presentes = ['todos']
+        if abs(p['giro']) > 6: presentes.append('giro')
+        if p['quartos']: presentes.append('deitado')
+        if p['perspectiva'] > 0.02: presentes.append('perspectiva')
+        if p['desfoque'] > 0.6: presentes.append('desfoque')
+        if p['sombra'] > 0.3: presentes.append('sombra')
+        if p['mesa']: presentes.append('mesa')
+        if item['rasuras']: presentes.append('rasura')
+        if any(len(m) > 1 for m in item['verdade'].values()): presentes.append('dupla')
+        return presentes
+
+    def resumo(self, valores):
+        ordenados = sorted(valores)
+        return {
+            'n': len(ordenados),
+            'media': round(statistics.fmean(ordenados), 2),
+            'mediana': round(statistics.median(ordenados), 2),
+            'p95': round(ordenados[min(len(ordenados) - 1, int(0.95 * len(ordenados)))], 2),
+        }
+
+    def salvar_corpus(self, pasta, corpus):
+        pasta.mkdir(parents=True, exist_ok=True)
+        verdade = {}
+        for item in corpus:
+            nome = f"cartao_{item['indice']:04d}.jpg"
+            (pasta / nome).write_bytes(item['jpg'])
+            verdade[nome] = {'qr': item['qr'], 'parametros': item['parametros'], 'rasuras': item['rasuras'],
+                             'verdade': {n: sorted(m) for n, m in item['verdade'].items()}}
+        (pasta / 'verdade.json').write_text(json.dumps(verdade, indent=2, ensure_ascii=False), encoding='utf-8')
+        self.stdout.write(f"Corpus gravado em {pasta}")
+
+    def commit_atual(self):
+        try:
+            return subprocess.run(
+                ['git', 'rev-parse', '--short', 'HEAD'], cwd=settings.BASE_DIR,
+                capture_output=True, text=True, timeout=5
+            ).stdout.strip() or None
+        except (OSError, subprocess.SubprocessError):
+            return None
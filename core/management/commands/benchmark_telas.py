@@ -0,0 +1,141 @@
+import json
+import statistics
+import subprocess
+import time
+from pathlib import Path
+
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.core.cache import cache
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+from django.db.models import Count
+from django.test import Client, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+from django.utils import timezone
+
+from core.models import Turma, Matricula, Avaliacao, Resultado, RespostaDetalhada
+
+# Cache só do benchmark: o cache.clear() de cada medição não pode apagar o Redis/Memcached de produção
+CACHE_ISOLADO = {'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache', 'LOCATION': 'benchmark_telas'}}
+
+
+class Command(BaseCommand):
+    help = (
+        "Cronometra as telas mais pesadas do SAMI (Dashboard, Mapa de Calor, Resultados, PDFs e Virada de Ano) "
+        "contra o banco atual e grava um JSON para comparar execuções. Use com gerar_escola_sintetica."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--repeticoes', type=int, default=5, help="Medições por tela (depois de 1 aquecimento).")
+        parser.add_argument('--usuario', default=None, help="Login usado nas requisições (padrão: primeiro superusuário).")
+        parser.add_argument('--saida', default=None, help="Arquivo JSON (padrão: benchmark_<data>.json).")
+        parser.add_argument('--telas', nargs='*', default=None, help="Mede só essas telas (nomes das rotas).")
+
+    def handle(self, *args, **opts):
+        usuario = self.escolher_usuario(opts['usuario'])
+        alvos = self.montar_alvos()
+        if opts['telas']:
+            alvos = [a for a in alvos if a[0] in opts['telas']]
+
+        cliente = Client()
+        cliente.force_login(usuario)
+
+        medicoes = []
+        with override_settings(CACHES=CACHE_ISOLADO):
+            for nome, url in alvos:
+                medicao = self.medir(cliente, url, opts['repeticoes'])
+                medicao.update({'tela': nome, 'url': url})
+                medicoes.append(medicao)
+                self.stdout.write(
+                    f"{nome:<38} mediana {medicao['mediana_ms']:>9.1f} ms | p95 {medicao['p95_ms']:>9.1f} ms | "
+                    f"{medicao['consultas']:>4} consultas ({medicao['sql_ms']:.1f} ms SQL) | HTTP {medicao['status']}"
+                )
+
+        relatorio = {
+            'gerado_em': timezone.now().isoformat(),
+            'commit': self.commit_atual(),
+            'banco': connection.vendor,
+            'repeticoes': opts['repeticoes'],
+            'escala': {
+                'turmas': Turma.objects.count(),
+                'matriculas': Matricula.objects.count(),
+                'avaliacoes': Avaliacao.objects.count(),
+                'resultados': Resultado.objects.count(),
+                'respostas': RespostaDetalhada.objects.count(),
+            },
+            'telas': medicoes,
+        }
+
+        saida = Path(opts['saida'] or f"benchmark_{timezone.now():%Y%m%d_%H%M%S}.json")
+        saida.write_text(json.dumps(relatorio, indent=2, ensure_ascii=False), encoding='utf-8')
+        self.stdout.write(self.style.SUCCESS(f"Resultados gravados em {saida}"))
+
+    def escolher_usuario(self, username):
+        if username:
+            usuario = User.objects.filter(username=username).first()
+            if not usuario: raise CommandError(f"Usuário '{username}' não encontrado.")
+            return usuario
+        usuario = User.objects.filter(is_superuser=True).order_by('id').first()
+        if not usuario:
+            raise CommandError("Nenhum superusuário no banco. Crie um (createsuperuser) ou passe --usuario.")
+        return usuario
+
+    def montar_alvos(self):
+        """Escolhe dados representativos: a prova com mais notas, um aluno dela e a série da turma."""
+        avaliacao = Avaliacao.objects.annotate(qtd=Count('resultado')).order_by('-qtd', '-id').select_related('alocacao__turma').first()
+        if not avaliacao:
+            raise CommandError("Banco sem avaliações. Rode antes: python manage.py gerar_escola_sintetica")
+        turma = avaliacao.alocacao.turma
+        matricula = Matricula.objects.filter(turma=turma).order_by('id').first()
+        serie = turma.nome.strip()[:1]
+
+        return [
+            ('dashboard', reverse('dashboard')),
+            ('dashboard (turma)', reverse('dashboard') + f"?turma={turma.id}"),
+            ('mapa_calor', reverse('mapa_calor', args=[avaliacao.id])),
+            ('resultados_turma', reverse('resultados_turma', args=[avaliacao.id])),
+            ('gerar_boletim_pdf', reverse('gerar_boletim_pdf', args=[matricula.aluno_id])),
+            ('gerar_cartoes_pdf', reverse('gerar_cartoes_pdf', args=[avaliacao.id])),
+            ('gerar_relatorio_proficiencia', reverse('gerar_relatorio_proficiencia')),
+            ('gerar_relatorio_proficiencia (turma)', reverse('gerar_relatorio_proficiencia') + f"?turma={turma.id}"),
+            ('gerenciar_virada_ano', reverse('gerenciar_virada_ano') + f"?serie_filtro={serie}"),
+        ]
+
+    def medir(self, cliente, url, repeticoes):
+        cliente.get(url)  # aquecimento (imports, templates, fontes do ReportLab)
+        tempos, consultas, sql = [], 0, 0.0
+        status, tamanho = None, 0
+        for _ in range(max(1, repeticoes)):
+            cache.clear()  # sempre o caminho frio do Dashboard (só o CACHE_ISOLADO, ver handle)
+            with CaptureQueriesContext(connection) as ctx:
+                inicio = time.perf_counter()
+                resposta = cliente.get(url)
+                corpo = b''.join(resposta.streaming_content) if resposta.streaming else resposta.content
+                tempos.append((time.perf_counter() - inicio) * 1000)
+            consultas = len(ctx)
+            sql = sum(float(q.get('time') or 0) for q in ctx.captured_queries) * 1000
+            status, tamanho = resposta.status_code, len(corpo)
+
+        tempos_ord = sorted(tempos)
+        return {
+            'status': status,
+            'bytes': tamanho,
+            'consultas': consultas,
+            'sql_ms': round(sql, 2),
+            'mediana_ms': round(statistics.median(tempos), 2),
+            'min_ms': round(tempos_ord[0], 2),
+            'max_ms': round(tempos_ord[-1], 2),
+            'p95_ms': round(tempos_ord[min(len(tempos_ord) - 1, int(round(0.95 * (len(tempos_ord) - 1))))], 2),
+            'tempos_ms': [round(t, 2) for t in tempos],
+        }
+
+    def commit_atual(self):
+        try:
+            return subprocess.run(
+                ['git', 'rev-parse', '--short', 'HEAD'], cwd=settings.BASE_DIR,
+                capture_output=True, text=True, timeout=5
+            ).stdout.strip() or None
+        except (OSError, subprocess.SubprocessError):
+            return None
@@ -0,0 +1,67 @@
+import time
+from pathlib import Path
+
+from django.core.management.base import BaseCommand, CommandError
+
+from core.models import Avaliacao
+from core.services.omr_lote import aplicar_leituras, extrair_paginas, ler_paginas, QTD_QUESTOES_PADRAO
+from core.services.correcao import carregar_gabarito
+
+
+class Command(BaseCommand):
+    help = (
+        "Corrige um lote de cartões-resposta digitalizados (PDF de várias páginas, ZIP de fotos ou uma imagem). "
+        "Cada cartão é ligado ao aluno pelo QR Code e as notas são gravadas de uma vez no final."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('arquivos', nargs='+', help="PDF, ZIP ou imagens a corrigir.")
+        parser.add_argument('--avaliacao', type=int, default=None, help="Aceita só cartões desta avaliação.")
+        parser.add_argument('--workers', type=int, default=None, help="Processos de leitura (padrão: nº de CPUs).")
+        parser.add_argument('--simular', action='store_true', help="Só lê e mostra; não grava nenhuma nota.")
+
+    def handle(self, *args, **opts):
+        avaliacao = None
+        if opts['avaliacao']:
+            avaliacao = Avaliacao.objects.filter(id=opts['avaliacao']).first()
+            if not avaliacao:
+                raise CommandError(f"Avaliação {opts['avaliacao']} não existe.")
+
+        paginas = []
+        for caminho in opts['arquivos']:
+            caminho = Path(caminho)
+            if not caminho.exists():
+                raise CommandError(f"Arquivo não encontrado: {caminho}")
+            try:
+                paginas += [(f"{caminho.name} · {rotulo}", conteudo) for rotulo, conteudo in extrair_paginas(caminho.name, caminho.read_bytes())]
+            except ValueError as e:
+                raise CommandError(f"{caminho.name}: {e}")
+
+        inicio = time.perf_counter()
+        qtd_questoes = (len(carregar_gabarito(avaliacao)) if avaliacao else 0) or QTD_QUESTOES_PADRAO
+        leituras = []
+        for lidas, da_pagina in enumerate(ler_paginas(paginas, qtd_questoes, opts['workers']), 1):
+            leituras += da_pagina
+            for leitura in da_pagina:
+                situacao = leitura.get('qr_code') or leitura.get('erro') or 'sem QR'
+                self.stdout.write(f"[{lidas:>3}/{len(paginas)}] {leitura['pagina']}: {situacao}")
+        tempo_leitura = time.perf_counter() - inicio
+
+        if opts['simular']:
+            self.stdout.write(self.style.WARNING(
+                f"Simulação: {len(paginas)} páginas ({len(leituras)} cartões) lidas em {tempo_leitura:.1f}s, nada gravado."
+            ))
+            return
+
+        contagem = {}
+        for s in aplicar_leituras(leituras, avaliacao):
+            contagem[s['status']] = contagem.get(s['status'], 0) + 1
+            if s['status'] == 'corrigido':
+                self.stdout.write(f"  ✅ {s['pagina']}: {s['aluno']} ({s['acertos']}/{s['total']})")
+            else:
+                self.stdout.write(self.style.ERROR(f"  ❌ {s['pagina']}: {s['erro']}"))
+
+        resumo = ", ".join(f"{n} {status}" for status, n in sorted(contagem.items()))
+        self.stdout.write(self.style.SUCCESS(
+            f"Lote concluído em {time.perf_counter() - inicio:.1f}s (leitura {tempo_leitura:.1f}s): {resumo}."
+        ))
@@ -0,0 +1,222 @@
+import json
+import math
+import random
+from datetime import date, timedelta
+from pathlib import Path
+
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+from django.utils import timezone
+
+from core.models import (
+    Disciplina, Descritor, Turma, Aluno, Matricula, Professor, Alocacao,
+    Avaliacao, ItemGabarito, Resultado, RespostaDetalhada, NDI
+)
+from core.services.proficiencia import atualizar_proficiencia
+from core.services.vetor_respostas import empacotar
+
+LETRAS = 'ABCDE'
+NOMES = ['Ana', 'Bruno', 'Carla', 'Davi', 'Eduarda', 'Felipe', 'Gabriela', 'Heitor', 'Isabela', 'João',
+         'Larissa', 'Mateus', 'Natália', 'Otávio', 'Paula', 'Rafael', 'Sofia', 'Thiago', 'Vitória', 'Yuri']
+SOBRENOMES = ['Silva', 'Souza', 'Oliveira', 'Lima', 'Pereira', 'Costa', 'Rodrigues', 'Almeida',
+              'Nascimento', 'Carvalho', 'Araújo', 'Ribeiro', 'Gomes', 'Martins', 'Barbosa', 'Freitas']
+
+
+class Command(BaseCommand):
+    help = (
+        "Gera uma escola sintética (turmas, alunos, professores, provas corrigidas e NDI) "
+        "com os descritores reais do backup_descritores.json, para medir o SAMI em escala de produção."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--turmas', type=int, default=6, help="Quantidade de turmas (distribuídas entre 1º, 2º e 3º ano).")
+        parser.add_argument('--alunos', type=int, default=35, help="Alunos por turma.")
+        parser.add_argument('--disciplinas', type=int, default=3, help="Disciplinas com descritores no backup a usar.")
+        parser.add_argument('--bimestres', type=int, default=4, choices=[1, 2, 3, 4])
+        parser.add_argument('--avaliacoes', type=int, default=1, help="Avaliações por bimestre (por turma e disciplina).")
+        parser.add_argument('--questoes', type=int, default=20, help="Questões por avaliação.")
+        parser.add_argument('--ausencia', type=float, default=0.04, help="Chance de o aluno faltar a uma prova.")
+        parser.add_argument('--semente', type=int, default=2026, help="Semente do sorteio (mesma semente, mesma escola).")
+        parser.add_argument('--forcar', action='store_true', help="Permite rodar com DEBUG=False.")
+
+    def handle(self, *args, **opts):
+        if not settings.DEBUG and not opts['forcar']:
+            raise CommandError("DEBUG está desligado: isso parece produção. Use --forcar se tiver certeza.")
+
+        self.rng = random.Random(opts['semente'])
+        self.notas_bimestre = {}  # (matricula_id, disciplina_id, bimestre) -> percentuais das provas
+        # Mesmo ano que a Virada de Ano considera "ano de origem"
+        hoje = timezone.now()
+        self.ano = hoje.year - 1 if hoje.month <= 3 else hoje.year
+
+        with transaction.atomic():
+            disciplinas = self.carregar_disciplinas(opts['disciplinas'])
+            turmas = self.criar_turmas(opts['turmas'], opts['alunos'])
+            professores = self.criar_professores(disciplinas, turmas)
+
+        total_respostas = 0
+        avaliacoes_criadas = []
+        for bimestre in range(1, opts['bimestres'] + 1):
+            for n in range(1, opts['avaliacoes'] + 1):
+                data_prova = date(self.ano, 2, 1) + timedelta(days=(bimestre - 1) * 60 + (n - 1) * 20)
+                for alocacao in professores:
+                    with transaction.atomic():
+                        av, qtd = self.aplicar_prova(alocacao, bimestre, n, data_prova, opts['questoes'], opts['ausencia'])
+                    avaliacoes_criadas.append(av.id)
+                    total_respostas += qtd
+            self.lancar_ndi(professores, bimestre)
+            self.stdout.write(f"  Bimestre {bimestre}: {len(avaliacoes_criadas)} provas, {total_respostas} respostas até agora")
+
+        for av_id in avaliacoes_criadas:
+            atualizar_proficiencia(av_id)
+
+        self.stdout.write(self.style.SUCCESS(
+            f"Escola sintética pronta: {len(turmas)} turmas, {len(turmas) * opts['alunos']} alunos, "
+            f"{len(disciplinas)} disciplinas, {len(avaliacoes_criadas)} avaliações, {total_respostas} respostas."
+        ))
+
+    # --------------------------------------------------------------------------
+    # ESTRUTURA
+    # --------------------------------------------------------------------------
+
+    def carregar_disciplinas(self, quantidade):
+        """Cria (ou reaproveita) as disciplinas e descritores do backup, na ordem das que têm mais descritores."""
+        base = Path(settings.BASE_DIR)
+        try:
+            nomes = {d['pk']: d['fields']['nome'] for d in json.loads((base / 'backup_disciplinas.json').read_text(encoding='utf-8'))}
+            backup = json.loads((base / 'backup_descritores.json').read_text(encoding='utf-8'))
+        except (OSError, ValueError) as e:
+            raise CommandError(f"Não foi possível ler os backups de disciplinas/descritores: {e}")
+
+        por_disciplina = {}
+        for d in backup:
+            por_disciplina.setdefault(d['fields']['disciplina'], []).append(d['fields'])
+        escolhidas = sorted(por_disciplina, key=lambda pk: -len(por_disciplina[pk]))[:quantidade]
+
+        disciplinas = []
+        for pk in escolhidas:
+            disciplina, _ = Disciplina.objects.get_or_create(nome=nomes.get(pk, f"Disciplina {pk}"))
+            existentes = set(Descritor.objects.filter(disciplina=disciplina).values_list('codigo', flat=True))
+            Descritor.objects.bulk_create([
+                Descritor(codigo=f['codigo'], descricao=f['descricao'], tema=f['tema'], disciplina=disciplina)
+                for f in por_disciplina[pk] if f['codigo'] not in existentes
+            ])
+            disciplina.descritores_sinteticos = list(Descritor.objects.filter(disciplina=disciplina))
+            disciplinas.append(disciplina)
+        return disciplinas
+
+    def criar_turmas(self, qtd_turmas, alunos_por_turma):
+        turmas = []
+        for i in range(qtd_turmas):
+            serie, letra = (i % 3) + 1, chr(ord('A') + i // 3)
+            turma = Turma.objects.create(nome=f"{serie}º Ano {letra}", ano_letivo=self.ano)
+            alunos = Aluno.objects.bulk_create([
+                Aluno(nome_completo=f"{self.rng.choice(NOMES)} {self.rng.choice(SOBRENOMES)} {self.rng.choice(SOBRENOMES)}")
+                for _ in range(alunos_por_turma)
+            ])
+            Matricula.objects.bulk_create([
+                Matricula(aluno=aluno, turma=turma, numero_chamada=n)
+                for n, aluno in enumerate(sorted(alunos, key=lambda a: a.nome_completo), 1)
+            ])
+            # Proficiência "verdadeira" de cada aluno (escala logística, média 0)
+            turma.habilidades = {
+                m_id: self.rng.gauss(0, 1) for m_id in Matricula.objects.filter(turma=turma).order_by('id').values_list('id', flat=True)
+            }
+            turmas.append(turma)
+        return turmas
+
+    def criar_professores(self, disciplinas, turmas):
+        alocacoes = []
+        for n, disciplina in enumerate(disciplinas, 1):
+            usuario, criado = User.objects.get_or_create(username=f"prof_sintetico{n}")
+            if criado:
+                usuario.set_password('sami1234')
+                usuario.save()
+            professor, _ = Professor.objects.get_or_create(usuario=usuario, defaults={'nome_completo': f"Professor {disciplina.nome}"})
+            for turma in turmas:
+                alocacao, _ = Alocacao.objects.get_or_create(professor=professor, disciplina=disciplina, turma=turma)
+                alocacao.turma = turma  # mantém as habilidades sorteadas
+                alocacao.disciplina = disciplina
+                alocacoes.append(alocacao)
+        return alocacoes
+
+    # --------------------------------------------------------------------------
+    # PROVAS E NOTAS
+    # --------------------------------------------------------------------------
+
+    def aplicar_prova(self, alocacao, bimestre, n, data_prova, qtd_questoes, chance_ausencia):
+        """
+        Cria a prova, o gabarito e as respostas de toda a turma.
+        Cada resposta segue um modelo logístico (habilidade do aluno x dificuldade do item),
+        então há alunos fortes e fracos e itens fáceis e difíceis, como numa turma de verdade.
+        """
+        turma, disciplina = alocacao.turma, alocacao.disciplina
+        avaliacao = Avaliacao.objects.create(
+            titulo=f"{disciplina.nome} - Avaliação {n} ({bimestre}º Bim)", data_aplicacao=data_prova, alocacao=alocacao
+        )
+        itens = ItemGabarito.objects.bulk_create([
+            ItemGabarito(
+                avaliacao=avaliacao, numero=num, resposta_correta=self.rng.choice(LETRAS),
+                descritor=self.rng.choice(disciplina.descritores_sinteticos)
+            )
+            for num in range(1, qtd_questoes + 1)
+        ])
+        dificuldades = {item.numero: self.rng.gauss(0, 1) for item in itens}
+
+        resultados, marcacoes = [], []
+        for matricula_id, habilidade in turma.habilidades.items():
+            resultado = Resultado(avaliacao=avaliacao, matricula_id=matricula_id, total_questoes=qtd_questoes)
+            if self.rng.random() < chance_ausencia:
+                resultado.acertos = None
+                marcacoes.append(None)
+            else:
+                linha = []
+                for item in itens:
+                    chance = 1 / (1 + math.exp(-1.7 * (habilidade - dificuldades[item.numero])))
+                    if self.rng.random() < chance:
+                        linha.append(item.resposta_correta)
+                    elif self.rng.random() < 0.03:
+                        linha.append('')  # deixou em branco
+                    else:
+                        linha.append(self.rng.choice([l for l in LETRAS if l != item.resposta_correta]))
+                resultado.acertos = sum(1 for item, letra in zip(itens, linha) if letra == item.resposta_correta)
+                marcacoes.append(linha)
+            linha = marcacoes[-1]
+            resultado.respostas_vetor, resultado.acertos_mascara = empacotar(
+                itens, None if linha is None else {str(item.numero): letra for item, letra in zip(itens, linha)}
+            )
+            resultados.append(resultado)
+
+        resultados = Resultado.objects.gravar_em_lote(resultados, campos_extras=['respostas_vetor', 'acertos_mascara'])
+        respostas = [
+            RespostaDetalhada(
+                resultado=resultado, item_gabarito=item, avaliacao=avaliacao, descritor_id=item.descritor_id,
+                resposta_aluno=letra, acertou=(letra == item.resposta_correta)
+            )
+            for resultado, linha in zip(resultados, marcacoes) if linha is not None
+            for item, letra in zip(itens, linha) if letra
+        ]
+        RespostaDetalhada.objects.bulk_create(respostas, batch_size=2000)
+
+        # Guarda a nota da prova para o NDI do bimestre
+        for resultado in resultados:
+            self.notas_bimestre.setdefault((resultado.matricula_id, disciplina.id, bimestre), []).append(resultado.percentual)
+        return avaliacao, len(respostas)
+
+    def lancar_ndi(self, alocacoes, bimestre):
+        ndis = []
+        notas = self.notas_bimestre
+        for alocacao in alocacoes:
+            for matricula_id in alocacao.turma.habilidades:
+                provas = [p for p in notas.get((matricula_id, alocacao.disciplina.id, bimestre), []) if p is not None]
+                nota_prova = round(sum(provas) / len(provas) / 10, 1) if provas else None
+                ndis.append(NDI(
+                    matricula_id=matricula_id, disciplina=alocacao.disciplina, bimestre=bimestre,
+                    nota_frequencia=round(self.rng.uniform(6, 10), 1),
+                    nota_atividade=round(self.rng.uniform(4, 10), 1),
+                    nota_comportamento=round(self.rng.uniform(6, 10), 1),
+                    nota_prova_parcial=nota_prova, nota_prova_bimestral=nota_prova,
+                ))
+        NDI.objects.bulk_create(ndis, batch_size=2000, ignore_conflicts=True)
@@ -0,0 +1,138 @@
+import os
+import time
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
+from concurrent.futures.process import BrokenProcessPool
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.db import connections
+
+from core.services.fila_omr import (
+    concluir, devolver, iniciar_processo, ler_tarefa, limpar_antigas, recuperar_travadas, reservar,
+)
+
+LIMPEZA_A_CADA = 600  # segundos entre as faxinas da fila (travadas e antigas)
+
+
+class Command(BaseCommand):
+    help = (
+        "Leitor de cartões-resposta em segundo plano: consome a fila (TarefaOMR) que o "
+        "api_ler_cartao alimenta, com processos próprios e o OpenCV já carregado."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--processos', type=int, default=None,
+                            help="Processos de leitura (padrão: OMR_WORKER_PROCESSOS ou nº de CPUs).")
+        parser.add_argument('--threads-opencv', type=int, default=None,
+                            help="Threads do OpenCV por processo (padrão: CPUs divididas pelos processos).")
+        parser.add_argument('--intervalo', type=float, default=0.2, help="Espera entre consultas com a fila vazia (s).")
+        parser.add_argument('--uma-vez', action='store_true', help="Esvazia a fila e sai (cron, testes).")
+
+    def handle(self, *args, **opts):
+        cpus = os.cpu_count() or 1
+        processos = max(1, opts['processos'] or getattr(settings, 'OMR_WORKER_PROCESSOS', 0) or cpus)
+        # Processos já dividem os núcleos: threads do OpenCV além disso só disputam CPU
+        threads = max(1, opts['threads_opencv'] or cpus // processos)
+
+        recuperadas = recuperar_travadas()
+        if recuperadas:
+            self.stdout.write(self.style.WARNING(f"{recuperadas} tarefa(s) travada(s) voltaram para a fila."))
+        self.stdout.write(f"Leitor OMR: {processos} processo(s), {threads} thread(s) do OpenCV cada.")
+
+        inicio, lidas = time.perf_counter(), 0
+        try:
+            if processos == 1:
+                lidas = self._rodar_aqui(threads, opts)
+            else:
+                lidas = self._rodar_em_pool(processos, threads, opts)
+        except KeyboardInterrupt:
+            # O que estava em LENDO volta para a fila no próximo início (recuperar_travadas)
+            self.stdout.write(self.style.WARNING("Interrompido."))
+        self.stdout.write(self.style.SUCCESS(f"{lidas} cartão(ões) lido(s) em {time.perf_counter() - inicio:.1f}s."))
+
+    def _rodar_aqui(self, threads, opts):
+        iniciar_processo(threads)
+        lidas, faxina = 0, time.monotonic()
+        while True:
+            tarefas = reservar(1)
+            if not tarefas:
+                if opts['uma_vez']:
+                    return lidas
+                faxina = self._faxina(faxina)
+                time.sleep(opts['intervalo'])
+                continue
+            self._registrar(tarefas[0][0], lambda: ler_tarefa(tarefas[0])[1])
+            lidas += 1
+
+    def _rodar_em_pool(self, processos, threads, opts):
+        self._lidas, suspeitas = 0, set()
+        while True:
+            em_andamento = {}
+            connections.close_all()  # os processos filhos não herdam conexão aberta com o banco
+            try:
+                with ProcessPoolExecutor(max_workers=processos, initializer=iniciar_processo, initargs=(threads,)) as pool:
+                    self._consumir(pool, processos, opts, em_andamento)
+                    return self._lidas
+            except BrokenProcessPool:
+                # Um filho morreu (segfault no cv2/pyzbar, OOM) e levou o pool junto. Não dá para saber
+                # qual foto foi: as que estavam em leitura voltam para a fila uma vez; se estiverem de
+                # novo numa queda, viram erro (senão uma foto envenenada derrubaria o worker para sempre)
+                ids = set(em_andamento.values())
+                reincidentes = ids & suspeitas
+                for tarefa_id in reincidentes:
+                    concluir(tarefa_id, {'sucesso': False, 'erro': 'O leitor caiu ao processar esta imagem. Envie de novo.'}, erro=True)
+                devolver(ids - reincidentes)
+                suspeitas |= ids - reincidentes
+                self.stdout.write(self.style.ERROR(
+                    f"  ❌ pool de leitura caiu: {len(ids - reincidentes)} tarefa(s) de volta à fila, "
+                    f"{len(reincidentes)} com erro. Recriando os processos."
+                ))
+
+    def _consumir(self, pool, processos, opts, em_andamento):
+        faxina = time.monotonic()
+        while True:
+            # Um pouco mais que os processos: ninguém fica parado esperando o banco
+            vagas = 2 * processos - len(em_andamento)
+            if vagas > 0:
+                novas = reservar(vagas)
+                for i, tarefa in enumerate(novas):
+                    try:
+                        em_andamento[pool.submit(ler_tarefa, tarefa)] = tarefa[0]
+                    except BrokenProcessPool:
+                        devolver([t[0] for t in novas[i:]])
+                        raise
+            if not em_andamento:
+                if opts['uma_vez']:
+                    return
+                faxina = self._faxina(faxina)
+                time.sleep(opts['intervalo'])
+                continue
+            prontas, _ = wait(em_andamento, timeout=opts['intervalo'], return_when=FIRST_COMPLETED)
+            for futuro in prontas:
+                # Só sai de em_andamento depois de registrada: numa queda do pool ela ainda é devolvida
+                self._registrar(em_andamento[futuro], lambda: futuro.result()[1])
+                del em_andamento[futuro]
+                self._lidas += 1
+
+    def _registrar(self, tarefa_id, obter_resultado):
+        try:
+            resultado = obter_resultado()
+        except BrokenProcessPool:
+            raise  # o pool caiu, não esta leitura: _rodar_em_pool decide o destino dela
+        except Exception as e:
+            concluir(tarefa_id, {'sucesso': False, 'erro': f"Falha ao processar: {e}"}, erro=True)
+            self.stdout.write(self.style.ERROR(f"  ❌ tarefa {tarefa_id}: {e}"))
+            return
+        concluir(tarefa_id, resultado)
+        if 'leituras' in resultado:
+            situacao = f"{len(resultado['leituras'])} cartão(ões) na página"
+        else:
+            situacao = resultado.get('qr_code') or resultado.get('erro') or 'sem QR'
+        self.stdout.write(f"  tarefa {tarefa_id}: {situacao}")
+
+    def _faxina(self, ultima):
+        if time.monotonic() - ultima < LIMPEZA_A_CADA:
+            return ultima
+        recuperar_travadas()
+        limpar_antigas()
+        return time.monotonic()
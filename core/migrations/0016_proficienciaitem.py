@@ -0,0 +1,55 @@
+# Generated by Django 6.0.1 on 2026-10-17 10:55
+
+import django.db.models.deletion
+from django.db import migrations, models
+from django.db.models import Count, Q
+from django.db.models.functions import Coalesce
+
+
+def consolidar_existentes(apps, schema_editor):
+    Avaliacao = apps.get_model('core', 'Avaliacao')
+    RespostaDetalhada = apps.get_model('core', 'RespostaDetalhada')
+    ProficienciaItem = apps.get_model('core', 'ProficienciaItem')
+
+    avaliacoes = Avaliacao.objects.filter(resultado__isnull=False).select_related('alocacao').distinct()
+    for av in avaliacoes.iterator():
+        linhas = RespostaDetalhada.objects.filter(resultado__avaliacao=av).values(
+            'item_gabarito_id', 'questao_id',
+            descritor_final=Coalesce('item_gabarito__descritor_id', 'questao__descritor_id'),
+        ).annotate(total=Count('id'), acertos=Count('id', filter=Q(acertou=True))).order_by()
+
+        ProficienciaItem.objects.bulk_create([
+            ProficienciaItem(
+                avaliacao_id=av.id, turma_id=av.alocacao.turma_id, disciplina_id=av.alocacao.disciplina_id,
+                descritor_id=l['descritor_final'], item_gabarito_id=l['item_gabarito_id'], questao_id=l['questao_id'],
+                total=l['total'], acertos=l['acertos'],
+            ) for l in linhas
+        ])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0015_areaconhecimento_disciplina_area_conhecimento_and_more'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ProficienciaItem',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('total', models.IntegerField(default=0)),
+                ('acertos', models.IntegerField(default=0)),
+                ('avaliacao', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='proficiencia_itens', to='core.avaliacao')),
+                ('descritor', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='+', to='core.descritor')),
+                ('disciplina', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='+', to='core.disciplina')),
+                ('item_gabarito', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.CASCADE, related_name='+', to='core.itemgabarito')),
+                ('questao', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='+', to='core.questao')),
+                ('turma', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='+', to='core.turma')),
+            ],
+            options={
+                'indexes': [models.Index(fields=['turma', 'disciplina'], name='core_profic_turma_i_a12d5c_idx')],
+            },
+        ),
+        migrations.RunPython(consolidar_existentes, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,23 @@
+# Generated by Django 6.0.1 on 2026-10-17 10:58
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0016_proficienciaitem'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='avaliacao',
+            name='versao_dados',
+            field=models.PositiveIntegerField(default=0, editable=False),
+        ),
+        migrations.AddField(
+            model_name='turma',
+            name='versao_dados',
+            field=models.PositiveIntegerField(default=0, editable=False),
+        ),
+    ]
@@ -0,0 +1,32 @@
+# Generated by Django 6.0.1 on 2026-10-17 11:01
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0017_versao_dados'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='respostadetalhada',
+            name='avaliacao',
+            field=models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.CASCADE, related_name='+', to='core.avaliacao'),
+        ),
+        migrations.AddField(
+            model_name='respostadetalhada',
+            name='descritor',
+            field=models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='+', to='core.descritor'),
+        ),
+        migrations.AddIndex(
+            model_name='respostadetalhada',
+            index=models.Index(fields=['descritor', 'acertou'], name='core_respos_descrit_4d3de4_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='respostadetalhada',
+            index=models.Index(fields=['avaliacao', 'descritor'], name='core_respos_avaliac_c1598b_idx'),
+        ),
+    ]
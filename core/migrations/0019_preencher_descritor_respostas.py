@@ -0,0 +1,39 @@
+from django.db import migrations
+from django.db.models import OuterRef, Subquery, Max
+from django.db.models.functions import Coalesce
+
+TAMANHO_LOTE = 5000
+
+
+def preencher_descritor_e_avaliacao(apps, schema_editor):
+    RespostaDetalhada = apps.get_model('core', 'RespostaDetalhada')
+    Resultado = apps.get_model('core', 'Resultado')
+    ItemGabarito = apps.get_model('core', 'ItemGabarito')
+    Questao = apps.get_model('core', 'Questao')
+
+    avaliacao_sq = Subquery(Resultado.objects.filter(id=OuterRef('resultado_id')).values('avaliacao_id')[:1])
+    descritor_sq = Coalesce(
+        Subquery(ItemGabarito.objects.filter(id=OuterRef('item_gabarito_id')).values('descritor_id')[:1]),
+        Subquery(ItemGabarito.objects.filter(id=OuterRef('item_gabarito_id')).values('questao_banco__descritor_id')[:1]),
+        Subquery(Questao.objects.filter(id=OuterRef('questao_id')).values('descritor_id')[:1]),
+    )
+
+    # Lotes por faixa de id: cada UPDATE é curto e não segura a tabela inteira
+    ultimo_id = RespostaDetalhada.objects.aggregate(m=Max('id'))['m'] or 0
+    for inicio in range(0, ultimo_id + 1, TAMANHO_LOTE):
+        RespostaDetalhada.objects.filter(id__gte=inicio, id__lt=inicio + TAMANHO_LOTE).update(
+            avaliacao_id=avaliacao_sq, descritor_id=descritor_sq
+        )
+
+
+class Migration(migrations.Migration):
+    # Sem transação única: cada lote é gravado assim que termina
+    atomic = False
+
+    dependencies = [
+        ('core', '0018_respostadetalhada_descritor'),
+    ]
+
+    operations = [
+        migrations.RunPython(preencher_descritor_e_avaliacao, migrations.RunPython.noop),
+    ]
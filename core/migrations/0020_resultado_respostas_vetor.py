@@ -0,0 +1,23 @@
+# Generated by Django 6.0.1 on 2026-10-17 11:12
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0019_preencher_descritor_respostas'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='resultado',
+            name='acertos_mascara',
+            field=models.BinaryField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='resultado',
+            name='respostas_vetor',
+            field=models.TextField(blank=True, default='', editable=False),
+        ),
+    ]
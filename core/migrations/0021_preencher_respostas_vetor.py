@@ -0,0 +1,54 @@
+from django.db import migrations, transaction
+
+TAMANHO_LOTE = 1000
+
+
+def preencher_vetores(apps, schema_editor):
+    Avaliacao = apps.get_model('core', 'Avaliacao')
+    ItemGabarito = apps.get_model('core', 'ItemGabarito')
+    Resultado = apps.get_model('core', 'Resultado')
+    RespostaDetalhada = apps.get_model('core', 'RespostaDetalhada')
+
+    # Uma prova por vez: memória limitada ao tamanho de uma turma
+    for avaliacao_id in Avaliacao.objects.filter(itens_gabarito__isnull=False).distinct().values_list('id', flat=True).iterator():
+        posicoes = {
+            item_id: pos for pos, item_id in enumerate(
+                ItemGabarito.objects.filter(avaliacao_id=avaliacao_id).order_by('numero').values_list('id', flat=True)
+            )
+        }
+        respostas = {}
+        for r in RespostaDetalhada.objects.filter(resultado__avaliacao_id=avaliacao_id).values('resultado_id', 'item_gabarito_id', 'resposta_aluno', 'acertou'):
+            respostas.setdefault(r['resultado_id'], []).append(r)
+
+        alterados = []
+        for resultado in Resultado.objects.filter(avaliacao_id=avaliacao_id).only('id', 'acertos'):
+            linhas = respostas.get(resultado.id, [])
+            # Respostas antigas sem item de gabarito não têm posição: ficam no caminho legado
+            if any(r['item_gabarito_id'] not in posicoes for r in linhas):
+                continue
+            letras = ['.'] * len(posicoes)
+            mascara = bytearray((len(posicoes) + 7) // 8)
+            for r in linhas:
+                pos = posicoes[r['item_gabarito_id']]
+                letras[pos] = (r['resposta_aluno'] or '.')[:1].upper()
+                if r['acertou']:
+                    mascara[pos // 8] |= 1 << (pos % 8)
+            resultado.respostas_vetor = ''.join(letras)
+            resultado.acertos_mascara = bytes(mascara)
+            alterados.append(resultado)
+
+        with transaction.atomic():
+            Resultado.objects.bulk_update(alterados, ['respostas_vetor', 'acertos_mascara'], batch_size=TAMANHO_LOTE)
+
+
+class Migration(migrations.Migration):
+    # Sem transação única: cada prova é gravada assim que termina
+    atomic = False
+
+    dependencies = [
+        ('core', '0020_resultado_respostas_vetor'),
+    ]
+
+    operations = [
+        migrations.RunPython(preencher_vetores, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,54 @@
+from django.db import migrations, transaction
+from django.db.models import Count, Q
+
+
+def mesclar_duplicados(apps, schema_editor):
+    """
+    Antes da restrição única: deixa um Resultado por (avaliação, matrícula).
+    Fica a correção mais recente com nota (ausência só sobrevive se for a única);
+    as respostas das cópias descartadas saem junto (CASCADE).
+    """
+    Resultado = apps.get_model('core', 'Resultado')
+    RespostaDetalhada = apps.get_model('core', 'RespostaDetalhada')
+    ProficienciaItem = apps.get_model('core', 'ProficienciaItem')
+    Avaliacao = apps.get_model('core', 'Avaliacao')
+
+    duplicados = Resultado.objects.values('avaliacao_id', 'matricula_id').annotate(n=Count('id')).filter(n__gt=1).order_by()
+    afetadas = set()
+    for d in duplicados.iterator():
+        copias = list(Resultado.objects.filter(
+            avaliacao_id=d['avaliacao_id'], matricula_id=d['matricula_id']
+        ).order_by('-id').values_list('id', 'acertos'))
+        fica = next((id_ for id_, acertos in copias if acertos is not None), copias[0][0])
+        with transaction.atomic():
+            Resultado.objects.filter(id__in=[id_ for id_, _ in copias if id_ != fica]).delete()
+        afetadas.add(d['avaliacao_id'])
+
+    # Tabela-fato das provas afetadas (mesma agregação de atualizar_proficiencia)
+    for avaliacao in Avaliacao.objects.filter(id__in=afetadas).select_related('alocacao'):
+        linhas = RespostaDetalhada.objects.filter(avaliacao_id=avaliacao.id).values(
+            'item_gabarito_id', 'questao_id', 'descritor_id'
+        ).annotate(total=Count('id'), acertos=Count('id', filter=Q(acertou=True))).order_by()
+        with transaction.atomic():
+            ProficienciaItem.objects.filter(avaliacao_id=avaliacao.id).delete()
+            ProficienciaItem.objects.bulk_create([
+                ProficienciaItem(
+                    avaliacao_id=avaliacao.id, turma_id=avaliacao.alocacao.turma_id,
+                    disciplina_id=avaliacao.alocacao.disciplina_id, descritor_id=l['descritor_id'],
+                    item_gabarito_id=l['item_gabarito_id'], questao_id=l['questao_id'],
+                    total=l['total'], acertos=l['acertos'],
+                )
+                for l in linhas
+            ])
+
+
+class Migration(migrations.Migration):
+    atomic = False
+
+    dependencies = [
+        ('core', '0021_preencher_respostas_vetor'),
+    ]
+
+    operations = [
+        migrations.RunPython(mesclar_duplicados, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,17 @@
+# Generated by Django 6.0.1 on 2026-10-17 11:16
+
+from django.db import migrations
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0022_mesclar_resultados_duplicados'),
+    ]
+
+    operations = [
+        migrations.AlterUniqueTogether(
+            name='resultado',
+            unique_together={('avaliacao', 'matricula')},
+        ),
+    ]
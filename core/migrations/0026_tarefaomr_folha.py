@@ -0,0 +1,18 @@
+# Generated by Django 6.0.1 on 2026-10-17 12:48
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0025_tarefaomr'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='tarefaomr',
+            name='folha',
+            field=models.BooleanField(default=False),
+        ),
+    ]
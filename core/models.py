@@ -34,6 +34,8 @@ class Disciplina(models.Model):
 class Turma(models.Model):
     nome = models.CharField(max_length=50, help_text="Ex: 3º Ano B")
     ano_letivo = models.IntegerField(default=2026) 
+    # Contador de alterações de notas/gabaritos da turma (chave do cache do Dashboard)
+    versao_dados = models.PositiveIntegerField(default=0, editable=False)
     
     def __str__(self): return f"{self.nome} ({self.ano_letivo})"
 
@@ -222,6 +224,8 @@ class Avaliacao(models.Model):
     
     questoes = models.ManyToManyField(Questao, related_name='avaliacoes', blank=True)
     matricula = models.ForeignKey('Matricula', on_delete=models.SET_NULL, null=True, blank=True)
+    # Contador de alterações de notas/gabarito desta prova (chave do cache do Dashboard)
+    versao_dados = models.PositiveIntegerField(default=0, editable=False)
 
     def __str__(self): 
         # Ajustado o __str__ para refletir a nova estrutura
@@ -239,8 +243,53 @@ class ItemGabarito(models.Model):
     def __str__(self):
         return f"Q{self.numero} - {self.avaliacao.titulo}"
 
+    @property
+    def descritor_efetivo_id(self):
+        # O descritor do gabarito manda; sem ele, vale o da questão do banco
+        if self.descritor_id: return self.descritor_id
+        return self.questao_banco.descritor_id if self.questao_banco_id else None
+
+class ResultadoManager(models.Manager):
+    """Gravação de notas em lote (correção da turma, leitura de cartões, importações e recorreções)."""
+
+    CAMPOS_NOTA = ['total_questoes', 'acertos', 'percentual', 'status']
+
+    def gravar_em_lote(self, linhas, campos_extras=(), batch_size=1000):
+        """
+        Grava muitas notas numa tacada: INSERT ... ON CONFLICT DO UPDATE sobre (avaliação, matrícula),
+        ou bulk_update para Resultados que já vieram do banco.
+
+        `linhas` são tuplas (avaliacao, matricula, acertos, total), ou Resultados já montados
+        (a correção usa isso para levar junto o vetor de respostas, listado em `campos_extras`).
+        acertos=None continua significando aluno ausente (percentual e status ficam vazios).
+        Percentual e status são calculados aqui, antes da escrita, sem passar por save().
+        Devolve os Resultados gravados, com id.
+        """
+        resultados = []
+        for linha in linhas:
+            if not isinstance(linha, Resultado):
+                avaliacao, matricula, acertos, total = linha
+                linha = Resultado(avaliacao=avaliacao, matricula=matricula, acertos=acertos, total_questoes=total)
+            linha.calcular_desempenho()
+            resultados.append(linha)
+
+        campos = self.CAMPOS_NOTA + list(campos_extras)
+        existentes = [r for r in resultados if r.pk]
+        novos = [r for r in resultados if not r.pk]
+        if existentes:
+            self.bulk_update(existentes, campos, batch_size=batch_size)
+        if novos:
+            self.bulk_create(
+                novos, batch_size=batch_size, update_conflicts=True,
+                unique_fields=['avaliacao', 'matricula'], update_fields=campos
+            )
+        return resultados
+
+
 class Resultado(models.Model):
     STATUS_CHOICES = [('ADQ', 'Adequado'), ('INT', 'Intermediário'), ('CRI', 'Crítico'), ('MCR', 'Muito Crítico')]
+    # Faixas de desempenho (percentual mínimo, status), da maior para a menor: fonte única das notas de corte
+    FAIXAS_STATUS = [(75, 'ADQ'), (50, 'INT'), (25, 'CRI'), (0, 'MCR')]
     avaliacao = models.ForeignKey(Avaliacao, on_delete=models.CASCADE)
     matricula = models.ForeignKey(Matricula, on_delete=models.CASCADE, related_name='resultados')
     
@@ -251,7 +300,19 @@ class Resultado(models.Model):
     total_questoes = models.IntegerField()
     status = models.CharField(max_length=3, choices=STATUS_CHOICES, editable=False, null=True, blank=True)
 
-    def save(self, *args, **kwargs):
+    # 🔥 Cartão compacto: uma letra por questão na ordem do gabarito ('.' = em branco)
+    # e um bit de acerto por questão. Vazio = lançamento antigo (ler RespostaDetalhada).
+    respostas_vetor = models.TextField(blank=True, default='', editable=False)
+    acertos_mascara = models.BinaryField(null=True, blank=True, editable=False)
+
+    objects = ResultadoManager()
+
+    class Meta:
+        # Um resultado por aluno em cada prova (permite o upsert da correção)
+        unique_together = ('avaliacao', 'matricula')
+
+    def calcular_desempenho(self):
+        """Preenche percentual e status a partir de acertos (usado também nas gravações em lote)."""
         # 🛡️ BLINDAGEM: Se acertos for None (Aluno Ausente), anula o resto e não faz conta!
         if self.acertos is None:
             self.percentual = None
@@ -263,16 +324,55 @@ class Resultado(models.Model):
             else: 
                 self.percentual = 0.0
                 
-            if self.percentual >= 75: self.status = 'ADQ'
-            elif self.percentual >= 50: self.status = 'INT'
-            elif self.percentual >= 25: self.status = 'CRI'
-            else: self.status = 'MCR'
-            
+            self.status = next((status for minimo, status in self.FAIXAS_STATUS if self.percentual >= minimo), self.FAIXAS_STATUS[-1][1])
+
+    def save(self, *args, **kwargs):
+        self.calcular_desempenho()
         super().save(*args, **kwargs)
 
     def __str__(self):
         return f"Resultado: {self.matricula.aluno.nome_completo[:15]} - {self.avaliacao.titulo[:15]}"
 
+class LancamentoSincronizado(models.Model):
+    """
+    Cartões corrigidos offline que já foram aplicados, pela chave gerada no aparelho.
+    Reenviar a mesma chave (Wi-Fi caiu antes da resposta chegar) devolve o mesmo
+    resultado sem corrigir de novo.
+    """
+    chave = models.CharField(max_length=64, unique=True)
+    usuario = models.ForeignKey(User, on_delete=models.SET_NULL, null=True, blank=True, related_name='+')
+    avaliacao = models.ForeignKey(Avaliacao, on_delete=models.CASCADE, related_name='+')
+    matricula = models.ForeignKey(Matricula, on_delete=models.CASCADE, related_name='+')
+    resposta = models.JSONField(default=dict)
+    criado_em = models.DateTimeField(auto_now_add=True)
+
+    def __str__(self):
+        return f"Lançamento {self.chave} ({self.avaliacao_id}/{self.matricula_id})"
+
+class TarefaOMR(models.Model):
+    """
+    Foto de cartão na fila do leitor. A view só enfileira; quem lê é o comando
+    worker_omr, num processo à parte com o OpenCV já carregado.
+    """
+    STATUS_CHOICES = [('PENDENTE', 'Na fila'), ('LENDO', 'Lendo'), ('CONCLUIDA', 'Concluída'), ('ERRO', 'Erro')]
+
+    status = models.CharField(max_length=10, choices=STATUS_CHOICES, default='PENDENTE')
+    imagem = models.BinaryField()  # foto como veio do celular; esvaziada quando a leitura termina
+    qtd_questoes = models.PositiveIntegerField(default=10)
+    # Página do lote (corrigir_cartoes_lote): pode trazer vários cartões, resultado em 'leituras'
+    folha = models.BooleanField(default=False)
+    usuario = models.ForeignKey(User, on_delete=models.SET_NULL, null=True, blank=True, related_name='+')
+    resultado = models.JSONField(null=True, blank=True)
+    criado_em = models.DateTimeField(auto_now_add=True)
+    iniciado_em = models.DateTimeField(null=True, blank=True)
+    concluido_em = models.DateTimeField(null=True, blank=True)
+
+    class Meta:
+        indexes = [models.Index(fields=['status', 'criado_em'])]
+
+    def __str__(self):
+        return f"Tarefa OMR {self.id} ({self.get_status_display()})"
+
 class RespostaDetalhada(models.Model):
     resultado = models.ForeignKey(Resultado, on_delete=models.CASCADE, related_name='respostas_detalhadas')
     questao = models.ForeignKey(Questao, on_delete=models.SET_NULL, null=True, blank=True)
@@ -280,6 +380,50 @@ class RespostaDetalhada(models.Model):
     acertou = models.BooleanField(default=False)
     resposta_aluno = models.CharField(max_length=1, blank=True, null=True)
 
+    # 🔥 Cópias gravadas na correção para as análises não precisarem de
+    # item_gabarito__descritor / questao__descritor (mantidas por definir_gabarito)
+    avaliacao = models.ForeignKey(Avaliacao, on_delete=models.CASCADE, null=True, blank=True, related_name='+')
+    descritor = models.ForeignKey(Descritor, on_delete=models.SET_NULL, null=True, blank=True, related_name='+')
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['descritor', 'acertou']),   # Raio-X (quem errou o descritor X)
+            models.Index(fields=['avaliacao', 'descritor']), # Proficiência por prova
+        ]
+
+    def save(self, *args, **kwargs):
+        if not self.avaliacao_id and self.resultado_id:
+            self.avaliacao_id = self.resultado.avaliacao_id
+        if not self.descritor_id:
+            if self.item_gabarito_id: self.descritor_id = self.item_gabarito.descritor_efetivo_id
+            elif self.questao_id: self.descritor_id = self.questao.descritor_id
+        super().save(*args, **kwargs)
+
+class ProficienciaItem(models.Model):
+    """
+    Tabela-fato do Dashboard: acertos e respostas já somados por
+    (avaliação, turma, disciplina, descritor, item).
+    Mantida por core.services.proficiencia sempre que as notas são lançadas.
+    """
+    avaliacao = models.ForeignKey(Avaliacao, on_delete=models.CASCADE, related_name='proficiencia_itens')
+    turma = models.ForeignKey(Turma, on_delete=models.CASCADE, related_name='+')
+    disciplina = models.ForeignKey(Disciplina, on_delete=models.CASCADE, related_name='+')
+    descritor = models.ForeignKey(Descritor, on_delete=models.SET_NULL, null=True, blank=True, related_name='+')
+    item_gabarito = models.ForeignKey(ItemGabarito, on_delete=models.CASCADE, null=True, blank=True, related_name='+')
+    # Respostas antigas (sem item de gabarito) ainda apontam direto para a questão do banco
+    questao = models.ForeignKey(Questao, on_delete=models.SET_NULL, null=True, blank=True, related_name='+')
+
+    total = models.IntegerField(default=0)
+    acertos = models.IntegerField(default=0)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['turma', 'disciplina']),
+        ]
+
+    def __str__(self):
+        return f"Proficiência {self.avaliacao_id} | item {self.item_gabarito_id}: {self.acertos}/{self.total}"
+
 # ==============================================================================
 # 4. NDI (Boletim)
 # ==============================================================================
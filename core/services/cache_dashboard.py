@@ -0,0 +1,105 @@
+import functools
+import hashlib
+import json
+import time
+
+from django.core.cache import cache
+from django.db import transaction
+from django.db.models import F, Sum, Count
+
+from ..models import Avaliacao, Turma
+
+# Mesmo sem nenhuma alteração, um resultado não fica guardado mais que isso
+TEMPO_CACHE = 60 * 30
+# Quanto tempo os outros acessos esperam quem já está calculando a mesma tela
+ESPERA_CALCULO = 10
+
+
+def registrar_alteracao(avaliacao_id):
+    """
+    Incrementa o contador de versão da avaliação e da turma dela.
+    Toda gravação de Resultado, RespostaDetalhada ou ItemGabarito passa por aqui,
+    então qualquer chave de cache montada antes da gravação deixa de ser usada.
+    """
+    if not avaliacao_id:
+        return
+    Avaliacao.objects.filter(id=avaliacao_id).update(versao_dados=F('versao_dados') + 1)
+    Turma.objects.filter(alocacoes__avaliacoes__id=avaliacao_id).update(versao_dados=F('versao_dados') + 1)
+
+
+def registrar_alteracao_turma(turma_id):
+    """
+    Só o contador da turma: usado quando a avaliação está sendo apagada, porque depois
+    do delete o registrar_alteracao não acha mais a turma pela avaliação.
+    """
+    if not turma_id:
+        return
+    Turma.objects.filter(id=turma_id).update(versao_dados=F('versao_dados') + 1)
+
+
+def uma_vez_ao_confirmar(funcao, avaliacao_id):
+    """
+    Agenda funcao(avaliacao_id) para o fim da transação, uma vez só por avaliação.
+    Apagar uma turma ou um aluno dispara um post_delete por Resultado em cascata:
+    sem isso, seriam duas gravações por linha apagada em vez de uma por avaliação.
+    Fora de transação roda na hora (como o on_commit).
+    """
+    if not avaliacao_id:
+        return
+    chave = (funcao.__name__, avaliacao_id)
+    # A fila do on_commit é da conexão e some no rollback: não sobra agendamento velho
+    if any(getattr(entrada[1], 'chave_agendada', None) == chave for entrada in transaction.get_connection().run_on_commit):
+        return
+    tarefa = functools.partial(funcao, avaliacao_id)
+    tarefa.chave_agendada = chave
+    transaction.on_commit(tarefa)
+
+
+def versao_dados(avaliacao_id=None, turma_ids=None):
+    """
+    Versão dos dados visíveis num filtro do Dashboard.
+    Os contadores só crescem, então a soma muda sempre que qualquer um deles muda.
+    """
+    if avaliacao_id:
+        versao = Avaliacao.objects.filter(id=avaliacao_id).values_list('versao_dados', flat=True).first()
+        return f"a{avaliacao_id}:{versao}"
+
+    turmas = Turma.objects.all()
+    if turma_ids is not None:
+        turmas = turmas.filter(id__in=turma_ids)
+    agregado = turmas.aggregate(soma=Sum('versao_dados'), qtd=Count('id'))
+    return f"t{agregado['qtd']}:{agregado['soma'] or 0}"
+
+
+def chave_dashboard(filtros, escopo, versao):
+    """Chave única para (filtros normalizados + escopo do professor + versão dos dados)."""
+    filtros_norm = [str(f).strip() if f not in (None, '') else '' for f in filtros]
+    bruto = json.dumps([filtros_norm, escopo, versao], default=str)
+    return "dashboard:" + hashlib.sha1(bruto.encode('utf-8')).hexdigest()
+
+
+def obter_ou_calcular(chave, calcular, timeout=TEMPO_CACHE):
+    """
+    Devolve o valor em cache ou calcula uma única vez.
+    Se outro acesso já está calculando a mesma chave (onda de logins de segunda-feira),
+    espera o resultado dele em vez de repetir a mesma consulta pesada.
+    """
+    valor = cache.get(chave)
+    if valor is not None:
+        return valor
+
+    trava = chave + ":calculando"
+    if not cache.add(trava, 1, ESPERA_CALCULO):
+        limite = time.monotonic() + ESPERA_CALCULO
+        while time.monotonic() < limite:
+            time.sleep(0.1)
+            valor = cache.get(chave)
+            if valor is not None:
+                return valor
+
+    try:
+        valor = calcular()
+        cache.set(chave, valor, timeout)
+    finally:
+        cache.delete(trava)
+    return valor
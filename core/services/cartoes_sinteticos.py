@@ -0,0 +1,184 @@
+"""
+Cartões-resposta sintéticos para medir o leitor (comando benchmark_omr e testes).
+
+O cartão é desenhado com o mesmo layout de gerar_cartoes_pdf (layout_cartao), marcado a
+partir de um gabarito conhecido e depois "fotografado" com os defeitos de uma foto de
+verdade: giro, perspectiva, desfoque, sombra, mesa bagunçada, rasuras e marcações duplas.
+Cada cartão sai com a verdade por bolinha, para comparar com o que o OMRScanner leu.
+"""
+import cv2
+import numpy as np
+import qrcode
+
+from reportlab.lib.pagesizes import A4
+
+from .layout_cartao import ALTERNATIVAS, codigo_qr, layout_cartao, posicoes_na_folha
+
+AUGMENTACOES = ('giro', 'perspectiva', 'desfoque', 'sombra', 'mesa', 'rasura', 'dupla')
+FUNDO_PADRAO = (70, 90, 110)
+
+
+def desenhar_cartao(layout, qr, marcadas, px_por_ponto=4, rasuras=None, tinta=40):
+    """
+    Cartão como sai da impressora, já preenchido. `marcadas`: {questão: letra ou conjunto
+    de letras}; `rasuras`: {questão: letra} apagada com borracha (não conta como marcada).
+    """
+    rasuras = rasuras or {}
+    largura, altura = int(layout['largura'] * px_por_ponto), int(layout['altura'] * px_por_ponto)
+    img = np.full((altura, largura, 3), 255, np.uint8)
+    ponto = lambda x, y: (int(round(x * px_por_ponto)), int(round((layout['altura'] - y) * px_por_ponto)))
+    escala_fonte = px_por_ponto / 40.0
+
+    meio = layout['marcador'] / 2
+    for x, y in layout['marcadores']:
+        cv2.rectangle(img, ponto(x - meio, y + meio), ponto(x + meio, y - meio), (0, 0, 0), -1)
+
+    qx, qy, lado = layout['qr']
+    lado_px = int(lado * px_por_ponto)
+    x0, y0 = ponto(qx, qy + lado)
+    img[y0:y0 + lado_px, x0:x0 + lado_px] = np.array(qrcode.make(qr, border=0).convert('RGB').resize((lado_px, lado_px), 0))
+
+    # Cabeçalho nas mesmas posições do PDF
+    for texto, y, tamanho in (("CARTAO RESPOSTA", 25, 11), ("Aluno: Fulano de Tal", 45, 9), ("Prova: Simulado", 58, 9), ("Turma: 3A", 70, 8)):
+        cv2.putText(img, texto, ponto(35, layout['altura'] - y), cv2.FONT_HERSHEY_SIMPLEX, escala_fonte * tamanho / 9, (0, 0, 0), max(1, px_por_ponto // 3))
+
+    raio = int(layout['raio_bolinha'] * px_por_ponto)
+    for questao in layout['questoes']:
+        cv2.putText(img, f"{questao['numero']:02d}", ponto(*questao['rotulo']), cv2.FONT_HERSHEY_SIMPLEX, escala_fonte, (0, 0, 0), 1)
+        marcada = marcadas.get(questao['numero']) or ()
+        marcada = {marcada} if isinstance(marcada, str) else set(marcada)
+        for letra, (x, y) in zip(ALTERNATIVAS, questao['bolinhas']):
+            centro = ponto(x, y)
+            cv2.circle(img, centro, raio, (0, 0, 0), max(1, px_por_ponto // 3))
+            cv2.putText(img, letra, (centro[0] - raio // 3, centro[1] + raio // 3), cv2.FONT_HERSHEY_SIMPLEX, escala_fonte * 0.6, (0, 0, 0), 1)
+            if letra in marcada:
+                cv2.circle(img, centro, raio - 1, (tinta, tinta, tinta), -1)
+            elif rasuras.get(questao['numero']) == letra:
+                # Borracha: sobra um cinza claro, mais fraco que a marcação
+                cv2.circle(img, centro, raio - 1, (205, 205, 205), -1)
+    return img
+
+
+def desenhar_folha(cartoes, px_por_ponto=3):
+    """Folha A4 como sai de gerar_cartoes_pdf: até 4 cartões já desenhados (mesmo px_por_ponto) nas posições de impressão."""
+    largura, altura = int(A4[0] * px_por_ponto), int(A4[1] * px_por_ponto)
+    folha = np.full((altura, largura, 3), 255, np.uint8)
+    for cartao, (x, y) in zip(cartoes, posicoes_na_folha()):
+        h, w = cartao.shape[:2]
+        x0, y0 = int(round(x * px_por_ponto)), altura - int(round(y * px_por_ponto)) - h
+        folha[y0:y0 + h, x0:x0 + w] = cartao
+    return folha
+
+
+def fotografar(cartao, rng, giro=0.0, quartos=0, perspectiva=0.0, desfoque=0.0, sombra=0.0, mesa=False, exposicao=1.0, fundo=FUNDO_PADRAO):
+    """
+    Cartão sobre a mesa, como o celular vê: `giro` em graus, `quartos` de volta (cartão
+    deitado ou de cabeça para baixo), `perspectiva` (fração do tamanho que cada canto anda),
+    `desfoque` (sigma em px), `sombra` (0 a 1, escurecimento máximo), objetos na `mesa` e
+    `exposicao` (papel de foto raramente chega ao branco 255 do desenho).
+    """
+    if exposicao != 1.0:
+        cartao = (cartao * exposicao).astype(np.uint8)
+    altura, largura = cartao.shape[:2]
+    foto = np.full((int(altura * 1.5), int(largura * 1.5), 3), fundo, np.uint8)
+    if mesa:
+        for _ in range(25):
+            x, y = int(rng.integers(0, foto.shape[1])), int(rng.integers(0, foto.shape[0]))
+            lado = int(rng.integers(5, max(6, largura // 12)))
+            cor = tuple(int(v) for v in rng.integers(0, 255, 3))
+            cv2.rectangle(foto, (x, y), (x + lado, y + int(rng.integers(5, max(6, largura // 12)))), cor, -1)
+
+    origem = np.float32([[0, 0], [largura, 0], [largura, altura], [0, altura]])
+    dx, dy = (foto.shape[1] - largura) / 2, (foto.shape[0] - altura) / 2
+    destino = origem + np.float32([dx, dy]) + (rng.uniform(-perspectiva, perspectiva, (4, 2)) * [largura, altura]).astype(np.float32)
+    matriz = cv2.getPerspectiveTransform(origem, destino)
+    mascara = cv2.warpPerspective(np.full((altura, largura), 255, np.uint8), matriz, foto.shape[1::-1])
+    foto[mascara > 0] = cv2.warpPerspective(cartao, matriz, foto.shape[1::-1])[mascara > 0]
+
+    if giro:
+        centro = (foto.shape[1] / 2, foto.shape[0] / 2)
+        foto = cv2.warpAffine(foto, cv2.getRotationMatrix2D(centro, giro, 1), foto.shape[1::-1], borderValue=fundo)
+    if sombra:
+        # Sombra da mão/celular: escurece em degradê numa direção qualquer
+        angulo = rng.uniform(0, 2 * np.pi)
+        yy, xx = np.mgrid[0:foto.shape[0], 0:foto.shape[1]].astype(np.float32)
+        rampa = xx * np.cos(angulo) + yy * np.sin(angulo)
+        rampa = (rampa - rampa.min()) / max(float(rampa.max() - rampa.min()), 1.0)
+        foto = (foto * (1 - sombra * rampa)[..., None]).astype(np.uint8)
+    if desfoque:
+        foto = cv2.GaussianBlur(foto, (0, 0), desfoque)
+    if quartos:
+        foto = np.ascontiguousarray(np.rot90(foto, quartos))
+    return foto
+
+
+def sortear_cartao(rng, qtd_questoes, augmentacoes=AUGMENTACOES, px_por_ponto=4):
+    """Gabarito marcado e defeitos de um cartão. Devolve (marcadas, rasuras, parâmetros da foto)."""
+    marcadas, rasuras = {}, {}
+    for numero in range(1, qtd_questoes + 1):
+        sorteio = rng.random()
+        if sorteio < 0.08:
+            continue  # em branco
+        letras = list(ALTERNATIVAS)
+        escolhida = letras.pop(int(rng.integers(len(letras))))
+        if 'dupla' in augmentacoes and sorteio > 0.95:
+            marcadas[numero] = {escolhida, letras[int(rng.integers(len(letras)))]}
+        else:
+            marcadas[numero] = escolhida
+            if 'rasura' in augmentacoes and rng.random() < 0.1:
+                rasuras[numero] = letras[int(rng.integers(len(letras)))]
+
+    parametros = {
+        'giro': float(rng.uniform(-12, 12)) if 'giro' in augmentacoes else 0.0,
+        'quartos': int(rng.integers(1, 4)) if 'giro' in augmentacoes and rng.random() < 0.15 else 0,
+        'perspectiva': float(rng.uniform(0, 0.04)) if 'perspectiva' in augmentacoes else 0.0,
+        'desfoque': float(rng.uniform(0, 0.3) * px_por_ponto) if 'desfoque' in augmentacoes else 0.0,
+        'sombra': float(rng.uniform(0, 0.5)) if 'sombra' in augmentacoes else 0.0,
+        'mesa': bool(rng.random() < 0.5) if 'mesa' in augmentacoes else False,
+        'exposicao': float(rng.uniform(0.8, 0.97)),
+    }
+    return marcadas, rasuras, parametros
+
+
+def gerar_corpus(qtd, qtd_questoes=20, semente=0, augmentacoes=AUGMENTACOES, px_por_ponto=4):
+    """
+    Gera `qtd` fotos de cartão reproduzíveis pela `semente`. Cada item:
+    {'indice', 'jpg', 'qr', 'verdade': {questão: conjunto de letras marcadas}, 'rasuras', 'parametros'}.
+    """
+    rng = np.random.default_rng(semente)
+    layout = layout_cartao(qtd_questoes)
+    for indice in range(qtd):
+        marcadas, rasuras, parametros = sortear_cartao(rng, qtd_questoes, augmentacoes, px_por_ponto)
+        qr = codigo_qr(1, indice + 1, qtd_questoes)
+        cartao = desenhar_cartao(layout, qr, marcadas, px_por_ponto, rasuras, tinta=int(rng.integers(20, 80)))
+        foto = fotografar(cartao, rng, **parametros)
+        verdade = {n: ({m} if isinstance(m, str) else set(m)) for n, m in marcadas.items()}
+        yield {
+            'indice': indice, 'jpg': cv2.imencode('.jpg', foto, [cv2.IMWRITE_JPEG_QUALITY, 90])[1].tobytes(),
+            'qr': qr, 'verdade': verdade, 'rasuras': rasuras, 'parametros': parametros,
+        }
+
+
+def conferir_leitura(verdade, respostas, qtd_questoes):
+    """
+    Compara a leitura com a verdade. Por questão: certa se a letra bate (ou "NULA" numa
+    marcação dupla, ou nada numa questão em branco). Por bolinha: verdadeiros/falsos
+    positivos e falsos negativos. "NULA" não diz quais bolinhas estavam cheias: numa
+    dupla de verdade conta como acerto das duas; fora disso, como uma bolinha a mais.
+    """
+    contagem = {'questoes': qtd_questoes, 'certas': 0, 'vp': 0, 'fp': 0, 'fn': 0}
+    respostas = {int(n): r for n, r in (respostas or {}).items()}
+    for numero in range(1, qtd_questoes + 1):
+        marcada = verdade.get(numero, set())
+        lida = respostas.get(numero)
+        if lida == 'NULA':
+            lidas = set(marcada) if len(marcada) > 1 else set(marcada) | {'?'}
+            certa = len(marcada) > 1
+        else:
+            lidas = {lida} if lida else set()
+            certa = lidas == marcada
+        contagem['certas'] += certa
+        contagem['vp'] += len(lidas & marcada)
+        contagem['fp'] += len(lidas - marcada)
+        contagem['fn'] += len(marcada - lidas)
+    return contagem
@@ -0,0 +1,385 @@
+from django.db import IntegrityError, transaction
+from django.db.models import Exists, OuterRef
+from django.db.models.functions import Upper
+
+from ..models import Avaliacao, ItemGabarito, LancamentoSincronizado, Matricula, Resultado, RespostaDetalhada
+from .proficiencia import atualizar_proficiencia
+from .vetor_respostas import ANULADA, empacotar, letras_marcadas, simbolo
+
+# Campos da resposta que a correção pode mudar (o resto identifica a linha)
+CAMPOS_RESPOSTA = ['resposta_aluno', 'acertou', 'questao', 'descritor', 'avaliacao']
+ATRIBUTOS_RESPOSTA = ['resposta_aluno', 'acertou', 'questao_id', 'descritor_id', 'avaliacao_id']
+LIMITE_ATUALIZACAO = 200  # acima disso as respostas alteradas são regravadas em vez de atualizadas
+CAMPOS_VETOR = ['respostas_vetor', 'acertos_mascara']
+AUSENTE = '-'
+
+
+def contar_provas_lancadas(avaliacao):
+    """Contador do topo da tela de lançamento (alunos cursando com resultado nesta prova)."""
+    return Resultado.objects.filter(
+        avaliacao=avaliacao, matricula__turma=avaliacao.alocacao.turma, matricula__status='CURSANDO'
+    ).count()
+
+
+def carregar_gabarito(avaliacao):
+    """Gabarito em memória, na ordem das questões (com a questão do banco para o descritor efetivo)."""
+    return list(ItemGabarito.objects.filter(avaliacao=avaliacao).select_related('questao_banco').order_by('numero'))
+
+
+def versao_lancamento(gabarito, respostas, lancado=True):
+    """
+    Assinatura do que está gravado para um aluno, para o aparelho saber se outro
+    corrigiu o mesmo cartão: '' sem lançamento, '-' ausente, senão uma letra por questão.
+    A tela calcula a mesma assinatura do lado dela.
+    """
+    if not lancado: return ''
+    if respostas is None: return AUSENTE
+    return ''.join(simbolo(respostas.get(str(item.numero))) for item in gabarito)
+
+
+def montar_sessao_lancamento(avaliacao, gabarito, matriculas):
+    """
+    Tudo o que a tela de lançamento precisa para corrigir a turma inteira sem voltar ao servidor:
+    o gabarito, os alunos e o que cada um já tem lançado. Uma consulta de Resultados
+    (mais uma só para lançamentos antigos, sem vetor), seja a turma de 5 ou de 45.
+    """
+    resultados = {
+        r.matricula_id: r for r in Resultado.objects.filter(avaliacao=avaliacao, matricula__in=[m.id for m in matriculas])
+    }
+    marcadas = letras_marcadas(resultados.values(), gabarito)
+
+    alunos = {}
+    for m in matriculas:
+        r = resultados.get(m.id)
+        ausente = r is not None and r.acertos is None
+        respostas = marcadas.get(r.id, {}) if r else {}
+        alunos[str(m.aluno_id)] = {
+            'matricula_id': m.id,
+            'lancado': r is not None,
+            'ausente': ausente,
+            'acertos': r.acertos if r else None,
+            'respostas': respostas,
+            'versao': versao_lancamento(gabarito, None if ausente else respostas, lancado=r is not None),
+        }
+    return {
+        'avaliacao_id': avaliacao.id,
+        'gabarito': [{'numero': item.numero, 'correta': item.resposta_correta} for item in gabarito],
+        'alunos': alunos,
+    }
+
+
+def mesclar_alteracoes(avaliacao, matricula, gabarito, alteracoes):
+    """
+    A tela manda só as questões que mudaram ({numero: letra}, '' apaga a marcação).
+    Junta com o que já está gravado para o aluno e devolve as respostas completas.
+    """
+    atual = Resultado.objects.filter(avaliacao=avaliacao, matricula=matricula).first()
+    respostas = letras_marcadas([atual], gabarito).get(atual.id, {}) if atual else {}
+    respostas.update({str(k): v for k, v in alteracoes.items()})
+    return respostas
+
+
+def sincronizar_respostas(desejadas):
+    """
+    Grava as respostas por DIFERENÇA em vez de apagar e recriar tudo.
+
+    `desejadas` é {resultado: [RespostaDetalhada não salvas, uma por item marcado]}.
+    As respostas atuais desses resultados são lidas numa consulta; só as linhas que
+    mudaram são atualizadas, só as que faltam são inseridas e só as que sobraram
+    (questão apagada pelo professor, ou aluno marcado como ausente) são removidas.
+    Corrigir uma bolinha custa uma linha gravada, não a prova inteira.
+    """
+    if not desejadas:
+        return
+    atuais = {}
+    sobras = []
+    for r in RespostaDetalhada.objects.filter(resultado__in=list(desejadas)).order_by('id'):
+        chave = (r.resultado_id, r.item_gabarito_id)
+        # Respostas antigas sem item de gabarito ou duplicadas não têm par: saem
+        if r.item_gabarito_id is None or chave in atuais: sobras.append(r.id)
+        else: atuais[chave] = r
+
+    novas, alteradas = [], []
+    for resultado, objs in desejadas.items():
+        for obj in objs:
+            atual = atuais.pop((resultado.id, obj.item_gabarito_id), None)
+            if atual is None:
+                obj.resultado = resultado
+                novas.append(obj)
+                continue
+            if any(getattr(atual, attr) != getattr(obj, attr) for attr in ATRIBUTOS_RESPOSTA):
+                obj.resultado = resultado
+                alteradas.append((atual, obj))
+
+    sobras += [r.id for r in atuais.values()]
+    if len(alteradas) > LIMITE_ATUALIZACAO:
+        # Reimportação da turma inteira: o UPDATE com CASE por linha fica quadrático,
+        # apagar e reinserir as linhas que mudaram sai bem mais barato (nada aponta para elas)
+        sobras += [atual.id for atual, _ in alteradas]
+        novas += [obj for _, obj in alteradas]
+        alteradas = []
+    for atual, obj in alteradas:
+        for attr in ATRIBUTOS_RESPOSTA: setattr(atual, attr, getattr(obj, attr))
+    if sobras: RespostaDetalhada.objects.filter(id__in=sobras).delete()
+    if alteradas: RespostaDetalhada.objects.bulk_update([atual for atual, _ in alteradas], CAMPOS_RESPOSTA, batch_size=1000)
+    if novas: RespostaDetalhada.objects.bulk_create(novas, batch_size=1000)
+
+
+def gravar_correcoes(avaliacao, gabarito, linhas):
+    """
+    Corrige e grava uma lista de (matricula, respostas) da mesma prova.
+    `respostas` é {numero: letra}, ou None para aluno ausente.
+    Devolve os Resultados gravados, na mesma ordem (a mesma matrícula repetida vale o último).
+
+    Os Resultados vão para o banco pelo Resultado.objects.gravar_em_lote (um único
+    INSERT ... ON CONFLICT DO UPDATE): nada é lido antes, e dois aplicadores corrigindo
+    o mesmo cartão ao mesmo tempo não criam resultado duplicado.
+    """
+    linhas = list({matricula.id: (matricula, respostas) for matricula, respostas in linhas}.values())
+
+    resultados = []
+    for matricula, respostas in linhas:
+        resultado = Resultado(avaliacao=avaliacao, matricula=matricula, total_questoes=len(gabarito))
+
+        objs = []
+        if respostas is None:
+            resultado.acertos = None
+        else:
+            respostas = {str(k): (v or '').strip().upper() for k, v in respostas.items()}
+            for item in gabarito:
+                letra = respostas.get(str(item.numero), '')
+                if not letra: continue
+                if len(letra) > 1: letra = ANULADA  # 'NULA'/'MULTIPLA' do scanner: cabe na coluna de 1 letra
+                objs.append(RespostaDetalhada(
+                    item_gabarito=item, questao=item.questao_banco,
+                    acertou=(letra == item.resposta_correta.upper()), resposta_aluno=letra,
+                    avaliacao=avaliacao, descritor_id=item.descritor_efetivo_id
+                ))
+            resultado.acertos = sum(1 for o in objs if o.acertou)
+
+        resultado.respostas_vetor, resultado.acertos_mascara = empacotar(gabarito, respostas)
+        resultados.append((resultado, objs))
+
+    with transaction.atomic():
+        Resultado.objects.gravar_em_lote([r for r, _ in resultados], campos_extras=CAMPOS_VETOR)
+        sincronizar_respostas({resultado: objs for resultado, objs in resultados})
+
+    # Tabela-fato + versão do cache do Dashboard (bulk não dispara sinais)
+    atualizar_proficiencia(avaliacao.id)
+    return [r for r, _ in resultados]
+
+
+def corrigir_turma(avaliacao, lancamentos):
+    """
+    Corrige vários alunos da mesma prova de uma vez.
+
+    `lancamentos` é uma lista de dicts {'aluno_id', 'respostas': {numero: letra}, 'ausente'}.
+    O gabarito é lido uma única vez e tudo é gravado numa transação com operações em lote,
+    seja a turma de 5 ou de 45 alunos.
+
+    Devolve (lista por aluno, provas_lancadas). Alunos sem matrícula ativa voltam com erro
+    e não impedem a gravação dos demais.
+    """
+    gabarito = carregar_gabarito(avaliacao)
+    if not gabarito:
+        raise ValueError('Defina o gabarito antes de lançar notas.')
+
+    # O mesmo aluno enviado duas vezes no lote: vale o último lançamento
+    lancamentos = list({str(l.get('aluno_id')): l for l in lancamentos}.values())
+    matriculas = {
+        str(m.aluno_id): m for m in Matricula.objects.filter(
+            aluno_id__in=[l.get('aluno_id') for l in lancamentos], turma=avaliacao.alocacao.turma, status='CURSANDO'
+        )
+    }
+
+    linhas, saida = [], []
+    for lanc in lancamentos:
+        matricula = matriculas.get(str(lanc.get('aluno_id')))
+        if matricula:
+            linhas.append((matricula, None if lanc.get('ausente') else (lanc.get('respostas') or {})))
+
+    gravados = {r.matricula_id: r for r in gravar_correcoes(avaliacao, gabarito, linhas)} if linhas else {}
+
+    for lanc in lancamentos:
+        matricula = matriculas.get(str(lanc.get('aluno_id')))
+        if not matricula:
+            saida.append({'aluno_id': lanc.get('aluno_id'), 'sucesso': False, 'erro': 'Matrícula ativa não encontrada.'})
+            continue
+        resultado = gravados[matricula.id]
+        saida.append({
+            'aluno_id': lanc.get('aluno_id'), 'sucesso': True, 'is_ausente': resultado.acertos is None,
+            'acertos': resultado.acertos, 'percentual': resultado.percentual, 'status': resultado.status,
+        })
+    return saida, contar_provas_lancadas(avaliacao)
+
+
+def recorrigir_avaliacoes(avaliacao_ids):
+    """
+    Corrige de novo tudo o que já foi lançado nessas provas depois que o gabarito mudou
+    (inclusive as provas irmãs que receberam o gabarito replicado).
+
+    Um UPDATE regrava o `acertou` de todas as respostas contra o gabarito atual; depois as
+    respostas são lidas uma vez para refazer acertos e o vetor compacto de cada Resultado;
+    só os que mudaram vão para Resultado.objects.gravar_em_lote.
+    Devolve quantos Resultados mudaram.
+    """
+    avaliacao_ids = list(avaliacao_ids)
+    gabaritos = {}
+    for item in ItemGabarito.objects.filter(avaliacao_id__in=avaliacao_ids).order_by('numero'):
+        gabaritos.setdefault(item.avaliacao_id, []).append(item)
+
+    with transaction.atomic():
+        RespostaDetalhada.objects.filter(avaliacao_id__in=avaliacao_ids, item_gabarito__isnull=False).update(
+            acertou=Exists(ItemGabarito.objects.annotate(correta=Upper('resposta_correta')).filter(
+                id=OuterRef('item_gabarito_id'), correta=Upper(OuterRef('resposta_aluno'))
+            ))
+        )
+
+        marcadas = {}
+        for r in RespostaDetalhada.objects.filter(avaliacao_id__in=avaliacao_ids).values_list(
+            'resultado_id', 'item_gabarito_id', 'resposta_aluno'
+        ):
+            marcadas.setdefault(r[0], []).append(r)
+
+        alterados = []
+        for resultado in Resultado.objects.filter(avaliacao_id__in=avaliacao_ids):
+            gabarito = gabaritos.get(resultado.avaliacao_id, [])
+            numeros = {item.id: str(item.numero) for item in gabarito}
+            linhas = marcadas.get(resultado.id, [])
+            respostas = {numeros[item_id]: (letra or '').upper() for _, item_id, letra in linhas if item_id in numeros}
+            # Lançamento antigo, sem nenhuma resposta ligada ao gabarito atual: não há o que recorrigir
+            if linhas and not respostas:
+                continue
+
+            mascara = resultado.acertos_mascara
+            antes = (resultado.total_questoes, resultado.acertos, resultado.respostas_vetor, None if mascara is None else bytes(mascara))
+            resultado.total_questoes = len(gabarito)
+            if resultado.acertos is None:
+                resultado.respostas_vetor, resultado.acertos_mascara = empacotar(gabarito, None)
+            else:
+                resultado.respostas_vetor, resultado.acertos_mascara = empacotar(gabarito, respostas)
+                resultado.acertos = sum(bin(b).count('1') for b in resultado.acertos_mascara)
+            if antes != (resultado.total_questoes, resultado.acertos, resultado.respostas_vetor, resultado.acertos_mascara):
+                alterados.append(resultado)
+
+        Resultado.objects.gravar_em_lote(alterados, campos_extras=CAMPOS_VETOR)
+
+    # Tabela-fato + versão do cache do Dashboard de cada prova
+    for avaliacao_id in avaliacao_ids:
+        atualizar_proficiencia(avaliacao_id)
+    return len(alterados)
+
+
+def sincronizar_lancamentos(cartoes, usuario=None):
+    """
+    Aplica a fila de cartões corrigidos offline na tela de lançamento.
+
+    Cada cartão é {'chave', 'avaliacao_id', 'aluno_id', 'alteracoes': {numero: letra}, 'ausente', 'base'}:
+    `chave` é gerada no aparelho (idempotência) e `base` é a versão que o aparelho tinha do aluno.
+    Tudo numa transação. Devolve (lista por cartão, {avaliacao_id: provas_lancadas}); o status é
+    'aplicado', 'repetido' (chave já aplicada antes), 'conflito' (outro aparelho mudou o aluno
+    depois da base; vem junto o que está no servidor) ou 'erro'.
+    """
+    cartoes = [c for c in cartoes if c.get('chave')]
+    chaves = [str(c['chave'])[:64] for c in cartoes]
+
+    saida = {}
+    grupos = {}
+    provas_lancadas = {}
+    with transaction.atomic():
+        ja_aplicados = {l.chave: l.resposta for l in LancamentoSincronizado.objects.filter(chave__in=chaves)}
+        for chave, cartao in zip(chaves, cartoes):
+            if chave in saida: continue  # mesma chave duas vezes no lote
+            if chave in ja_aplicados:
+                saida[chave] = dict(ja_aplicados[chave], chave=chave, status='repetido')
+            else:
+                saida[chave] = None
+                grupos.setdefault(str(cartao.get('avaliacao_id')), []).append((chave, cartao))
+
+        for avaliacao_id, lote in grupos.items():
+            avaliacao = Avaliacao.objects.select_related('alocacao').filter(id=avaliacao_id).first() if avaliacao_id.isdigit() else None
+            gabarito = carregar_gabarito(avaliacao) if avaliacao else []
+            if not gabarito:
+                erro = 'Avaliação não encontrada.' if not avaliacao else 'Defina o gabarito antes de lançar notas.'
+                saida.update({chave: {'chave': chave, 'status': 'erro', 'erro': erro} for chave, _ in lote})
+                continue
+
+            matriculas = {
+                str(m.aluno_id): m for m in Matricula.objects.filter(
+                    aluno_id__in=[c.get('aluno_id') for _, c in lote], turma=avaliacao.alocacao.turma, status='CURSANDO'
+                )
+            }
+            # Trava os resultados desses alunos até o fim da transação (outro aparelho espera)
+            resultados = {
+                r.matricula_id: r for r in Resultado.objects.select_for_update().filter(
+                    avaliacao=avaliacao, matricula__in=list(matriculas.values())
+                )
+            }
+            marcadas = letras_marcadas(resultados.values(), gabarito)
+            # Estado atual de cada aluno: (versão, respostas ou None se ausente); vai mudando ao longo do lote
+            estado = {}
+            for m_id, r in resultados.items():
+                respostas = None if r.acertos is None else marcadas.get(r.id, {})
+                estado[m_id] = (versao_lancamento(gabarito, respostas), respostas)
+
+            linhas, aplicados = {}, []
+            for chave, cartao in lote:
+                matricula = matriculas.get(str(cartao.get('aluno_id')))
+                if not matricula:
+                    saida[chave] = {'chave': chave, 'status': 'erro', 'erro': 'Matrícula ativa não encontrada.'}
+                    continue
+                versao, respostas = estado.get(matricula.id, ('', {}))
+                if str(cartao.get('base') or '') != versao:
+                    saida[chave] = {
+                        'chave': chave, 'status': 'conflito', 'aluno_id': matricula.aluno_id,
+                        'servidor': {'versao': versao, 'lancado': versao != '', 'ausente': respostas is None, 'respostas': respostas or {}},
+                    }
+                    continue
+
+                if cartao.get('ausente'):
+                    novas = None
+                else:
+                    novas = dict(respostas or {})
+                    novas.update({str(k): (v or '').strip().upper() for k, v in (cartao.get('alteracoes') or {}).items()})
+                    novas = {k: v for k, v in novas.items() if v}
+                estado[matricula.id] = (versao_lancamento(gabarito, novas), novas)
+                linhas[matricula.id] = (matricula, novas)
+                aplicados.append((chave, matricula))
+
+            gravados = {r.matricula_id: r for r in gravar_correcoes(avaliacao, gabarito, list(linhas.values()))} if linhas else {}
+            registros = []
+            for chave, matricula in aplicados:
+                resultado = gravados[matricula.id]
+                resposta = {
+                    'aluno_id': matricula.aluno_id, 'versao': estado[matricula.id][0],
+                    'is_ausente': resultado.acertos is None, 'acertos': resultado.acertos,
+                }
+                saida[chave] = dict(resposta, chave=chave, status='aplicado')
+                registros.append(LancamentoSincronizado(
+                    chave=chave, usuario=usuario, avaliacao=avaliacao, matricula=matricula, resposta=resposta
+                ))
+            _registrar_chaves(registros, saida)
+            provas_lancadas[avaliacao.id] = contar_provas_lancadas(avaliacao)
+
+    return [saida[chave] for chave in dict.fromkeys(chaves)], provas_lancadas
+
+
+def _registrar_chaves(registros, saida):
+    """
+    Grava as chaves aplicadas. Dois reenvios simultâneos da mesma chave passam juntos pela
+    consulta inicial; o segundo a gravar bate na chave única. Sem savepoint isso desfaria o
+    lote inteiro: aqui só aquela chave vira 'repetido', com a resposta que o primeiro gravou.
+    """
+    try:
+        with transaction.atomic():
+            LancamentoSincronizado.objects.bulk_create(registros)
+        return
+    except IntegrityError:
+        pass
+    for registro in registros:
+        try:
+            with transaction.atomic():
+                registro.save()
+        except IntegrityError:
+            anterior = LancamentoSincronizado.objects.filter(chave=registro.chave).values_list('resposta', flat=True).first()
+            saida[registro.chave] = dict(anterior or registro.resposta, chave=registro.chave, status='repetido')
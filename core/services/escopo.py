@@ -0,0 +1,38 @@
+from django.db.models import Exists, OuterRef
+
+from ..models import Alocacao
+
+
+def perfil_professor(request):
+    """Perfil de professor do usuário logado, ou None (gestão/admin enxerga tudo)."""
+    return getattr(request.user, 'professor_perfil', None) if request.user.is_authenticated else None
+
+
+def pares_escopo(request):
+    """
+    Pares (turma_id, disciplina_id) que o professor enxerga, resolvidos uma única vez
+    por requisição. Devolve None para quem não é professor (sem restrição).
+    """
+    if not hasattr(request, '_pares_escopo'):
+        perfil = perfil_professor(request)
+        request._pares_escopo = None if perfil is None else sorted(
+            Alocacao.objects.filter(professor=perfil).values_list('turma_id', 'disciplina_id')
+        )
+    return request._pares_escopo
+
+
+def filtrar_escopo(queryset, request, turma='alocacao__turma', disciplina='alocacao__disciplina'):
+    """
+    Restringe o queryset às turmas+disciplinas do professor (o "poder compartilhado":
+    provas de colegas da mesma turma e matéria também aparecem).
+
+    Um único EXISTS contra Alocacao, em vez de um OR com uma cláusula por alocação.
+    `turma` e `disciplina` são os caminhos até esses campos a partir do modelo filtrado
+    (ex.: 'avaliacao__alocacao__turma' para Resultado, 'turma' para ProficienciaItem).
+    """
+    perfil = perfil_professor(request)
+    if perfil is None:
+        return queryset
+    return queryset.filter(Exists(
+        Alocacao.objects.filter(professor=perfil, turma_id=OuterRef(turma), disciplina_id=OuterRef(disciplina))
+    ))
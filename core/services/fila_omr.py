@@ -0,0 +1,127 @@
+"""
+Fila de leitura de cartões no banco (TarefaOMR).
+
+A view do aplicador decodifica a foto só para a triagem de qualidade (checar_foto),
+enfileira e espera pouco pelo resultado; a leitura de verdade (QR, marcadores,
+bolinhas) roda no comando worker_omr, longe dos workers do gunicorn. Assim um cartão
+difícil não segura o atendimento de ninguém: se a leitura demora, a tela consulta
+depois (api_resultado_leitura) em vez de prender o worker esperando.
+"""
+import time
+from datetime import timedelta
+
+from django.utils import timezone
+
+from ..models import TarefaOMR
+
+ESPERA_CONSULTA = 0.25  # intervalo entre as consultas enquanto a view aguarda
+ESPERA_LOTE = 1.0  # intervalo entre as consultas do lote (páginas demoram mais que um cartão)
+TRAVADA_APOS = timedelta(minutes=5)  # LENDO há mais tempo que isso = worker caiu no meio
+GUARDAR_POR = timedelta(days=1)  # tarefas concluídas somem depois disso
+
+
+def enfileirar(imagem, qtd_questoes, usuario=None):
+    """Grava a foto (bytes, como veio do upload) na fila."""
+    return TarefaOMR.objects.create(
+        imagem=imagem, qtd_questoes=qtd_questoes,
+        usuario=usuario if usuario is not None and usuario.is_authenticated else None,
+    )
+
+
+def enfileirar_paginas(paginas, qtd_questoes, usuario=None):
+    """Páginas do lote [(rótulo, bytes)] na fila, na ordem do arquivo. Devolve {tarefa_id: rótulo}."""
+    usuario = usuario if usuario is not None and usuario.is_authenticated else None
+    tarefas = TarefaOMR.objects.bulk_create([
+        TarefaOMR(imagem=conteudo, qtd_questoes=qtd_questoes, folha=True, usuario=usuario) for _, conteudo in paginas
+    ])
+    return {tarefa.id: rotulo for tarefa, (rotulo, _) in zip(tarefas, paginas)}
+
+
+def acompanhar(tarefa_ids, timeout):
+    """
+    (id, resultado) de cada tarefa conforme o worker termina; as que passarem de `timeout`
+    segundos no total saem com resultado None. A view só consulta o banco: nada de OpenCV aqui.
+    """
+    faltam, limite = set(tarefa_ids), time.monotonic() + timeout
+    while faltam:
+        prontas = TarefaOMR.objects.filter(id__in=faltam, status__in=['CONCLUIDA', 'ERRO']).values_list('id', 'resultado')
+        for tarefa_id, resultado in prontas:
+            faltam.discard(tarefa_id)
+            yield tarefa_id, resultado
+        if faltam and time.monotonic() >= limite:
+            for tarefa_id in sorted(faltam):
+                yield tarefa_id, None
+            return
+        if faltam:
+            time.sleep(ESPERA_LOTE)
+
+
+def aguardar(tarefa_id, timeout):
+    """Resultado da tarefa se ficar pronto em até `timeout` segundos; senão None (a tela consulta depois)."""
+    limite = time.monotonic() + timeout
+    while True:
+        linha = TarefaOMR.objects.filter(id=tarefa_id).values('status', 'resultado').first()
+        if linha is None or linha['status'] in ('CONCLUIDA', 'ERRO'):
+            return linha and linha['resultado']
+        if time.monotonic() >= limite:
+            return None
+        time.sleep(ESPERA_CONSULTA)
+
+
+def reservar(limite):
+    """
+    Pega até `limite` tarefas pendentes, as mais antigas primeiro. A troca PENDENTE -> LENDO
+    é um UPDATE condicional: com vários workers, cada tarefa fica com um só (vale em
+    qualquer banco, sem SELECT ... FOR UPDATE).
+    """
+    reservadas = []
+    candidatas = TarefaOMR.objects.filter(status='PENDENTE').order_by('criado_em').values_list('id', flat=True)[:limite * 2]
+    for tarefa_id in candidatas:
+        if len(reservadas) >= limite:
+            break
+        if TarefaOMR.objects.filter(id=tarefa_id, status='PENDENTE').update(status='LENDO', iniciado_em=timezone.now()):
+            reservadas.append(tarefa_id)
+    return list(TarefaOMR.objects.filter(id__in=reservadas).order_by('criado_em').values_list('id', 'imagem', 'qtd_questoes', 'folha'))
+
+
+def concluir(tarefa_id, resultado, erro=False):
+    """Guarda o resultado e descarta a foto."""
+    TarefaOMR.objects.filter(id=tarefa_id).update(
+        status='ERRO' if erro else 'CONCLUIDA', resultado=resultado, imagem=b'', concluido_em=timezone.now(),
+    )
+
+
+def devolver(tarefa_ids):
+    """Tarefas reservadas que não chegaram a ser lidas (pool do worker caiu) voltam para a fila."""
+    return TarefaOMR.objects.filter(id__in=tarefa_ids, status='LENDO').update(status='PENDENTE', iniciado_em=None)
+
+
+def recuperar_travadas():
+    """Tarefas que ficaram em LENDO (worker reiniciado no meio) voltam para a fila."""
+    return TarefaOMR.objects.filter(status='LENDO', iniciado_em__lt=timezone.now() - TRAVADA_APOS).update(status='PENDENTE', iniciado_em=None)
+
+
+def limpar_antigas():
+    return TarefaOMR.objects.filter(status__in=['CONCLUIDA', 'ERRO'], concluido_em__lt=timezone.now() - GUARDAR_POR).delete()[0]
+
+
+def iniciar_processo(threads_opencv):
+    """Roda uma vez em cada processo do worker: fixa as threads do OpenCV e já deixa tudo carregado."""
+    import cv2
+    import numpy as np
+    from .omr_scanner import OMRScanner
+
+    cv2.setNumThreads(threads_opencv)
+    OMRScanner(debug_mode=False).processar_cartao(np.full((600, 400, 3), 255, np.uint8), checar_qualidade=False)
+
+
+def ler_tarefa(tarefa):
+    """Roda num processo do worker: só OpenCV, nada de banco. Devolve (id, resultado)."""
+    from .omr_scanner import OMRScanner
+
+    tarefa_id, imagem, qtd_questoes, folha = tarefa
+    if folha:
+        # Página do lote: um resultado por cartão encontrado nela
+        return tarefa_id, {'sucesso': True, 'leituras': OMRScanner().processar_folha(bytes(imagem), qtd_questoes=qtd_questoes)}
+    # A view já fez a triagem de qualidade antes de enfileirar
+    return tarefa_id, OMRScanner().processar_cartao(bytes(imagem), qtd_questoes=qtd_questoes, checar_qualidade=False)
@@ -0,0 +1,156 @@
+import re
+import unicodedata
+
+import numpy as np
+import pandas as pd
+
+from ..models import Matricula, Resultado
+from .correcao import gravar_correcoes
+
+COLUNAS_MATRICULA = {'matricula', 'matr', 'id', 'id matricula', 'cod matricula'}
+COLUNAS_CHAMADA = {'chamada', 'n chamada', 'numero chamada', 'numero de chamada', 'n', 'no', 'nº', 'num'}
+COLUNAS_NOME = {'nome', 'nome completo', 'aluno', 'estudante', 'nome do aluno', 'nome do estudante'}
+COLUNAS_AUSENTE = {'ausente', 'faltou', 'falta'}
+MARCAS_SIM = {'S', 'SIM', 'X', '1', 'TRUE', 'VERDADEIRO'}
+
+# "1", "Q1", "Questão 01", "item 3", "1. Qual é a capital..." (cabeçalho do Google Forms)
+REGEX_QUESTAO = re.compile(r'^(?:q|questao|item)?\s*[-_.]?\s*0*(\d+)(?:\D|$)')
+
+
+def normalizar_nome(texto):
+    """Sem acento, minúsculo e com espaços simples: 'JOÃO  da Silva ' == 'joao da silva'."""
+    if texto is None or (isinstance(texto, float) and pd.isna(texto)): return ''
+    sem_acento = ''.join(c for c in unicodedata.normalize('NFD', str(texto)) if unicodedata.category(c) != 'Mn')
+    return ' '.join(sem_acento.lower().replace('.', ' ').split())
+
+
+def _inteiro(valor):
+    try:
+        return int(float(str(valor).strip()))
+    except (TypeError, ValueError):
+        return None
+
+
+def mapear_colunas(df, gabarito):
+    """Descobre as colunas de identificação e a coluna de cada questão do gabarito."""
+    colunas = {'matricula': None, 'chamada': None, 'nome': None, 'ausente': None, 'questoes': {}}
+    numeros = {item.numero for item in gabarito}
+    for coluna in df.columns:
+        nome = normalizar_nome(coluna)
+        if nome in COLUNAS_MATRICULA and not colunas['matricula']: colunas['matricula'] = coluna
+        elif nome in COLUNAS_CHAMADA and not colunas['chamada']: colunas['chamada'] = coluna
+        elif nome in COLUNAS_NOME and not colunas['nome']: colunas['nome'] = coluna
+        elif nome in COLUNAS_AUSENTE and not colunas['ausente']: colunas['ausente'] = coluna
+        else:
+            achou = REGEX_QUESTAO.match(nome)
+            if achou and int(achou.group(1)) in numeros:
+                colunas['questoes'].setdefault(int(achou.group(1)), coluna)
+    return colunas
+
+
+def preparar_importacao(df, avaliacao, gabarito):
+    """
+    Confere a planilha sem gravar nada (a pré-visualização).
+
+    Cada linha é ligada a uma matrícula da turma pelo id da matrícula, pelo número de chamada
+    ou pelo nome normalizado, nessa ordem. A correção da planilha inteira é feita de uma vez
+    (letras x gabarito como tabela), sem laço por questão.
+
+    Devolve {'linhas': [...para a tela...], 'validas': [(matricula_id, respostas ou None)],
+    'resumo': {...}, 'erro': mensagem se a planilha não serve}.
+    """
+    colunas = mapear_colunas(df, gabarito)
+    if not colunas['questoes']:
+        return {'erro': 'Nenhuma coluna de questão encontrada (use cabeçalhos como 1, 2, 3 ou Q1, Q2, Q3).'}
+    if not (colunas['matricula'] or colunas['chamada'] or colunas['nome']):
+        return {'erro': 'A planilha precisa de uma coluna MATRICULA, CHAMADA ou NOME para identificar o aluno.'}
+
+    if avaliacao.matricula_id:
+        matriculas = list(Matricula.objects.filter(id=avaliacao.matricula_id).select_related('aluno'))
+    else:
+        matriculas = list(Matricula.objects.filter(turma=avaliacao.alocacao.turma, status='CURSANDO').select_related('aluno'))
+    por_id = {m.id: m for m in matriculas}
+    por_chamada = {m.numero_chamada: m for m in matriculas if m.numero_chamada is not None}
+    por_nome = {}
+    for m in matriculas:
+        por_nome.setdefault(normalizar_nome(m.aluno.nome_completo), []).append(m)
+
+    # 🧮 Correção vetorizada: uma tabela alunos x questões comparada com a linha do gabarito
+    ordem = [item for item in gabarito if item.numero in colunas['questoes']]
+    marcas = df[[colunas['questoes'][item.numero] for item in ordem]].copy()
+    marcas.columns = [str(item.numero) for item in ordem]
+    marcas = marcas.fillna('').astype(str).apply(lambda c: c.str.strip().str.upper().replace({'NAN': ''}))
+    corretas = pd.Series({str(item.numero): item.resposta_correta.strip().upper() for item in ordem})
+    acertos = marcas.eq(corretas).sum(axis=1)
+    preenchidas = marcas.ne('').sum(axis=1)
+    percentuais = acertos / len(gabarito) * 100
+    # Mesmas faixas do Resultado.calcular_desempenho, que é quem grava o status de verdade
+    faixas = Resultado.FAIXAS_STATUS
+    status = np.select([percentuais >= minimo for minimo, _ in faixas], [s for _, s in faixas], faixas[-1][1])
+    ausentes = (
+        df[colunas['ausente']].fillna('').astype(str).str.strip().str.upper().isin(MARCAS_SIM)
+        if colunas['ausente'] else pd.Series(False, index=df.index)
+    )
+
+    linhas, validas, usadas = [], [], {}
+    for pos, (indice, registro) in enumerate(df.iterrows()):
+        numero_linha = pos + 2  # linha 1 é o cabeçalho
+        linha = {'linha': numero_linha, 'identificacao': '', 'aluno': None, 'criterio': None, 'erro': None}
+
+        matricula = None
+        mat_id = _inteiro(registro[colunas['matricula']]) if colunas['matricula'] else None
+        chamada = _inteiro(registro[colunas['chamada']]) if colunas['chamada'] else None
+        nome = normalizar_nome(registro[colunas['nome']]) if colunas['nome'] else ''
+        if mat_id is not None and mat_id in por_id:
+            matricula, linha['criterio'], linha['identificacao'] = por_id[mat_id], 'matrícula', str(mat_id)
+        elif chamada is not None and chamada in por_chamada:
+            matricula, linha['criterio'], linha['identificacao'] = por_chamada[chamada], 'nº de chamada', str(chamada)
+        elif nome:
+            linha['identificacao'] = str(registro[colunas['nome']]).strip()
+            candidatos = por_nome.get(nome, [])
+            if len(candidatos) == 1:
+                matricula, linha['criterio'] = candidatos[0], 'nome'
+            elif candidatos:
+                linha['erro'] = 'Nome repetido na turma: use a matrícula ou o nº de chamada.'
+        else:
+            linha['identificacao'] = str(mat_id or chamada or '')
+
+        ausente = bool(ausentes.loc[indice])
+        if not matricula and not linha['erro']:
+            linha['erro'] = 'Aluno não encontrado nesta turma.'
+        elif matricula and matricula.id in usadas:
+            linha['erro'] = f"Aluno repetido (já aparece na linha {usadas[matricula.id]})."
+        elif matricula and not ausente and not preenchidas.loc[indice]:
+            linha['erro'] = 'Linha sem nenhuma resposta (marque a coluna AUSENTE se o aluno faltou).'
+
+        if matricula:
+            linha['aluno'] = matricula.aluno.nome_completo
+        if not linha['erro']:
+            usadas[matricula.id] = numero_linha
+            respostas = None if ausente else {k: v for k, v in marcas.loc[indice].items() if v}
+            validas.append((matricula.id, respostas))
+            linha.update({
+                'ausente': ausente,
+                'acertos': None if ausente else int(acertos.loc[indice]),
+                'percentual': None if ausente else round(float(percentuais.loc[indice]), 1),
+                'status': None if ausente else str(status[pos]),
+            })
+        linhas.append(linha)
+
+    return {
+        'linhas': linhas,
+        'validas': validas,
+        'resumo': {
+            'total': len(linhas), 'validas': len(validas), 'com_erro': len(linhas) - len(validas),
+            'questoes_encontradas': len(ordem), 'questoes_gabarito': len(gabarito),
+            'sem_lancamento': len(matriculas) - len(validas),
+        },
+        'erro': None,
+    }
+
+
+def aplicar_importacao(avaliacao, gabarito, validas):
+    """Grava as linhas aprovadas na pré-visualização, todas de uma vez (ver gravar_correcoes)."""
+    matriculas = Matricula.objects.in_bulk([m_id for m_id, _ in validas])
+    linhas = [(matriculas[m_id], respostas) for m_id, respostas in validas if m_id in matriculas]
+    return gravar_correcoes(avaliacao, gabarito, linhas) if linhas else []
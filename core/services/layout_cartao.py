@@ -0,0 +1,104 @@
+"""
+Geometria do cartão-resposta, compartilhada entre quem desenha (gerar_cartoes_pdf)
+e quem lê (OMRScanner).
+
+Tudo em pontos de PDF, relativo ao canto inferior esquerdo do cartão (y para cima,
+como no ReportLab). A versão vai impressa no QR Code: se o desenho mudar, cria-se uma
+versão nova aqui e os cartões antigos continuam legíveis.
+"""
+import re
+
+from reportlab.lib.pagesizes import A4
+from reportlab.lib.units import cm
+
+VERSAO_ATUAL = 1
+ALTERNATIVAS = ['A', 'B', 'C', 'D', 'E']
+
+# Folha A4 com 4 cartões (2 x 2)
+MARGEM_FOLHA = 1 * cm
+LARGURA_CARTAO = (A4[0] - 3 * MARGEM_FOLHA) / 2
+ALTURA_CARTAO = (A4[1] - 3 * MARGEM_FOLHA) / 2
+
+# Quadrados pretos dos cantos (referência para endireitar a foto)
+TAMANHO_MARCADOR = 15
+RECUO_MARCADOR = 10
+
+# Grade de questões: 2 colunas de 15; a 16ª linha já cairia em cima do QR e dos marcadores do pé
+LIMITE_COLUNA_1 = 15
+MAX_QUESTOES = 2 * LIMITE_COLUNA_1
+PASSO_LINHA = 16
+PASSO_ALTERNATIVA = 14
+RAIO_BOLINHA = 5.5
+LADO_QR = 45
+
+# "A39-M559" (cartões antigos) ou "A39-M559-L1-Q30"
+REGEX_QR = re.compile(r'A(\d+)-M(\d+)(?:-L(\d+))?(?:-Q(\d+))?')
+
+
+def posicoes_na_folha():
+    """Canto inferior esquerdo de cada um dos 4 cartões da folha, na ordem de impressão."""
+    largura, altura = A4
+    return [
+        (MARGEM_FOLHA, altura - MARGEM_FOLHA - ALTURA_CARTAO),
+        (MARGEM_FOLHA + LARGURA_CARTAO + MARGEM_FOLHA, altura - MARGEM_FOLHA - ALTURA_CARTAO),
+        (MARGEM_FOLHA, MARGEM_FOLHA),
+        (MARGEM_FOLHA + LARGURA_CARTAO + MARGEM_FOLHA, MARGEM_FOLHA),
+    ]
+
+
+def layout_cartao(total_questoes, versao=VERSAO_ATUAL):
+    """
+    Descritor do cartão: tamanho, marcadores, QR e o centro de cada bolinha.
+
+    {'versao', 'largura', 'altura', 'raio_bolinha',
+     'marcadores': [(x, y) do centro: sup. esq., sup. dir., inf. dir., inf. esq.],
+     'marcador': lado, 'qr': (x, y, lado),
+     'questoes': [{'numero', 'rotulo': (x, y), 'bolinhas': [(x, y) por alternativa]}]}
+    """
+    if versao != 1:
+        raise ValueError(f"Layout de cartão desconhecido: versão {versao}")
+    if total_questoes > MAX_QUESTOES:
+        raise ValueError(f"O cartão-resposta comporta até {MAX_QUESTOES} questões; a prova tem {total_questoes}.")
+
+    largura, altura = LARGURA_CARTAO, ALTURA_CARTAO
+    meio = RECUO_MARCADOR + TAMANHO_MARCADOR / 2
+    marcadores = [(meio, altura - meio), (largura - meio, altura - meio), (largura - meio, meio), (meio, meio)]
+
+    y_inicio = altura - 95
+    x_col1 = 30
+    x_col2 = largura / 2 + 10
+    questoes = []
+    for numero in range(1, total_questoes + 1):
+        if numero <= LIMITE_COLUNA_1:
+            x, y = x_col1, y_inicio - (numero - 1) * PASSO_LINHA
+        else:
+            x, y = x_col2, y_inicio - (numero - LIMITE_COLUNA_1 - 1) * PASSO_LINHA
+        questoes.append({
+            'numero': numero,
+            'rotulo': (x, y),
+            'bolinhas': [(x + 25 + i * PASSO_ALTERNATIVA, y + 3) for i in range(len(ALTERNATIVAS))],
+        })
+
+    return {
+        'versao': versao, 'largura': largura, 'altura': altura, 'raio_bolinha': RAIO_BOLINHA,
+        'marcadores': marcadores, 'marcador': TAMANHO_MARCADOR,
+        # QR no pé, centralizado: longe dos marcadores e abaixo da última linha de bolinhas
+        'qr': ((largura - LADO_QR) / 2, 8, LADO_QR),
+        'questoes': questoes,
+    }
+
+
+def codigo_qr(avaliacao_id, matricula_id, total_questoes, versao=VERSAO_ATUAL):
+    return f"A{avaliacao_id}-M{matricula_id}-L{versao}-Q{total_questoes}"
+
+
+def ler_codigo_qr(codigo):
+    """'A39-M559-L1-Q30' -> {'avaliacao_id': 39, 'matricula_id': 559, 'versao': 1, 'total_questoes': 30}."""
+    achou = REGEX_QR.search(codigo or '')
+    if not achou:
+        return None
+    avaliacao_id, matricula_id, versao, total = achou.groups()
+    return {
+        'avaliacao_id': int(avaliacao_id), 'matricula_id': int(matricula_id),
+        'versao': int(versao) if versao else None, 'total_questoes': int(total) if total else None,
+    }
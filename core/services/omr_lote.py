@@ -0,0 +1,202 @@
+import io
+import os
+import zipfile
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+from ..models import Avaliacao, Matricula
+from . import fila_omr
+from .correcao import carregar_gabarito, gravar_correcoes
+from .layout_cartao import ler_codigo_qr
+from .omr_scanner import OMRScanner
+
+EXTENSOES_IMAGEM = ('.jpg', '.jpeg', '.png', '.bmp', '.tif', '.tiff', '.webp')
+LIMITE_PAGINAS = 300  # uma turma grande com folga; protege contra ZIP/PDF gigante
+# ZIP descompactado (tamanho declarado no índice, conferido antes de ler): contra ZIP-bomba
+LIMITE_BYTES_IMAGEM = 20 * 1024 * 1024  # uma foto de celular boa fica em 3 a 8 MB
+LIMITE_BYTES_LOTE = 400 * 1024 * 1024
+QTD_QUESTOES_PADRAO = 30
+
+
+def extrair_paginas(nome, conteudo):
+    """
+    Transforma o arquivo enviado numa lista de (rótulo, bytes da imagem), uma por cartão.
+
+    Aceita PDF de várias páginas (o da copiadora/scanner: cada página carrega a foto
+    digitalizada, que é extraída direto, sem rasterizar), ZIP de fotos ou uma foto solta.
+    """
+    nome = (nome or '').lower()
+    if nome.endswith('.pdf'):
+        from pypdf import PdfReader
+        paginas = []
+        for numero, pagina in enumerate(PdfReader(io.BytesIO(conteudo)).pages, 1):
+            imagens = list(pagina.images)
+            # Página sem foto (ex.: o PDF de cartões em branco) segue vazia e vira erro na leitura
+            maior = max(imagens, key=lambda img: len(img.data)) if imagens else None
+            paginas.append((f"Página {numero}", maior.data if maior else b''))
+    elif nome.endswith('.zip'):
+        with zipfile.ZipFile(io.BytesIO(conteudo)) as pacote:
+            membros = sorted(
+                (m for m in pacote.infolist()
+                 if m.filename.lower().endswith(EXTENSOES_IMAGEM) and not os.path.basename(m.filename).startswith('.')),
+                key=lambda m: m.filename
+            )
+            if len(membros) > LIMITE_PAGINAS:
+                raise ValueError(f"O arquivo tem {len(membros)} imagens; o limite por envio é {LIMITE_PAGINAS}.")
+            grande = next((m for m in membros if m.file_size > LIMITE_BYTES_IMAGEM), None)
+            if grande:
+                raise ValueError(f"A imagem {os.path.basename(grande.filename)} passa de {LIMITE_BYTES_IMAGEM // 2**20} MB.")
+            if sum(m.file_size for m in membros) > LIMITE_BYTES_LOTE:
+                raise ValueError(f"As imagens descompactadas passam de {LIMITE_BYTES_LOTE // 2**20} MB; divida o envio.")
+            # O ZipExtFile não entrega mais que o file_size declarado, então os limites acima valem
+            paginas = [(os.path.basename(m.filename), pacote.read(m)) for m in membros]
+    elif nome.endswith(EXTENSOES_IMAGEM):
+        paginas = [(os.path.basename(nome), conteudo)]
+    else:
+        raise ValueError("Formato não suportado: envie um PDF, um ZIP de fotos ou uma imagem.")
+
+    if not paginas:
+        raise ValueError("Nenhuma página ou imagem encontrada no arquivo.")
+    if len(paginas) > LIMITE_PAGINAS:
+        raise ValueError(f"O arquivo tem {len(paginas)} páginas; o limite por envio é {LIMITE_PAGINAS}.")
+    return paginas
+
+
+def _ler_pagina(tarefa):
+    """
+    Roda num processo do pool: só OpenCV, nada de banco. Uma leitura por cartão da página
+    (a folha impressa por gerar_cartoes_pdf traz 4), cada uma com o seu rótulo.
+    """
+    rotulo, conteudo, qtd_questoes = tarefa
+    if not conteudo:
+        return [{'pagina': rotulo, 'sucesso': False, 'erro': 'Página sem imagem digitalizada.'}]
+    return _rotular(rotulo, OMRScanner().processar_folha(conteudo, qtd_questoes=qtd_questoes))
+
+
+def _rotular(rotulo, leituras):
+    """Página com vários cartões: 'Página 3 · cartão 2' (a posição na folha); com um só, o rótulo da página."""
+    for numero, leitura in enumerate(leituras, 1):
+        leitura['pagina'] = f"{rotulo} · cartão {leitura.get('posicao') or numero}" if len(leituras) > 1 else rotulo
+    return leituras
+
+
+def ler_paginas(paginas, qtd_questoes=QTD_QUESTOES_PADRAO, workers=None):
+    """
+    Lê as páginas em paralelo (ProcessPoolExecutor: a visão computacional é CPU pura e
+    não escala com threads por causa do GIL). Devolve, conforme cada página fica pronta,
+    a lista de leituras dos cartões dela.
+    """
+    tarefas = [(rotulo, conteudo, qtd_questoes) for rotulo, conteudo in paginas]
+    workers = min(workers or os.cpu_count() or 1, len(tarefas))
+    if workers <= 1:
+        for tarefa in tarefas:
+            yield _ler_pagina(tarefa)
+        return
+
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        futuros = {pool.submit(_ler_pagina, tarefa): tarefa[0] for tarefa in tarefas}
+        for futuro in as_completed(futuros):
+            try:
+                yield futuro.result()
+            except Exception as e:
+                yield [{'pagina': futuros[futuro], 'sucesso': False, 'erro': f"Falha ao processar: {e}"}]
+
+
+def ler_paginas_na_fila(paginas, qtd_questoes=QTD_QUESTOES_PADRAO, usuario=None, timeout=600):
+    """
+    Mesmo contrato de ler_paginas, mas quem lê é o worker_omr (TarefaOMR): o processo web
+    só enfileira e consulta o banco. Página que não ficar pronta em `timeout` segundos
+    volta como erro (a tarefa segue na fila e é limpa depois pelo worker).
+    """
+    vazias = [[{'pagina': rotulo, 'sucesso': False, 'erro': 'Página sem imagem digitalizada.'}]
+              for rotulo, conteudo in paginas if not conteudo]
+    yield from vazias
+    rotulos = fila_omr.enfileirar_paginas([p for p in paginas if p[1]], qtd_questoes, usuario)
+    for tarefa_id, resultado in fila_omr.acompanhar(list(rotulos), timeout):
+        if resultado is None:
+            yield [{'pagina': rotulos[tarefa_id], 'sucesso': False, 'erro': 'A leitura demorou demais (worker_omr parado?).'}]
+        elif 'leituras' in resultado:
+            yield _rotular(rotulos[tarefa_id], resultado['leituras'])
+        else:
+            yield [{'pagina': rotulos[tarefa_id], 'sucesso': False, 'erro': resultado.get('erro') or 'Falha na leitura.'}]
+
+
+def aplicar_leituras(leituras, avaliacao=None):
+    """
+    Liga cada leitura à matrícula pelo QR e grava todas as correções de uma vez
+    (um gravar_correcoes por prova). Com `avaliacao`, cartões de outra prova são recusados.
+
+    Devolve um status por página: corrigido, sem_qr, outra_avaliacao, matricula_invalida,
+    repetido, sem_gabarito ou erro.
+    """
+    status = []
+    for leitura in leituras:
+        qr = ler_codigo_qr(leitura.get('qr_code')) or {}
+        av_id, mat_id = qr.get('avaliacao_id'), qr.get('matricula_id')
+        status.append({
+            'pagina': leitura.get('pagina'), 'avaliacao_id': av_id, 'matricula_id': mat_id,
+            'respostas': leitura.get('respostas') or {}, 'status': None, 'aluno': None,
+            'acertos': None, 'erro': None if leitura.get('sucesso') else leitura.get('erro'),
+        })
+
+    for s in status:
+        if s['erro']: s['status'] = 'erro'
+        elif not s['matricula_id']: s['status'], s['erro'] = 'sem_qr', 'QR Code não encontrado ou ilegível.'
+        elif avaliacao and s['avaliacao_id'] != avaliacao.id:
+            s['status'], s['erro'] = 'outra_avaliacao', f"Cartão da avaliação {s['avaliacao_id']}."
+
+    pendentes = [s for s in status if not s['status']]
+    avaliacoes = Avaliacao.objects.select_related('alocacao').in_bulk({s['avaliacao_id'] for s in pendentes})
+    matriculas = Matricula.objects.select_related('aluno').in_bulk({s['matricula_id'] for s in pendentes})
+
+    por_avaliacao, vistos = {}, set()
+    for s in pendentes:
+        av, mat = avaliacoes.get(s['avaliacao_id']), matriculas.get(s['matricula_id'])
+        if not av or not mat or (mat.id != av.matricula_id if av.matricula_id else mat.turma_id != av.alocacao.turma_id):
+            s['status'], s['erro'] = 'matricula_invalida', 'O aluno do QR não faz esta prova.'
+            continue
+        s['aluno'] = mat.aluno.nome_completo
+        if (av.id, mat.id) in vistos:
+            s['status'], s['erro'] = 'repetido', 'Cartão repetido no lote (vale o primeiro).'
+            continue
+        vistos.add((av.id, mat.id))
+        por_avaliacao.setdefault(av.id, []).append((s, mat))
+
+    for av_id, linhas in por_avaliacao.items():
+        gabarito = carregar_gabarito(avaliacoes[av_id])
+        if not gabarito:
+            for s, _ in linhas: s['status'], s['erro'] = 'sem_gabarito', 'A prova ainda não tem gabarito.'
+            continue
+        resultados = gravar_correcoes(avaliacoes[av_id], gabarito, [(mat, s['respostas']) for s, mat in linhas])
+        for (s, _), resultado in zip(linhas, resultados):
+            s['status'], s['acertos'], s['total'] = 'corrigido', resultado.acertos, resultado.total_questoes
+    return status
+
+
+def corrigir_lote(paginas, avaliacao=None, workers=None, fila=False, usuario=None, timeout=600):
+    """
+    Lote completo, como eventos para ir mostrando na tela: um {'tipo': 'leitura'} por
+    cartão assim que o pool termina a página dele ('lidas'/'total' contam páginas), depois
+    um {'tipo': 'correcao'} por cartão e o {'tipo': 'resumo'} final, quando tudo já foi gravado.
+
+    Com `fila`, as páginas vão para o worker_omr em vez de um pool aberto aqui.
+    """
+    qtd_questoes = (len(carregar_gabarito(avaliacao)) if avaliacao else 0) or QTD_QUESTOES_PADRAO
+    if fila:
+        por_pagina = ler_paginas_na_fila(paginas, qtd_questoes, usuario, timeout)
+    else:
+        por_pagina = ler_paginas(paginas, qtd_questoes, workers)
+    leituras = []
+    for lidas, da_pagina in enumerate(por_pagina, 1):
+        leituras += da_pagina
+        for leitura in da_pagina:
+            yield {
+                'tipo': 'leitura', 'pagina': leitura.get('pagina'), 'lidas': lidas, 'total': len(paginas),
+                'sucesso': bool(leitura.get('sucesso')), 'qr_code': leitura.get('qr_code'), 'erro': leitura.get('erro'),
+            }
+
+    contagem = {}
+    for s in aplicar_leituras(leituras, avaliacao):
+        contagem[s['status']] = contagem.get(s['status'], 0) + 1
+        s.pop('respostas')
+        yield {'tipo': 'correcao', **s}
+    yield {'tipo': 'resumo', 'total': len(leituras), 'corrigidos': contagem.get('corrigido', 0), 'por_status': contagem}
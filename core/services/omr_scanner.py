@@ -1,18 +1,115 @@
 import cv2
 import numpy as np
+import itertools
+import logging
 import os
-from pyzbar.pyzbar import decode
+import queue
+import random
+import threading
+import time
+import uuid
+from django.conf import settings
+from pyzbar.pyzbar import ZBarSymbol, decode
+from reportlab.lib.pagesizes import A4
+
+from .layout_cartao import ALTERNATIVAS, ALTURA_CARTAO, LARGURA_CARTAO, VERSAO_ATUAL, layout_cartao, ler_codigo_qr, posicoes_na_folha
+
+logger = logging.getLogger(__name__)
+
+KERNEL_MIOLO = np.ones((4, 4), np.uint8)  # erosão que descarta o contorno impresso da bolinha
+MARGEM_ROI = 4  # >= tamanho do kernel: a borda do recorte não interfere na erosão
+
+# Leitura pelo layout impresso: o cartão é endireitado para PX_POR_PONTO pixels por ponto de PDF
+PX_POR_PONTO = 3
+LADO_BUSCA_MARCADORES = 800  # maior lado da cópia reduzida onde os marcadores são procurados
+MARCADORES_POR_CANTO = 5  # candidatos mais perto de cada canto: no máximo 5**4 combinações conferidas em bloco
+# Miolo do cartão (entre os centros dos marcadores) numa miniatura de 21x61, só para ver se é papel
+MIOLO_REFERENCIA = np.float32([[0, 0], [20, 0], [20, 60], [0, 60]])
+# Triagem da foto antes da leitura (medidas numa miniatura de LADO_MINIATURA_QUALIDADE)
+LADO_MINIMO_FOTO = 400  # menor lado, em pixels: abaixo disso as bolinhas somem
+LADO_MINIATURA_QUALIDADE = 640
+NITIDEZ_MINIMA = 100  # variância do Laplaciano; cartões legíveis ficam bem acima de 250
+REFLEXO_MAXIMO = 0.05  # fração do papel estourada (>= 250) num papel que não é todo branco
+LADO_BUSCA_QR = 1000  # maior lado da miniatura onde o QR é procurado primeiro
+FOLGA_RECORTE_QR = 0.2  # margem em volta do cartão estimado pelo QR (fração do tamanho)
+QR_DE_CARTAO_SOZINHO = 0.065  # lado do QR / maior lado da foto: na folha A4 com 4 cartões fica em ~0,05
+FOLGA_RECORTE_FOLHA = 0.08  # só 1 cm entre cartões vizinhos: folga curta para não pegar os marcadores do lado
+TINTA_MINIMA_CARTAO = 0.005  # fração escura da posição na folha a partir da qual há cartão impresso ali
+LIMIAR_MARCADA = 0.45  # fração pintada do miolo a partir da qual a bolinha conta como marcada
+
+
+class _GravadorDebug:
+    """
+    Grava as imagens de depuração numa thread própria: a leitura do cartão nunca espera o disco.
+    Fila cheia = imagem descartada (depuração não pode segurar a correção).
+    """
+    def __init__(self, tamanho_fila=32):
+        self.fila = queue.Queue(maxsize=tamanho_fila)
+        self.thread = None
+        self.trava = threading.Lock()
+
+    def enviar(self, caminho, img):
+        with self.trava:
+            if self.thread is None or not self.thread.is_alive():
+                self.thread = threading.Thread(target=self._trabalhar, name='omr-debug', daemon=True)
+                self.thread.start()
+        try:
+            self.fila.put_nowait((caminho, img))
+        except queue.Full:
+            pass
+
+    def _trabalhar(self):
+        while True:
+            caminho, img = self.fila.get()
+            try:
+                os.makedirs(os.path.dirname(caminho), exist_ok=True)
+                cv2.imwrite(caminho, img)
+            except Exception as e:
+                logger.warning("Falha ao gravar imagem de depuração %s: %s", caminho, e)
+            finally:
+                self.fila.task_done()
+
+
+gravador_debug = _GravadorDebug()
+
 
 class OMRScanner:
-    def __init__(self, debug_mode=True):
-        self.debug = debug_mode
-        self.debug_dir = "media/temp/debug"
-        if self.debug:
-            os.makedirs(self.debug_dir, exist_ok=True)
+    def __init__(self, debug_mode=None, amostra_debug=None):
+        # Padrão vem do settings (OMR_DEBUG, desligado); a amostra diz que fração dos cartões gera imagens
+        self.debug = getattr(settings, 'OMR_DEBUG', False) if debug_mode is None else debug_mode
+        self.amostra_debug = getattr(settings, 'OMR_DEBUG_AMOSTRA', 0.1) if amostra_debug is None else amostra_debug
+        self.debug_dir = getattr(settings, 'OMR_DEBUG_DIR', "media/temp/debug")
+        self._prefixo_debug = None
+        self.tempos = {}  # ms por etapa do último cartão lido (benchmark_omr)
+        self._ultima_marca = None
+
+    def _marcar(self, etapa):
+        """Soma em self.tempos[etapa] o tempo desde a marca anterior."""
+        agora = time.perf_counter()
+        self.tempos[etapa] = self.tempos.get(etapa, 0.0) + (agora - self._ultima_marca) * 1000
+        self._ultima_marca = agora
 
     def _salvar_debug(self, nome, img):
-        if self.debug:
-            cv2.imwrite(os.path.join(self.debug_dir, nome), img)
+        if self._prefixo_debug:
+            gravador_debug.enviar(os.path.join(self.debug_dir, f"{self._prefixo_debug}_{nome}"), img)
+
+    def _carregar_imagem(self, origem):
+        """
+        Decodifica o cartão em memória: bytes, arquivo enviado (UploadedFile), buffer NumPy
+        ou imagem já decodificada. Caminho (str) ainda é aceito para uso avulso.
+        """
+        if isinstance(origem, np.ndarray) and origem.ndim >= 2:
+            return origem
+        if isinstance(origem, (str, os.PathLike)):
+            return cv2.imread(os.fspath(origem))
+        if hasattr(origem, 'chunks'):
+            origem = b''.join(origem.chunks())
+        elif hasattr(origem, 'read'):
+            origem = origem.read()
+        buffer = np.frombuffer(origem, dtype=np.uint8) if not isinstance(origem, np.ndarray) else origem
+        if buffer.size == 0:
+            return None
+        return cv2.imdecode(buffer, cv2.IMREAD_COLOR)
 
     def _ordenar_pontos(self, pts):
         rect = np.zeros((4, 2), dtype="float32")
@@ -45,21 +142,334 @@ class OMRScanner:
         M = cv2.getPerspectiveTransform(rect, dst)
         return cv2.warpPerspective(image, M, (maxWidth, maxHeight))
 
-    def processar_cartao(self, image_path, qtd_questoes=30, alternativas=5):
-        print(f"🚀 OMR DEFINITIVO - {image_path}")
-        
-        image = cv2.imread(image_path)
-        if image is None: return {"sucesso": False, "erro": "Imagem inválida"}
+    def _preenchimento(self, thresh, bolinha):
+        """
+        Fração pintada do miolo da bolinha, medida só no recorte dela (e não na página inteira).
+        A margem de MARGEM_ROI px deixa a erosão igual à feita na imagem toda.
+        """
+        c, x, y, w, h = bolinha
+        x0, y0 = max(x - MARGEM_ROI, 0), max(y - MARGEM_ROI, 0)
+        x1, y1 = min(x + w + MARGEM_ROI, thresh.shape[1]), min(y + h + MARGEM_ROI, thresh.shape[0])
 
-        # 1. QR Code (Mantém a lógica robusta do SAMI: A39-M559)
-        dados_qr = None
-        try:
-            decodes = decode(image)
-            if decodes:
-                dados_qr = decodes[0].data.decode("utf-8")
-        except Exception as e:
-            pass
+        # 1. Máscara da bolinha inteira, já no sistema de coordenadas do recorte
+        mask = np.zeros((y1 - y0, x1 - x0), dtype="uint8")
+        cv2.drawContours(mask, [c], -1, 255, -1, offset=(-x0, -y0))
+
+        # 2. O SEGREDO: Corrói as beiradas da máscara! (Exclui a linha grossa do gabarito)
+        mask = cv2.erode(mask, KERNEL_MIOLO, iterations=1)
+
+        # 3. Lê apenas os pixels que sobraram no miolo absoluto
+        area_mascara = cv2.countNonZero(mask)
+        if not area_mascara:
+            return 0
+        return cv2.countNonZero(cv2.bitwise_and(thresh[y0:y1, x0:x1], mask)) / float(area_mascara)
+
+    def _decidir_linha(self, preenchimentos):
+        """Uma questão: letra marcada, "NULA" (duas ou mais) ou None (em branco)."""
+        ordem = sorted(range(len(preenchimentos)), key=lambda j: preenchimentos[j], reverse=True)
+        if not ordem or preenchimentos[ordem[0]] <= LIMIAR_MARCADA:
+            return None
+        if len(ordem) > 1 and preenchimentos[ordem[1]] > LIMIAR_MARCADA:
+            return "NULA"
+        return ALTERNATIVAS[ordem[0]]
+
+    def _ler_qr(self, image):
+        """
+        (texto do QR, 4 cantos do símbolo na ordem do próprio QR: sup. esq., sup. dir.,
+        inf. dir., inf. esq.) ou (None, None).
+
+        Decodifica numa miniatura (LADO_BUSCA_QR); se ela não der conta, o detector do
+        OpenCV só localiza o QR e o pyzbar lê o recorte na resolução original. A foto
+        inteira em resolução cheia fica como último recurso.
+        """
+        escala = min(1.0, LADO_BUSCA_QR / float(max(image.shape[:2])))
+        miniatura = cv2.resize(image, None, fx=escala, fy=escala, interpolation=cv2.INTER_AREA) if escala < 1 else image
+        detector = cv2.QRCodeDetector()
+
+        achados = decode(miniatura)
+        if achados:
+            return achados[0].data.decode("utf-8"), self._cantos_do_qr(detector, miniatura, achados[0].rect, escala)
+
+        ok, cantos = detector.detect(miniatura)
+        if ok and cantos is not None:
+            cantos = cantos.reshape(4, 2) / escala
+            x0, y0 = np.maximum(cantos.min(axis=0) - (cantos.max(axis=0) - cantos.min(axis=0)) / 2, 0).astype(int)
+            x1, y1 = (cantos.max(axis=0) + (cantos.max(axis=0) - cantos.min(axis=0)) / 2).astype(int)
+            achados = decode(image[y0:y1, x0:x1])
+            if achados:
+                return achados[0].data.decode("utf-8"), cantos
+
+        achados = decode(image)
+        if achados:
+            return achados[0].data.decode("utf-8"), None
+        return None, None
+
+    def _cantos_do_qr(self, detector, miniatura, r, escala):
+        """
+        O pyzbar não informa a orientação; o detector do OpenCV, no recorte do QR, informa.
+        QR pequeno (folha digitalizada, JPEG) às vezes só fecha no recorte ampliado 2x.
+        """
+        folga = max(r.width, r.height) // 2
+        x0, y0 = max(r.left - folga, 0), max(r.top - folga, 0)
+        recorte = miniatura[y0:r.top + r.height + folga, x0:r.left + r.width + folga]
+        ok, cantos = detector.detect(recorte)
+        if not ok or cantos is None:
+            ok, cantos = detector.detect(cv2.resize(recorte, None, fx=2, fy=2, interpolation=cv2.INTER_CUBIC))
+            cantos = cantos / 2 if ok and cantos is not None else None
+        return (cantos.reshape(4, 2) + (x0, y0)) / escala if cantos is not None else None
+
+    def _ler_qrs(self, image):
+        """
+        Todos os QRs da folha com vários cartões: [(texto, cantos ou None)], de cima para
+        baixo e da esquerda para a direita. Cada QR ocupa pouco da folha, então a busca é na
+        resolução cheia; se faltar cartão, uma segunda passada na imagem binarizada recupera
+        os QRs borrados que o pyzbar perde no cinza.
+        """
+        gray = cv2.cvtColor(image, cv2.COLOR_BGR2GRAY)
+        achados = {a.data: a for a in decode(gray, symbols=[ZBarSymbol.QRCODE])}
+        if len(achados) < len(posicoes_na_folha()):
+            binaria = cv2.adaptiveThreshold(gray, 255, cv2.ADAPTIVE_THRESH_MEAN_C, cv2.THRESH_BINARY, 31, 10)
+            for a in decode(binaria, symbols=[ZBarSymbol.QRCODE]):
+                achados.setdefault(a.data, a)
+        # Mesma fileira de cartões = QRs na mesma altura (tolerância de dois QRs)
+        ordem = sorted(achados.values(), key=lambda a: (round(a.rect.top / (2 * max(a.rect.height, 1))), a.rect.left))
+        detector = cv2.QRCodeDetector()
+        cantos = [self._cantos_do_qr(detector, gray, a.rect, 1.0) for a in ordem]
+
+        # O detector do OpenCV às vezes não fecha um QR que o pyzbar leu. A folha gira inteira:
+        # o polígono do pyzbar, girado como os QRs vizinhos, dá os cantos na ordem do QR
+        vizinho = next((c for c in cantos if c is not None), None)
+        if vizinho is not None:
+            quartos = self._quartos_do_qr(vizinho)
+            for i, a in enumerate(ordem):
+                if cantos[i] is None and len(a.polygon) == 4:
+                    cantos[i] = np.roll(self._ordenar_pontos(np.float32(a.polygon)), -quartos, axis=0)
+        return [(a.data.decode("utf-8"), c) for a, c in zip(ordem, cantos)]
+
+    def _quartos_do_qr(self, cantos_qr):
+        """Quartos de volta (0 a 3) do topo do QR em relação ao topo da foto."""
+        dx, dy = cantos_qr[1] - cantos_qr[0]
+        return int(round(np.degrees(np.arctan2(dy, dx)) / 90.0)) % 4
+
+    def _orientar(self, image, cantos_qr):
+        """Gira a foto em múltiplos de 90° até o QR ficar de pé (cartão de cabeça para baixo ou deitado)."""
+        if cantos_qr is None:
+            return image, None
+        quartos = self._quartos_do_qr(cantos_qr)
+        if not quartos:
+            return image, cantos_qr
+        h, w = image.shape[:2]
+        x, y = cantos_qr[:, 0], cantos_qr[:, 1]
+        # Topo do QR apontando para baixo (90°), para a esquerda (180°) ou para cima (270°)
+        if quartos == 1:
+            return cv2.rotate(image, cv2.ROTATE_90_COUNTERCLOCKWISE), np.stack([y, w - 1 - x], axis=1)
+        if quartos == 2:
+            return cv2.rotate(image, cv2.ROTATE_180), np.stack([w - 1 - x, h - 1 - y], axis=1)
+        return cv2.rotate(image, cv2.ROTATE_90_CLOCKWISE), np.stack([h - 1 - y, x], axis=1)
+
+    def _recortar_pelo_qr(self, image, cantos_qr, layout, folga=FOLGA_RECORTE_QR):
+        """
+        Só a região do cartão, estimada pela posição do QR no layout (com `folga` para a
+        perspectiva). Mesa, mãos e outros papéis ficam de fora antes de qualquer limiarização.
+        Devolve (recorte, cantos do QR no recorte).
+        """
+        qx, qy, lado = layout['qr']
+        altura_pt = layout['altura']
+        qr_layout = np.float32([(qx, altura_pt - qy - lado), (qx + lado, altura_pt - qy - lado), (qx + lado, altura_pt - qy), (qx, altura_pt - qy)])
+        # Afim (e não homografia): extrapolar a partir de um QR pequeno fica mais estável
+        matriz, _ = cv2.estimateAffine2D(qr_layout, np.float32(cantos_qr))
+        if matriz is None:
+            return image, cantos_qr
+        cantos_cartao = np.float32([(0, 0), (layout['largura'], 0), (layout['largura'], altura_pt), (0, altura_pt)])
+        cartao = cv2.transform(cantos_cartao[None], matriz)[0]
+        margem = folga * (cartao.max(axis=0) - cartao.min(axis=0))
+        h, w = image.shape[:2]
+        x0, y0 = np.maximum(cartao.min(axis=0) - margem, 0).astype(int)
+        x1, y1 = np.minimum(cartao.max(axis=0) + margem, (w, h)).astype(int)
+        if x1 - x0 < 50 or y1 - y0 < 50:
+            return image, cantos_qr
+        return image[y0:y1, x0:x1], cantos_qr - (x0, y0)
+
+    def _localizar_marcadores(self, gray, layout):
+        """
+        Centros dos 4 quadrados pretos do cartão (sup. esq., sup. dir., inf. dir., inf. esq.),
+        em coordenadas da imagem original, ou None.
+
+        A busca roda numa cópia de tamanho fixo (LADO_BUSCA_MARCADORES) com componentes
+        conexos filtrados em bloco pelo NumPy: o custo não depende da resolução da foto nem
+        de quanta coisa há na mesa. Só depois o centro de cada marcador é refinado na
+        imagem original.
+        """
+        escala = min(1.0, LADO_BUSCA_MARCADORES / float(max(gray.shape[:2])))
+        pequena = cv2.resize(gray, None, fx=escala, fy=escala, interpolation=cv2.INTER_AREA) if escala < 1 else gray
+        _, binaria = cv2.threshold(pequena, 0, 255, cv2.THRESH_BINARY_INV | cv2.THRESH_OTSU)
+        altura, largura = binaria.shape
+
+        # Num fundo escuro o cartão vira um "buraco" claro: os marcadores são componentes à parte
+        _, rotulos, stats, centros = cv2.connectedComponentsWithStats(binaria, connectivity=8)
+        w, h, area = stats[1:, cv2.CC_STAT_WIDTH], stats[1:, cv2.CC_STAT_HEIGHT], stats[1:, cv2.CC_STAT_AREA]
+        indices = np.flatnonzero(
+            (w >= 5) & (h >= 5) & (w <= largura / 6) & (h <= altura / 6)
+            & (w <= 1.8 * h) & (h <= 1.8 * w) & (area >= 0.45 * w * h)
+        ) + 1
+
+        candidatos = []
+        for i in indices:
+            bx, by, bw, bh, barea = stats[i]
+            # Quadrado cheio de tinta (mesmo girado): bolinha pintada e olho do QR (anel) ficam abaixo
+            pontos = cv2.findNonZero((rotulos[by:by + bh, bx:bx + bw] == i).astype(np.uint8))
+            (_, _), (lado_a, lado_b), _ = cv2.minAreaRect(pontos)
+            if not lado_a or not lado_b or not 0.7 <= lado_a / lado_b <= 1.4: continue
+            if barea < 0.88 * lado_a * lado_b: continue
+            # Quadrado, não bolinha: a circularidade do contorno convexo fica perto de pi/4
+            casca = cv2.convexHull(pontos)
+            perimetro = cv2.arcLength(casca, True)
+            if not perimetro or 4 * np.pi * cv2.contourArea(casca) / perimetro ** 2 > 0.9: continue
+            # ... e impresso no papel: a moldura em volta tem que ser clara
+            mx, my = max(bw // 2, 2), max(bh // 2, 2)
+            x0, y0, x1, y1 = max(bx - mx, 0), max(by - my, 0), min(bx + bw + mx, largura), min(by + bh + my, altura)
+            moldura = cv2.countNonZero(binaria[y0:y1, x0:x1]) - barea
+            if moldura > 0.15 * ((x1 - x0) * (y1 - y0) - barea): continue
+            candidatos.append((centros[i][0], centros[i][1], float(barea)))
+
+        escolhidos = self._escolher_marcadores(candidatos, layout, binaria)
+        if escolhidos is None:
+            return None
+        return np.float32([self._refinar_centro(gray, cx / escala, cy / escala, np.sqrt(a) / escala) for cx, cy, a in escolhidos])
+
+    def _escolher_marcadores(self, candidatos, layout, binaria):
+        """
+        Dos quadrados candidatos, os 4 que formam o maior cartão plausível: proporção do
+        layout, lados opostos parecidos, marcadores do tamanho certo para aquele cartão e
+        miolo claro (papel). Cada canto esperado (os da imagem, já recortada pelo QR quando
+        dá) fica só com os MARCADORES_POR_CANTO candidatos mais próximos, primeiro os do
+        próprio quadrante; as combinações desses são testadas de uma vez com NumPy e só as
+        que passam nisso tudo chegam à conferência do miolo.
+        """
+        if len(candidatos) < 4:
+            return None
+        (ex1, ey1), (ex2, _), (_, ey3) = layout['marcadores'][0], layout['marcadores'][1], layout['marcadores'][3]
+        esperado = (ex2 - ex1) / float(ey1 - ey3)
+        lado_relativo = layout['marcador'] / float(ex2 - ex1)
+
+        pts = np.array([c[:2] for c in candidatos], dtype=float)
+        areas = np.array([c[2] for c in candidatos], dtype=float)
+        altura, largura = binaria.shape
+        por_canto = []
+        for canto in ((0, 0), (largura, 0), (largura, altura), (0, altura)):
+            fora_do_quadrante = (np.abs(pts - canto) > (largura / 2, altura / 2)).any(axis=1)
+            distancia = np.linalg.norm(pts - canto, axis=1)
+            por_canto.append(np.lexsort((distancia, fora_do_quadrante))[:MARCADORES_POR_CANTO])
+        # Um mesmo candidato pode estar perto de dois cantos: só grupos de 4 distintos, sem repetição
+        grupos = np.unique(np.sort(np.array(list(itertools.product(*por_canto))), axis=1), axis=0)
+        grupos = grupos[(np.diff(grupos, axis=1) > 0).all(axis=1)]
+
+        a = areas[grupos]
+        grupos = grupos[a.max(axis=1) <= 2 * a.min(axis=1)]
+        if not len(grupos):
+            return None
+
+        # Ordem sup. esq., sup. dir., inf. dir., inf. esq. pelos extremos de x+y e x-y
+        p = pts[grupos]
+        soma, dif = p[..., 0] + p[..., 1], p[..., 0] - p[..., 1]
+        ordem = np.stack([soma.argmin(1), dif.argmax(1), soma.argmax(1), dif.argmin(1)], axis=1)
+        distintos = np.sort(ordem, axis=1)
+        validos = (np.diff(distintos, axis=1) > 0).all(axis=1)
+        grupos, ordem, p = grupos[validos], ordem[validos], p[validos]
+        if not len(grupos):
+            return None
+        cantos = np.take_along_axis(p, ordem[..., None], axis=1)
+        tl, tr, br, bl = cantos[:, 0], cantos[:, 1], cantos[:, 2], cantos[:, 3]
+        topo, base = np.linalg.norm(tr - tl, axis=1), np.linalg.norm(br - bl, axis=1)
+        esq, dir_ = np.linalg.norm(bl - tl, axis=1), np.linalg.norm(br - tr, axis=1)
+        largura, altura = (topo + base) / 2, (esq + dir_) / 2
+        lado = np.sqrt(areas[grupos])
+
+        ok = (altura > 0) & (np.abs(largura / np.maximum(altura, 1e-6) - esperado) <= 0.25 * esperado)
+        ok &= (np.abs(topo - base) <= 0.2 * largura) & (np.abs(esq - dir_) <= 0.2 * altura)
+        # Cantos quase retos: a foto inclina o cartão, mas não o entorta num losango
+        for v1, v2 in ((tr - tl, bl - tl), (tl - tr, br - tr), (tr - br, bl - br), (br - bl, tl - bl)):
+            cosseno = (v1 * v2).sum(axis=1) / np.maximum(np.linalg.norm(v1, axis=1) * np.linalg.norm(v2, axis=1), 1e-6)
+            ok &= np.abs(cosseno) <= 0.25
+        # Marcador do tamanho que o layout manda para um cartão daquela largura
+        ok &= ((lado >= 0.7 * lado_relativo * largura[:, None]) & (lado <= 1.4 * lado_relativo * largura[:, None])).all(axis=1)
+        if not ok.any():
+            return None
+
+        # Maiores primeiro; vale o primeiro com miolo de papel. As linhas verticais entre os
+        # marcadores passam só pela margem do cartão: uma delas tem que estar limpa e a outra
+        # quase (um dedo ou um estojo por cima ainda passa, o fundo da mesa não)
+        indices = np.flatnonzero(ok)
+        area_quad = largura[indices] * altura[indices]
+        for i in indices[np.argsort(-area_quad)]:
+            miolo = cv2.warpPerspective(binaria, cv2.getPerspectiveTransform(np.float32(cantos[i]), MIOLO_REFERENCIA), (21, 61))
+            sujeira = np.count_nonzero(miolo[1:-1, [0, -1]], axis=0) / float(miolo.shape[0] - 2)
+            if cv2.countNonZero(miolo) <= 0.35 * miolo.size and sujeira.min() <= 0.05 and sujeira.max() <= 0.3:
+                return [candidatos[grupos[i][k]] for k in ordem[i]]
+        return None
+
+    def _refinar_centro(self, gray, cx, cy, lado):
+        """Centro do marcador medido na resolução original (centroide da mancha escura)."""
+        r = int(lado) + 2
+        x0, y0 = max(int(cx) - r, 0), max(int(cy) - r, 0)
+        recorte = gray[y0:int(cy) + r + 1, x0:int(cx) + r + 1]
+        if recorte.size == 0:
+            return cx, cy
+        _, mancha = cv2.threshold(recorte, 0, 255, cv2.THRESH_BINARY_INV | cv2.THRESH_OTSU)
+        total, rotulos, stats, centros = cv2.connectedComponentsWithStats(mancha)
+        if total < 2:
+            return cx, cy
+        maior = 1 + int(np.argmax(stats[1:, cv2.CC_STAT_AREA]))
+        return x0 + centros[maior][0], y0 + centros[maior][1]
 
+    def _endireitar(self, image, marcadores, layout):
+        """Homografia direta marcadores -> layout: o cartão inteiro a PX_POR_PONTO pixels por ponto."""
+        altura_pt = layout['altura']
+        destino = np.float32([(x * PX_POR_PONTO, (altura_pt - y) * PX_POR_PONTO) for x, y in layout['marcadores']])
+        matriz = cv2.getPerspectiveTransform(np.float32(marcadores), destino)
+        return cv2.warpPerspective(image, matriz, (int(layout['largura'] * PX_POR_PONTO), int(altura_pt * PX_POR_PONTO)))
+
+    def _ler_por_layout(self, image, layout, alternativas=5, marcadores=None):
+        """
+        Lê o cartão pelas coordenadas impressas: endireita pelos marcadores e mede o miolo de
+        cada bolinha onde ela foi desenhada, sem procurar contornos. None se não achar os marcadores.
+        """
+        gray = cv2.cvtColor(image, cv2.COLOR_BGR2GRAY) if image.ndim == 3 else image
+        if marcadores is None:
+            marcadores = self._localizar_marcadores(gray, layout)
+        if marcadores is None:
+            return None
+
+        altura_pt = layout['altura']
+        cartao = self._endireitar(gray, marcadores, layout)
+        altura_px, largura_px = cartao.shape
+        # Janela maior que a bolinha: o miolo de uma bolinha cheia continua escuro
+        binaria = cv2.adaptiveThreshold(cartao, 255, cv2.ADAPTIVE_THRESH_GAUSSIAN_C, cv2.THRESH_BINARY_INV, 51, 10)
+
+        # Disco do miolo (sem o contorno impresso) aplicado em todas as bolinhas de uma vez
+        raio = int(layout['raio_bolinha'] * 0.75 * PX_POR_PONTO)
+        dy, dx = np.mgrid[-raio:raio + 1, -raio:raio + 1]
+        dentro = dx ** 2 + dy ** 2 <= raio ** 2
+        dx, dy = dx[dentro], dy[dentro]
+        centros = np.array([q['bolinhas'][:alternativas] for q in layout['questoes']], dtype=float)
+        cx = np.rint(centros[..., 0] * PX_POR_PONTO).astype(int)[..., None] + dx
+        cy = np.rint((altura_pt - centros[..., 1]) * PX_POR_PONTO).astype(int)[..., None] + dy
+        preenchimentos = (binaria[np.clip(cy, 0, altura_px - 1), np.clip(cx, 0, largura_px - 1)] > 0).mean(axis=2)
+
+        respostas = {}
+        for questao, linha in zip(layout['questoes'], preenchimentos):
+            letra = self._decidir_linha(list(linha))
+            if letra: respostas[questao['numero']] = letra
+
+        if self._prefixo_debug:
+            img_layout = cv2.cvtColor(cartao, cv2.COLOR_GRAY2BGR)
+            for linha_x, linha_y in zip(cx[..., 0].ravel(), cy[..., 0].ravel()):
+                cv2.circle(img_layout, (int(linha_x), int(linha_y)), raio, (255, 0, 0), 1)
+            self._salvar_debug("05_layout.jpg", img_layout)
+        return respostas
+
+    def _procurar_folha(self, image, clahe):
+        """Sem marcadores: acha a folha pelo maior quadrilátero de bordas (Canny)."""
         # 2. Resize Controlado
         h, w = image.shape[:2]
         target_h = 1200
@@ -67,10 +477,8 @@ class OMRScanner:
         image = cv2.resize(image, (int(w * scale), target_h))
 
         # 3. CLAHE + Encontrar a Folha
-        gray = cv2.cvtColor(image, cv2.COLOR_BGR2GRAY)
-        clahe = cv2.createCLAHE(clipLimit=2.0, tileGridSize=(8,8))
-        gray = clahe.apply(gray)
-        
+        gray = clahe.apply(cv2.cvtColor(image, cv2.COLOR_BGR2GRAY))
+
         blurred = cv2.GaussianBlur(gray, (5, 5), 0)
         edges = cv2.Canny(blurred, 75, 200)
         kernel = cv2.getStructuringElement(cv2.MORPH_RECT, (3, 3))
@@ -92,6 +500,203 @@ class OMRScanner:
             warped_gray = clahe.apply(cv2.cvtColor(warped, cv2.COLOR_BGR2GRAY))
         else:
             warped, warped_gray = image, gray
+        return warped, warped_gray
+
+    def avaliar_qualidade(self, image):
+        """
+        Triagem barata (alguns ms) antes de gastar a leitura inteira: foto pequena demais,
+        tremida ou com reflexo. Devolve None se a foto serve, ou o erro pronto para a
+        resposta, com a orientação para o aplicador refazer a foto.
+        """
+        altura, largura = image.shape[:2]
+        medidas = {'largura': largura, 'altura': altura}
+        if min(altura, largura) < LADO_MINIMO_FOTO:
+            return self._foto_recusada('resolucao', f"Foto com resolução muito baixa ({largura}x{altura}). Fotografe mais de perto ou com a câmera principal.", medidas)
+
+        escala = LADO_MINIATURA_QUALIDADE / float(max(altura, largura))
+        cinza = cv2.cvtColor(image, cv2.COLOR_BGR2GRAY) if image.ndim == 3 else image
+        miniatura = cv2.resize(cinza, None, fx=escala, fy=escala, interpolation=cv2.INTER_AREA) if escala < 1 else cinza
+
+        medidas['nitidez'] = round(float(cv2.Laplacian(miniatura, cv2.CV_64F).var()), 1)
+        if medidas['nitidez'] < NITIDEZ_MINIMA:
+            return self._foto_recusada('desfocada', "Foto tremida ou fora de foco. Apoie o celular, espere focar e fotografe de novo.", medidas)
+
+        # Reflexo: mancha estourada num papel que, fora dela, não é branco puro (scanner é)
+        limiar, _ = cv2.threshold(miniatura, 0, 255, cv2.THRESH_BINARY | cv2.THRESH_OTSU)
+        papel = miniatura[miniatura > limiar]
+        medidas['reflexo'] = round(float((papel >= 250).mean()), 3) if papel.size else 0.0
+        if papel.size and np.median(papel) < 245 and medidas['reflexo'] > REFLEXO_MAXIMO:
+            return self._foto_recusada('reflexo', "Reflexo de luz sobre o cartão. Incline o celular ou afaste da lâmpada e fotografe de novo.", medidas)
+        return None
+
+    def _foto_recusada(self, motivo, erro, medidas):
+        return {"sucesso": False, "erro": erro, "refazer_foto": True, "motivo": motivo, "qualidade": medidas}
+
+    def checar_foto(self, imagem):
+        """(imagem decodificada, erro da triagem ou None): a view responde na hora se a foto não serve."""
+        image = self._carregar_imagem(imagem)
+        if image is None:
+            return None, {"sucesso": False, "erro": "Imagem inválida"}
+        return image, self.avaliar_qualidade(image)
+
+    def processar_folha(self, imagem, qtd_questoes=30, alternativas=5, checar_qualidade=True):
+        """
+        Folha digitalizada com vários cartões (gerar_cartoes_pdf imprime 4 por A4). Cada QR
+        acha o seu cartão: recorta, endireita e lê pelo layout, sem misturar as bolinhas dos
+        vizinhos. Devolve uma leitura por cartão, na ordem da folha, com a 'posicao' (1 a 4)
+        dele. Cartão impresso cujo QR não foi lido vira uma leitura com erro na sua posição,
+        para o resumo do lote não contar menos alunos do que havia na folha. Sem QR de layout
+        novo, a foto pode ser de um cartão só: o processar_cartao tenta antes.
+        """
+        self.tempos, self._ultima_marca = {}, time.perf_counter()
+        image = self._carregar_imagem(imagem)
+        if image is None: return [{"sucesso": False, "erro": "Imagem inválida"}]
+        self._marcar('carregar')
+
+        problema = self.avaliar_qualidade(image) if checar_qualidade else None
+        self._marcar('qualidade')
+        if problema: return [problema]
+
+        # Foto de um cartão só (QR grande na miniatura) nem passa pela busca na resolução cheia
+        escala = min(1.0, LADO_BUSCA_QR / float(max(image.shape[:2])))
+        miniatura = cv2.resize(image, None, fx=escala, fy=escala, interpolation=cv2.INTER_AREA) if escala < 1 else image
+        if any(max(a.rect.width, a.rect.height) >= QR_DE_CARTAO_SOZINHO * max(miniatura.shape[:2]) for a in decode(miniatura, symbols=[ZBarSymbol.QRCODE])):
+            return [self.processar_cartao(image, qtd_questoes, alternativas, checar_qualidade=False)]
+
+        try:
+            qrs = self._ler_qrs(image)
+        except Exception as e:
+            logger.warning(f"Falha ao ler os QRs da folha: {e}")
+            qrs = []
+        self._marcar('qr')
+        if not qrs or (len(qrs) == 1 and not (ler_codigo_qr(qrs[0][0]) or {}).get('versao')):
+            leitura = self.processar_cartao(image, qtd_questoes, alternativas, checar_qualidade=False)
+            faltando = [] if leitura.get('qr_code') else self._posicoes_dos_cartoes(image, [])[1]
+            if not faltando:
+                return [leitura]
+            return [self._cartao_sem_qr(posicao) for posicao in faltando]
+
+        posicoes, faltando = self._posicoes_dos_cartoes(image, qrs)
+        self._prefixo_debug = None
+        leituras = [
+            dict(self._ler_cartao_da_folha(image, texto, cantos, qtd_questoes, alternativas), posicao=posicao)
+            for (texto, cantos), posicao in zip(qrs, posicoes)
+        ]
+        leituras += [self._cartao_sem_qr(posicao) for posicao in faltando]
+        return sorted(leituras, key=lambda l: l['posicao'] or len(posicoes_na_folha()) + 1)
+
+    def _cartao_sem_qr(self, posicao):
+        return {"sucesso": False, "erro": f"Cartão {posicao} da folha sem QR legível: fotografe este cartão sozinho.", "posicao": posicao}
+
+    def _posicoes_dos_cartoes(self, image, qrs):
+        """
+        Em qual posição da folha (posicoes_na_folha, numeradas na ordem da imagem) caiu cada
+        QR, e quais posições têm cartão impresso sem QR lido. As contas são na imagem inteira
+        tomada como a folha A4: a grade 2x2 é simétrica, então folha de cabeça para baixo ou
+        deitada continua com um cartão por quadrante.
+        """
+        gray = cv2.cvtColor(image, cv2.COLOR_BGR2GRAY)
+        h, w = gray.shape
+        largura, altura = A4
+        caixas = []
+        for x, y in posicoes_na_folha():
+            x0, x1 = int(x / largura * w), int((x + LARGURA_CARTAO) / largura * w)
+            y0, y1 = int((altura - y - ALTURA_CARTAO) / altura * h), int((altura - y) / altura * h)
+            caixas.append((x0, y0, x1, y1))
+        # Ordem da imagem: de cima para baixo, da esquerda para a direita (a mesma do _ler_qrs)
+        caixas.sort(key=lambda c: (c[1], c[0]))
+
+        posicoes = []
+        for _, cantos in qrs:
+            if cantos is None:
+                posicoes.append(None)
+                continue
+            cx, cy = np.asarray(cantos, np.float32).mean(axis=0)
+            perto = min(range(len(caixas)), key=lambda i: ((caixas[i][0] + caixas[i][2]) / 2 - cx) ** 2 + ((caixas[i][1] + caixas[i][3]) / 2 - cy) ** 2)
+            posicoes.append(perto + 1)
+
+        faltando = [
+            numero for numero, (x0, y0, x1, y1) in enumerate(caixas, 1)
+            if numero not in posicoes and np.mean(gray[y0:y1, x0:x1] < 128) > TINTA_MINIMA_CARTAO
+        ]
+        # QR sem cantos não tem posição, mas o cartão dele foi achado: não conta duas vezes
+        return posicoes, faltando[:max(0, len(caixas) - len(qrs))]
+
+    def _ler_cartao_da_folha(self, image, dados_qr, cantos_qr, qtd_questoes, alternativas):
+        info_qr = ler_codigo_qr(dados_qr)
+        if cantos_qr is None or not info_qr or not info_qr['versao']:
+            # Sem a versão não se sabe onde o cartão começa: o de layout antigo vai em foto própria
+            return {"sucesso": False, "erro": "Cartão sem layout no QR: fotografe este cartão sozinho.", "qr_code": dados_qr}
+        try:
+            layout = layout_cartao(info_qr['total_questoes'] or qtd_questoes, info_qr['versao'])
+        except ValueError as e:
+            return {"sucesso": False, "erro": str(e), "qr_code": dados_qr}
+
+        recorte, cantos_qr = self._recortar_pelo_qr(image, cantos_qr, layout, FOLGA_RECORTE_FOLHA)
+        recorte, _ = self._orientar(recorte, cantos_qr)
+        gray = cv2.cvtColor(recorte, cv2.COLOR_BGR2GRAY)
+        self._marcar('orientacao')
+        marcadores = self._localizar_marcadores(gray, layout)
+        self._marcar('marcadores')
+        if marcadores is None:
+            return {"sucesso": False, "erro": "Marcadores do cartão não encontrados.", "qr_code": dados_qr}
+        respostas = self._ler_por_layout(gray, layout, alternativas, marcadores)
+        self._marcar('leitura')
+        return {"sucesso": True, "respostas": respostas, "qr_code": dados_qr, "metodo": "layout"}
+
+    def processar_cartao(self, imagem, qtd_questoes=30, alternativas=5, checar_qualidade=True):
+        self.tempos, self._ultima_marca = {}, time.perf_counter()
+        image = self._carregar_imagem(imagem)
+        if image is None: return {"sucesso": False, "erro": "Imagem inválida"}
+        self._marcar('carregar')
+
+        # 0. Triagem: foto ruim volta em milissegundos, sem passar pelo resto
+        problema = self.avaliar_qualidade(image) if checar_qualidade else None
+        self._marcar('qualidade')
+        if problema: return problema
+
+        # Depuração por amostragem: só alguns cartões geram imagens, cada um com seu prefixo
+        self._prefixo_debug = uuid.uuid4().hex[:8] if self.debug and random.random() < self.amostra_debug else None
+
+        # 1. QR Code (Mantém a lógica robusta do SAMI: A39-M559), achado numa miniatura
+        dados_qr, cantos_qr = None, None
+        try:
+            dados_qr, cantos_qr = self._ler_qr(image)
+        except Exception as e:
+            logger.warning(f"Falha ao ler o QR do cartão: {e}")
+        self._marcar('qr')
+
+        # 1a. Posição do QR no layout conhecida: o resto da foto nem entra na leitura
+        info_qr = ler_codigo_qr(dados_qr)
+        try:
+            layout = layout_cartao(info_qr['total_questoes'] or qtd_questoes, info_qr['versao'] or VERSAO_ATUAL) if info_qr else layout_cartao(qtd_questoes)
+        except ValueError:
+            layout = None
+        if layout and cantos_qr is not None and info_qr and info_qr['versao']:
+            image, cantos_qr = self._recortar_pelo_qr(image, cantos_qr, layout)
+        # O QR manda: cartão girado/de cabeça para baixo é endireitado (já recortado, gira menos pixels)
+        image, cantos_qr = self._orientar(image, cantos_qr)
+        self._marcar('orientacao')
+
+        # 1b. Marcadores dos cantos: custo fixo, não importa o que mais aparece na foto
+        gray_original = cv2.cvtColor(image, cv2.COLOR_BGR2GRAY)
+        marcadores = self._localizar_marcadores(gray_original, layout) if layout else None
+        self._marcar('marcadores')
+
+        # 1c. Layout conhecido (versão no QR): lê direto nas coordenadas impressas
+        if marcadores is not None and info_qr and info_qr['versao']:
+            respostas = self._ler_por_layout(gray_original, layout, alternativas, marcadores)
+            self._marcar('leitura')
+            return {"sucesso": True, "respostas": respostas, "qr_code": dados_qr, "metodo": "layout"}
+
+        clahe = cv2.createCLAHE(clipLimit=2.0, tileGridSize=(8,8))
+        if marcadores is not None:
+            # Cartão sem versão no QR: os marcadores já endireitam, segue a busca de bolinhas
+            warped = self._endireitar(image, marcadores, layout)
+            warped_gray = clahe.apply(cv2.cvtColor(warped, cv2.COLOR_BGR2GRAY))
+        else:
+            warped, warped_gray = self._procurar_folha(image, clahe)
+        self._marcar('folha')
 
         self._salvar_debug("01_warped.jpg", warped)
 
@@ -100,31 +705,31 @@ class OMRScanner:
         self._salvar_debug("02_thresh.jpg", thresh)
 
         # 5. Encontrar Bolinhas (Geometria Estrita anti-números e letras)
+        # Cada bolinha guarda o boundingRect já calculado: (contorno, x, y, w, h)
         cnts = cv2.findContours(thresh.copy(), cv2.RETR_EXTERNAL, cv2.CHAIN_APPROX_SIMPLE)[0]
         todas_bolinhas = []
-        img_bolinhas = warped.copy()
+        img_bolinhas = warped.copy() if self._prefixo_debug else None
 
         for c in cnts:
             x, y, w_box, h_box = cv2.boundingRect(c)
             ar = w_box / float(h_box)
-            area = cv2.contourArea(c)
             
             # Filtro de bolinha
             if 15 <= w_box <= 45 and 15 <= h_box <= 45 and 0.75 <= ar <= 1.25:
-                extent = area / float(w_box * h_box)
+                extent = cv2.contourArea(c) / float(w_box * h_box)
                 # O Extent bloqueia letras. O "y > 150" bloqueia o cabeçalho.
                 if 0.55 <= extent <= 0.95 and y > 150:
-                    todas_bolinhas.append(c)
-                    cv2.rectangle(img_bolinhas, (x, y), (x+w_box, y+h_box), (255, 0, 0), 2)
+                    todas_bolinhas.append((c, x, y, w_box, h_box))
+                    if img_bolinhas is not None: cv2.rectangle(img_bolinhas, (x, y), (x+w_box, y+h_box), (255, 0, 0), 2)
 
         self._salvar_debug("03_bolinhas.jpg", img_bolinhas)
 
         if not todas_bolinhas:
+            self._marcar('leitura')
             return {"sucesso": False, "erro": "Nenhuma marcação detectável.", "qr_code": dados_qr}
 
         # 6. Dividir Colunas (O Algoritmo "GAP" da Perplexity)
-        coords_x = [cv2.boundingRect(c)[0] for c in todas_bolinhas]
-        coords_x_sorted = sorted(coords_x)
+        coords_x_sorted = sorted(b[1] for b in todas_bolinhas)
         # Calcula a distância (gap) entre as bolinhas
         gaps = [coords_x_sorted[i+1] - coords_x_sorted[i] for i in range(len(coords_x_sorted)-1)]
         
@@ -133,8 +738,8 @@ class OMRScanner:
             gap_idx = np.argmax(gaps)
             split_val = coords_x_sorted[gap_idx] + (max(gaps) / 2)
             
-            col_esq = [c for c in todas_bolinhas if cv2.boundingRect(c)[0] < split_val]
-            col_dir = [c for c in todas_bolinhas if cv2.boundingRect(c)[0] > split_val]
+            col_esq = [b for b in todas_bolinhas if b[1] < split_val]
+            col_dir = [b for b in todas_bolinhas if b[1] > split_val]
             
             colunas = [col_esq, col_dir] if col_dir else [col_esq]
         else:
@@ -142,63 +747,40 @@ class OMRScanner:
 
         # 7. Leitura com a EROSÃO DE MÁSCARA (A Mágica Anti-NULA)
         respostas_lidas = {}
-        img_resultados = warped.copy()
+        img_resultados = warped.copy() if self._prefixo_debug else None
         prox_num = 1
 
         for col in colunas:
             if not col: continue
             # Ordena de cima para baixo
-            col = sorted(col, key=lambda c: cv2.boundingRect(c)[1])
+            col = sorted(col, key=lambda b: b[2])
             
             linhas = []
             linha_atual = [col[0]]
             for i in range(1, len(col)):
-                if abs(cv2.boundingRect(col[i])[1] - cv2.boundingRect(linha_atual[-1])[1]) < 20:
+                if abs(col[i][2] - linha_atual[-1][2]) < 20:
                     linha_atual.append(col[i])
                 else:
                     if len(linha_atual) >= 3: # Salva linha e ordena da esq->dir (A, B, C, D, E)
-                        linhas.append(sorted(linha_atual, key=lambda c: cv2.boundingRect(c)[0]))
+                        linhas.append(sorted(linha_atual, key=lambda b: b[1]))
                     linha_atual = [col[i]]
             if len(linha_atual) >= 3:
-                linhas.append(sorted(linha_atual, key=lambda c: cv2.boundingRect(c)[0]))
+                linhas.append(sorted(linha_atual, key=lambda b: b[1]))
 
             for linha in linhas:
                 l_sort = linha[:alternativas]
-                preenchimentos = []
-
-                for j, c in enumerate(l_sort):
-                    # 1. Cria a máscara cobrindo a bolinha inteira
-                    mask = np.zeros(thresh.shape, dtype="uint8")
-                    cv2.drawContours(mask, [c], -1, 255, -1)
-                    
-                    # 2. O SEGREDO: Corrói as beiradas da máscara! (Exclui a linha grossa do gabarito)
-                    kernel_erode = np.ones((4,4), np.uint8)
-                    mask = cv2.erode(mask, kernel_erode, iterations=1)
-                    
-                    # 3. Lê apenas os pixels que sobraram no miolo absoluto
-                    miolo = cv2.bitwise_and(thresh, thresh, mask=mask)
-                    pixels_brancos = cv2.countNonZero(miolo)
-                    area_mascara = cv2.countNonZero(mask)
-                    
-                    pct = pixels_brancos / float(area_mascara) if area_mascara > 0 else 0
-                    preenchimentos.append((pct, j))
-
-                # Ordena as bolinhas da mais marcada para a menos marcada
-                preenchimentos.sort(reverse=True, key=lambda x: x[0])
-                
-                # Se o miolo tiver mais de 45% pintado, é resposta!
-                if preenchimentos[0][0] > 0.45:
-                    # Verifica Rasura / Dupla marcação
-                    if len(preenchimentos) > 1 and preenchimentos[1][0] > 0.45:
-                        respostas_lidas[prox_num] = "NULA"
-                    else:
-                        idx = preenchimentos[0][1]
-                        respostas_lidas[prox_num] = ['A','B','C','D','E'][idx]
-                        
-                        bx,by,bw,bh = cv2.boundingRect(l_sort[idx])
+                preenchimentos = [self._preenchimento(thresh, b) for b in l_sort]
+
+                # Mesma regra da leitura pelo layout: LIMIAR_MARCADA e dupla marcação = NULA
+                resposta = self._decidir_linha(preenchimentos)
+                if resposta:
+                    respostas_lidas[prox_num] = resposta
+                    if resposta != "NULA" and img_resultados is not None:
+                        _, bx, by, bw, bh = l_sort[ALTERNATIVAS.index(resposta)]
                         cv2.rectangle(img_resultados, (bx,by), (bx+bw,by+bh), (0,255,0), 3)
-                        
+
                 prox_num += 1
 
         self._salvar_debug("04_final.jpg", img_resultados)
+        self._marcar('leitura')
         return {"sucesso": True, "respostas": respostas_lidas, "qr_code": dados_qr}
\ No newline at end of file
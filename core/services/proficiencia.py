@@ -0,0 +1,105 @@
+from django.db import transaction
+from django.db.models import Count, Q, Sum, F, OuterRef, Subquery
+from django.db.models.functions import Coalesce
+
+from ..models import Avaliacao, ItemGabarito, Questao, RespostaDetalhada, ProficienciaItem
+from .cache_dashboard import registrar_alteracao
+
+
+def atualizar_proficiencia(avaliacao_id):
+    """
+    Reconsolida a tabela-fato de UMA avaliação a partir das respostas gravadas.
+    Chamada pelos fluxos de lançamento/gabarito: custa uma agregação sobre
+    as respostas de uma única turma, nunca sobre o ano inteiro.
+    """
+    avaliacao = Avaliacao.objects.select_related('alocacao').filter(id=avaliacao_id).first()
+    if not avaliacao:
+        return
+
+    linhas = RespostaDetalhada.objects.filter(avaliacao_id=avaliacao.id).values(
+        'item_gabarito_id', 'questao_id', descritor_final=F('descritor_id'),
+    ).annotate(
+        total=Count('id'),
+        acertos=Count('id', filter=Q(acertou=True))
+    ).order_by()
+
+    novos = [
+        ProficienciaItem(
+            avaliacao_id=avaliacao.id,
+            turma_id=avaliacao.alocacao.turma_id,
+            disciplina_id=avaliacao.alocacao.disciplina_id,
+            descritor_id=l['descritor_final'],
+            item_gabarito_id=l['item_gabarito_id'],
+            questao_id=l['questao_id'],
+            total=l['total'],
+            acertos=l['acertos'],
+        )
+        for l in linhas
+    ]
+
+    with transaction.atomic():
+        ProficienciaItem.objects.filter(avaliacao_id=avaliacao.id).delete()
+        if novos:
+            ProficienciaItem.objects.bulk_create(novos)
+
+    # A tabela-fato mudou: invalida as telas do Dashboard que a leram
+    registrar_alteracao(avaliacao.id)
+
+
+def sincronizar_descritores(avaliacao_id):
+    """
+    Regrava o descritor copiado nas respostas de UMA avaliação depois que o
+    gabarito muda (descritor trocado, itens recriados ou replicados).
+    Um único UPDATE: gabarito > questão do gabarito > questão da resposta.
+    """
+    item = ItemGabarito.objects.filter(id=OuterRef('item_gabarito_id'))
+    RespostaDetalhada.objects.filter(avaliacao_id=avaliacao_id).update(descritor_id=Coalesce(
+        Subquery(item.values('descritor_id')[:1]),
+        Subquery(item.values('questao_banco__descritor_id')[:1]),
+        Subquery(Questao.objects.filter(id=OuterRef('questao_id')).values('descritor_id')[:1]),
+    ))
+
+
+# ==============================================================================
+# LEITURA (mesmo formato para a tabela-fato e para as respostas "ao vivo")
+# ==============================================================================
+
+def proficiencia_por_descritor(fatos):
+    """Linhas {'cod', 'total', 'acertos'} agrupadas pelo código do descritor."""
+    return fatos.values(cod=F('descritor__codigo')).annotate(
+        total_soma=Sum('total'), acertos_soma=Sum('acertos')
+    ).values('cod', total=F('total_soma'), acertos=F('acertos_soma')).order_by('cod')
+
+
+def ranking_por_item(fatos):
+    """Linhas do ranking de questões (fácil/difícil) a partir da tabela-fato."""
+    return fatos.values(
+        desc_final=F('descritor__codigo'),
+        enunciado=F('questao__enunciado'),
+        enunciado_banco=F('item_gabarito__questao_banco__enunciado'),
+        numero=F('item_gabarito__numero'),
+    ).annotate(
+        total_soma=Sum('total'), acertos_soma=Sum('acertos')
+    ).values('desc_final', 'enunciado', 'enunciado_banco', 'numero',
+             total=F('total_soma'), acertos=F('acertos_soma'))
+
+
+def proficiencia_por_descritor_respostas(respostas):
+    """Mesmo formato de proficiencia_por_descritor, direto de RespostaDetalhada (filtro por aluno)."""
+    return respostas.values(cod=F('descritor__codigo')).annotate(
+        total=Count('id'),
+        acertos=Count('id', filter=Q(acertou=True))
+    ).order_by('cod')
+
+
+def ranking_por_item_respostas(respostas):
+    """Mesmo formato de ranking_por_item, direto de RespostaDetalhada (filtro por aluno)."""
+    return respostas.values(
+        desc_final=F('descritor__codigo'),
+        enunciado=F('questao__enunciado'),
+        enunciado_banco=F('item_gabarito__questao_banco__enunciado'),
+        numero=F('item_gabarito__numero'),
+    ).annotate(
+        total=Count('id'),
+        acertos=Count('id', filter=Q(acertou=True))
+    )
@@ -0,0 +1,97 @@
+from django.db.models import F
+
+from ..models import Resultado, RespostaDetalhada
+
+EM_BRANCO = '.'
+ANULADA = '*'
+
+
+def simbolo(letra):
+    """Uma posição por questão: em branco vira '.', marcação nula/múltipla ('NULA', 'MULTIPLA') vira '*'."""
+    letra = (letra or '').strip().upper()
+    return (letra if len(letra) <= 1 else ANULADA) or EM_BRANCO
+
+
+def empacotar(gabarito, respostas):
+    """
+    Monta (respostas_vetor, acertos_mascara) de um aluno.
+    `gabarito` é a lista de ItemGabarito na ordem das questões e `respostas` é
+    {numero (str): letra}; None significa aluno ausente (tudo em branco).
+    """
+    respostas = respostas or {}
+    letras = []
+    mascara = bytearray((len(gabarito) + 7) // 8)
+    for pos, item in enumerate(gabarito):
+        letra = respostas.get(str(item.numero), '')
+        letras.append(simbolo(letra))
+        if letra and letra == item.resposta_correta.upper():
+            mascara[pos // 8] |= 1 << (pos % 8)
+    return ''.join(letras), bytes(mascara)
+
+
+def desempacotar(resultado):
+    """Lista [(letra ou None, acertou ou None)] por posição do gabarito."""
+    mascara = bytes(resultado.acertos_mascara or b'')
+    saida = []
+    for pos, letra in enumerate(resultado.respostas_vetor):
+        if letra == EM_BRANCO:
+            saida.append((None, None))
+        else:
+            acertou = pos // 8 < len(mascara) and bool(mascara[pos // 8] >> (pos % 8) & 1)
+            saida.append((letra, acertou))
+    return saida
+
+
+def mapa_acertos(resultados, itens):
+    """
+    {resultado_id: {item_id: acertou}} para montar mapas de calor.
+
+    `resultados` já carregados (o vetor vem na mesma consulta) e `itens` na ordem do
+    gabarito. Só lançamentos antigos, sem vetor, ainda consultam RespostaDetalhada.
+    Questão em branco fica fora do dicionário (o template mostra como "sem resposta").
+    """
+    mapa = {}
+    legados = []
+    for res in resultados:
+        # Vetor de um gabarito com outro tamanho não está alinhado: usa as linhas
+        if not res.respostas_vetor or len(res.respostas_vetor) != len(itens):
+            legados.append(res.id)
+            continue
+        mapa[res.id] = {
+            item.id: acertou
+            for item, (letra, acertou) in zip(itens, desempacotar(res)) if letra is not None
+        }
+
+    if legados:
+        for r in RespostaDetalhada.objects.filter(resultado_id__in=legados).values('resultado_id', 'item_gabarito_id', 'acertou'):
+            mapa.setdefault(r['resultado_id'], {})[r['item_gabarito_id']] = r['acertou']
+    return mapa
+
+
+def letras_marcadas(resultados, gabarito):
+    """
+    {resultado_id: {numero (str): letra}} com o que o aluno marcou, para reabrir a correção.
+    Lê o vetor compacto; lançamentos antigos vêm de RespostaDetalhada numa consulta só.
+    """
+    marcadas, legados = {}, []
+    for res in resultados:
+        if res.respostas_vetor and len(res.respostas_vetor) == len(gabarito):
+            marcadas[res.id] = {
+                str(item.numero): letra for item, letra in zip(gabarito, res.respostas_vetor) if letra != EM_BRANCO
+            }
+        else:
+            legados.append(res.id)
+
+    if legados:
+        for r in RespostaDetalhada.objects.filter(resultado_id__in=legados, item_gabarito__isnull=False).values(
+            'resultado_id', 'resposta_aluno', 'acertou', numero=F('item_gabarito__numero'), correta=F('item_gabarito__resposta_correta')
+        ):
+            # Lançamento muito antigo guardava só o acerto, sem a letra
+            letra = r['resposta_aluno'] or (r['correta'] if r['acertou'] else '')
+            if letra: marcadas.setdefault(r['resultado_id'], {})[str(r['numero'])] = letra
+    return marcadas
+
+
+def descartar_vetores(avaliacao_id):
+    """Gabarito recriado: os vetores da prova deixam de estar alinhados e voltam ao caminho legado."""
+    Resultado.objects.filter(avaliacao_id=avaliacao_id).update(respostas_vetor='', acertos_mascara=None)
@@ -0,0 +1,42 @@
+from django.db.models.signals import post_save, post_delete, pre_delete
+from django.dispatch import receiver
+
+from .models import Avaliacao, Resultado, RespostaDetalhada, ItemGabarito
+from .services.cache_dashboard import registrar_alteracao, registrar_alteracao_turma, uma_vez_ao_confirmar
+from .services.proficiencia import atualizar_proficiencia
+
+
+# Gravações em lote (bulk_create/update) não disparam sinais:
+# esses fluxos chamam registrar_alteracao diretamente.
+
+@receiver(post_save, sender=Resultado)
+@receiver(post_save, sender=ItemGabarito)
+def versionar_avaliacao(sender, instance, **kwargs):
+    registrar_alteracao(instance.avaliacao_id)
+
+
+@receiver(post_delete, sender=ItemGabarito)
+def versionar_avaliacao_apagada(sender, instance, **kwargs):
+    # Exclusão em cascata chega aqui linha a linha: versiona uma vez por avaliação, no commit
+    uma_vez_ao_confirmar(registrar_alteracao, instance.avaliacao_id)
+
+
+@receiver(pre_delete, sender=Avaliacao)
+def versionar_turma_da_avaliacao(sender, instance, **kwargs):
+    # No commit a avaliação já não existe: a turma é guardada agora e versionada pelo id
+    turma_id = Avaliacao.objects.filter(id=instance.id).values_list('alocacao__turma_id', flat=True).first()
+    uma_vez_ao_confirmar(registrar_alteracao_turma, turma_id)
+
+
+@receiver(post_delete, sender=Resultado)
+def reconsolidar_avaliacao(sender, instance, **kwargs):
+    # Aluno, matrícula ou resultado apagado: a tabela-fato da avaliação é refeita uma vez
+    # no commit (atualizar_proficiencia já versiona o cache do Dashboard)
+    uma_vez_ao_confirmar(atualizar_proficiencia, instance.avaliacao_id)
+
+
+@receiver(post_save, sender=RespostaDetalhada)
+def versionar_resposta(sender, instance, **kwargs):
+    # Sem post_delete aqui: apagar respostas em massa continua sem carregar linha a linha
+    if instance.resultado_id:
+        registrar_alteracao(Resultado.objects.filter(id=instance.resultado_id).values_list('avaliacao_id', flat=True).first())
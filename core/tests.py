@@ -1,3 +1,1228 @@
+import json
+from datetime import date
+
+from django.contrib.auth.models import User
+from django.core.cache import cache
+from django.db import connection
 from django.test import TestCase
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+
+from .models import (
+    AreaConhecimento, Disciplina, Descritor, Turma, Aluno, Matricula, Professor, Alocacao,
+    CoordenadorArea, Avaliacao, ItemGabarito, Resultado, RespostaDetalhada, NDI, TarefaOMR, ProficienciaItem, Questao
+)
+from .services.proficiencia import atualizar_proficiencia
+from .services.vetor_respostas import empacotar, mapa_acertos
+
+
+# ==============================================================================
+# 🏫 ESCOLA DE TESTE
+# ==============================================================================
+
+def matricular_com_notas(turma, avaliacao, itens, quantidade, inicio=0):
+    """Matricula `quantidade` alunos na turma já com prova corrigida e diário (NDI) lançados."""
+    respostas = []
+    for i in range(inicio, inicio + quantidade):
+        aluno = Aluno.objects.create(nome_completo=f"Aluno {turma.nome} {i:03d}")
+        mat = Matricula.objects.create(aluno=aluno, turma=turma, numero_chamada=i + 1)
+
+        marcadas = ['ABCDE'[(i + item.numero) % 5] for item in itens]
+        acertos = sum(1 for item, letra in zip(itens, marcadas) if letra == item.resposta_correta)
+        vetor, mascara = empacotar(itens, {str(item.numero): letra for item, letra in zip(itens, marcadas)})
+        resultado = Resultado.objects.create(
+            avaliacao=avaliacao, matricula=mat, total_questoes=len(itens), acertos=acertos,
+            respostas_vetor=vetor, acertos_mascara=mascara
+        )
+        respostas += [
+            RespostaDetalhada(
+                resultado=resultado, item_gabarito=item, avaliacao=avaliacao, descritor_id=item.descritor_id,
+                resposta_aluno=letra, acertou=(letra == item.resposta_correta)
+            )
+            for item, letra in zip(itens, marcadas)
+        ]
+        NDI.objects.create(
+            matricula=mat, disciplina=avaliacao.alocacao.disciplina, bimestre=1,
+            nota_frequencia=8, nota_atividade=7, nota_comportamento=9,
+            nota_prova_parcial=6, nota_prova_bimestral=(acertos / len(itens)) * 10
+        )
+    RespostaDetalhada.objects.bulk_create(respostas)
+    atualizar_proficiencia(avaliacao.id)
+
+
+def semear_escola(qtd_turmas=2, alunos_por_turma=10, qtd_itens=10):
+    """
+    Escola mínima, mas completa: gestão, professor, PCA, turmas com alunos,
+    uma prova corrigida por turma e o diário do 1º bimestre.
+    """
+    area = AreaConhecimento.objects.create(nome="Matemática e suas Tecnologias")
+    disciplina = Disciplina.objects.create(nome="Matemática", area_conhecimento=area)
+    descritores = [
+        Descritor.objects.create(codigo=f"D{n:02d}", descricao=f"Descritor {n}", disciplina=disciplina)
+        for n in range(1, 6)
+    ]
+
+    User.objects.create_superuser('gestao', 'gestao@sami.local', 'senha')
+    professor = Professor.objects.create(
+        usuario=User.objects.create_user('professor', password='senha'), nome_completo="Professor Teste"
+    )
+    pca = CoordenadorArea.objects.create(
+        usuario=User.objects.create_user('pca', password='senha'), nome_completo="PCA Teste"
+    )
+    pca.areas_conhecimento.add(area)
+
+    escola = {'disciplina': disciplina, 'professor': professor, 'turmas': []}
+    for t in range(qtd_turmas):
+        turma = Turma.objects.create(nome=f"{t + 1}º Ano A", ano_letivo=date.today().year)
+        alocacao = Alocacao.objects.create(professor=professor, disciplina=disciplina, turma=turma)
+        avaliacao = Avaliacao.objects.create(titulo="Simulado 1", data_aplicacao=date.today(), alocacao=alocacao)
+        itens = [
+            ItemGabarito.objects.create(
+                avaliacao=avaliacao, numero=n, resposta_correta='ABCDE'[n % 5], descritor=descritores[n % 5]
+            )
+            for n in range(1, qtd_itens + 1)
+        ]
+        matricular_com_notas(turma, avaliacao, itens, alunos_por_turma)
+        escola['turmas'].append({'turma': turma, 'avaliacao': avaliacao, 'itens': itens})
+    return escola
+
+
+# ==============================================================================
+# 📏 ORÇAMENTO DE CONSULTAS
+# ==============================================================================
+
+class OrcamentoConsultasMixin:
+    """
+    Mede quantas consultas SQL (e quanto tempo de banco) uma tela gasta.
+    Falha quando a tela passa do orçamento declarado ou quando o número de
+    consultas cresce junto com o tamanho da turma (o famoso N+1).
+    """
+
+    def medir(self, url, usuario='gestao'):
+        self.client.force_login(User.objects.get(username=usuario))
+        self.client.get(url)  # aquecimento: sessão e caches do processo fora da medição
+        cache.clear()  # o Dashboard guarda os indicadores em cache: mede sempre o cálculo
+        with CaptureQueriesContext(connection) as consultas:
+            resposta = self.client.get(url)
+        self.assertEqual(resposta.status_code, 200, f"{url} respondeu {resposta.status_code}")
+        tempo_sql = sum(float(q.get('time') or 0) for q in consultas.captured_queries)
+        return len(consultas), tempo_sql
+
+    def assertDentroDoOrcamento(self, url, orcamento, usuario='gestao'):
+        qtd, tempo_sql = self.medir(url, usuario)
+        self.assertLessEqual(
+            qtd, orcamento,
+            f"{url}: {qtd} consultas ({tempo_sql * 1000:.1f} ms de SQL), orçamento é {orcamento}"
+        )
+        return qtd
+
+    def assertNaoCresceComATurma(self, url, usuario='gestao'):
+        antes, _ = self.medir(url, usuario)
+        for dados in self.escola['turmas']:
+            matricular_com_notas(dados['turma'], dados['avaliacao'], dados['itens'], 15, inicio=1000)
+        depois, _ = self.medir(url, usuario)
+        self.assertEqual(antes, depois, f"{url}: {antes} consultas com a turma menor, {depois} com 15 alunos a mais")
+
+
+class OrcamentoConsultasTests(OrcamentoConsultasMixin, TestCase):
+    # (nome da rota, kwargs, querystring, usuário, orçamento máximo de consultas)
+    ORCAMENTOS = [
+        ('dashboard', {}, '', 'gestao', 16),
+        ('dashboard', {}, '', 'professor', 17),
+        ('mapa_calor', {'avaliacao_id': 'avaliacao'}, '', 'gestao', 9),
+        ('resultados_turma', {'avaliacao_id': 'avaliacao'}, '', 'gestao', 14),
+        ('gerenciar_ndi', {}, '?turma={turma}&disciplina={disciplina}&bimestre=1', 'gestao', 12),
+        ('dashboard_pca', {}, '', 'pca', 11),
+        ('gerenciar_avaliacoes', {}, '', 'professor', 13),
+        ('lancar_nota', {}, '?avaliacao_id={avaliacao}', 'professor', 10),
+        ('area_professor', {}, '', 'professor', 23),
+        ('dashboard_aplicador', {}, '', 'professor', 15),
+    ]
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.escola = semear_escola()
+
+    def montar_url(self, rota, kwargs, querystring):
+        primeira = self.escola['turmas'][0]
+        valores = {
+            'avaliacao': primeira['avaliacao'].id,
+            'turma': primeira['turma'].id,
+            'disciplina': self.escola['disciplina'].id,
+        }
+        url = reverse(rota, kwargs={k: valores[v] for k, v in kwargs.items()})
+        return url + querystring.format(**valores)
+
+    def test_telas_dentro_do_orcamento(self):
+        for rota, kwargs, querystring, usuario, orcamento in self.ORCAMENTOS:
+            with self.subTest(rota=rota, usuario=usuario):
+                self.assertDentroDoOrcamento(self.montar_url(rota, kwargs, querystring), orcamento, usuario)
+
+    def test_mapa_calor_nao_cresce_com_a_turma(self):
+        self.assertNaoCresceComATurma(self.montar_url('mapa_calor', {'avaliacao_id': 'avaliacao'}, ''))
+
+    def test_resultados_turma_nao_cresce_com_a_turma(self):
+        self.assertNaoCresceComATurma(self.montar_url('resultados_turma', {'avaliacao_id': 'avaliacao'}, ''))
+
+    def test_ndi_nao_cresce_com_a_turma(self):
+        self.assertNaoCresceComATurma(
+            self.montar_url('gerenciar_ndi', {}, '?turma={turma}&disciplina={disciplina}&bimestre=1')
+        )
+
+    def test_lancar_nota_nao_cresce_com_a_turma(self):
+        self.assertNaoCresceComATurma(self.montar_url('lancar_nota', {}, '?avaliacao_id={avaliacao}'), 'professor')
+
+    def test_dashboard_nao_cresce_com_a_turma(self):
+        self.assertNaoCresceComATurma(reverse('dashboard'))
+
+    def test_dashboard_pca_nao_cresce_com_as_alocacoes(self):
+        url = reverse('dashboard_pca')
+        antes, _ = self.medir(url, 'pca')
+        disciplina = self.escola['disciplina']
+        for n in range(5):
+            prof = Professor.objects.create(
+                usuario=User.objects.create_user(f'colega{n}', password='senha'), nome_completo=f"Colega {n}"
+            )
+            turma = Turma.objects.create(nome=f"3º Ano {n}", ano_letivo=date.today().year)
+            aloc = Alocacao.objects.create(professor=prof, disciplina=disciplina, turma=turma)
+            Avaliacao.objects.create(titulo="Simulado 1", data_aplicacao=date.today(), alocacao=aloc)
+        depois, _ = self.medir(url, 'pca')
+        self.assertEqual(antes, depois)
+
+    def test_ndi_salva_em_lote(self):
+        primeira = self.escola['turmas'][0]
+        url = self.montar_url('gerenciar_ndi', {}, '?turma={turma}&disciplina={disciplina}&bimestre=1')
+        matriculas = list(Matricula.objects.filter(turma=primeira['turma']))
+        dados = {f'pb_{m.id}': '9,5' for m in matriculas}
+        self.client.force_login(User.objects.get(username='gestao'))
+        with CaptureQueriesContext(connection) as consultas:
+            resposta = self.client.post(url, dados)
+        self.assertEqual(resposta.status_code, 302)
+        self.assertLessEqual(len(consultas), 15)
+        self.assertEqual(
+            NDI.objects.filter(matricula__in=matriculas, bimestre=1, nota_prova_bimestral=9.5).count(), len(matriculas)
+        )
+
+
+class LancamentoEmLoteTests(OrcamentoConsultasMixin, TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.escola = semear_escola(qtd_turmas=1, alunos_por_turma=0)
+        cls.dados = cls.escola['turmas'][0]
+        for i in range(30):
+            aluno = Aluno.objects.create(nome_completo=f"Aluno Lote {i:02d}")
+            Matricula.objects.create(aluno=aluno, turma=cls.dados['turma'], numero_chamada=i + 1)
+
+    def lancar(self, lancamentos):
+        self.client.force_login(User.objects.get(username='professor'))
+        with CaptureQueriesContext(connection) as consultas:
+            resposta = self.client.post(
+                reverse('api_lancar_nota_ajax'),
+                json.dumps({'avaliacao_id': self.dados['avaliacao'].id, 'lancamentos': lancamentos}),
+                content_type='application/json'
+            )
+        return resposta.json(), len(consultas)
+
+    def gabarito_com_acertos(self, qtd_acertos):
+        return {str(it.numero): (it.resposta_correta if it.numero <= qtd_acertos else 'X') for it in self.dados['itens']}
+
+    def test_turma_inteira_num_post(self):
+        alunos = list(Matricula.objects.filter(turma=self.dados['turma']).values_list('aluno_id', flat=True))
+        lancamentos = [{'aluno_id': a, 'respostas': self.gabarito_com_acertos(i % 11)} for i, a in enumerate(alunos)]
+        lancamentos[0] = {'aluno_id': alunos[0], 'ausente': True}
+
+        dados, _ = self.lancar(lancamentos)
+
+        self.assertTrue(dados['sucesso'])
+        self.assertEqual(dados['provas_lancadas'], len(alunos))
+        self.assertTrue(dados['resultados'][0]['is_ausente'])
+        self.assertEqual(dados['resultados'][5]['acertos'], 5)
+        resultado = Resultado.objects.get(avaliacao=self.dados['avaliacao'], matricula__aluno_id=alunos[5])
+        self.assertEqual((resultado.acertos, resultado.percentual, resultado.status), (5, 50.0, 'INT'))
+        self.assertEqual(RespostaDetalhada.objects.filter(resultado=resultado).count(), len(self.dados['itens']))
+
+    def test_relancamento_atualiza_sem_duplicar(self):
+        aluno_id = Matricula.objects.filter(turma=self.dados['turma']).first().aluno_id
+        self.lancar([{'aluno_id': aluno_id, 'respostas': self.gabarito_com_acertos(2)}])
+        dados, _ = self.lancar([{'aluno_id': aluno_id, 'respostas': self.gabarito_com_acertos(9)}])
+
+        self.assertEqual(dados['resultados'][0]['acertos'], 9)
+        self.assertEqual(Resultado.objects.filter(avaliacao=self.dados['avaliacao'], matricula__aluno_id=aluno_id).count(), 1)
+
+    def test_resultado_gravado_num_upsert(self):
+        aluno_id = Matricula.objects.filter(turma=self.dados['turma']).first().aluno_id
+        self.lancar([{'aluno_id': aluno_id, 'respostas': self.gabarito_com_acertos(2)}])
+        with CaptureQueriesContext(connection) as consultas:
+            self.lancar([{'aluno_id': aluno_id, 'respostas': self.gabarito_com_acertos(6)}])
+
+        escritas = [q['sql'] for q in consultas.captured_queries
+                    if q['sql'].split()[0] in ('INSERT', 'UPDATE') and 'core_resultado"' in q['sql'].split('WHERE')[0]]
+        self.assertEqual(len(escritas), 1)
+        self.assertIn('ON CONFLICT', escritas[0])
+        self.assertEqual(Resultado.objects.get(avaliacao=self.dados['avaliacao'], matricula__aluno_id=aluno_id).acertos, 6)
+
+    def test_sessao_de_lancamento_e_alteracoes(self):
+        matriculas = list(Matricula.objects.filter(turma=self.dados['turma']).order_by('id'))
+        self.lancar([
+            {'aluno_id': matriculas[0].aluno_id, 'respostas': self.gabarito_com_acertos(3)},
+            {'aluno_id': matriculas[1].aluno_id, 'ausente': True},
+        ])
+
+        resposta = self.client.get(reverse('lancar_nota') + f"?avaliacao_id={self.dados['avaliacao'].id}")
+        sessao = resposta.context['sessao_lancamento']
+        self.assertEqual(len(sessao['gabarito']), len(self.dados['itens']))
+        self.assertEqual(sessao['alunos'][str(matriculas[0].aluno_id)]['respostas'], self.gabarito_com_acertos(3))
+        self.assertTrue(sessao['alunos'][str(matriculas[1].aluno_id)]['ausente'])
+        self.assertFalse(sessao['alunos'][str(matriculas[2].aluno_id)]['lancado'])
+        self.assertEqual(resposta.context['provas_lancadas'], 2)
+
+        # Só a questão 4 muda: as outras continuam como estavam
+        self.client.post(
+            reverse('api_lancar_nota_ajax'),
+            json.dumps({'avaliacao_id': self.dados['avaliacao'].id, 'aluno_id': matriculas[0].aluno_id,
+                        'alteracoes': {'4': self.dados['itens'][3].resposta_correta, '10': ''}}),
+            content_type='application/json'
+        )
+        resultado = Resultado.objects.get(avaliacao=self.dados['avaliacao'], matricula=matriculas[0])
+        self.assertEqual(resultado.acertos, 4)
+        self.assertEqual(RespostaDetalhada.objects.filter(resultado=resultado).count(), len(self.dados['itens']) - 1)
+
+    def test_consultas_nao_crescem_com_o_lote(self):
+        import math
+        alunos = list(Matricula.objects.filter(turma=self.dados['turma']).values_list('aluno_id', flat=True))
+
+        def lancar_medindo(lote, acertos):
+            self.client.force_login(User.objects.get(username='professor'))
+            with CaptureQueriesContext(connection) as consultas:
+                self.client.post(
+                    reverse('api_lancar_nota_ajax'),
+                    json.dumps({'avaliacao_id': self.dados['avaliacao'].id,
+                                'lancamentos': [{'aluno_id': a, 'respostas': self.gabarito_com_acertos(acertos)} for a in lote]}),
+                    content_type='application/json'
+                )
+            insercoes = [q for q in consultas.captured_queries if q['sql'].startswith('INSERT INTO "core_respostadetalhada"')]
+            return len(consultas) - len(insercoes), len(insercoes)
+
+        poucos, _ = lancar_medindo(alunos[:5], 3)
+        muitos, insercoes = lancar_medindo(alunos[5:], 7)
+        self.assertEqual(poucos, muitos)
+        # As respostas vão num INSERT por lote do banco (o SQLite limita as variáveis por consulta)
+        linhas = len(alunos[5:]) * len(self.dados['itens'])
+        campos = [f for f in RespostaDetalhada._meta.concrete_fields if not f.primary_key]
+        self.assertLessEqual(insercoes, math.ceil(linhas / connection.ops.bulk_batch_size(campos, [None] * linhas)))
+
+    def test_aluno_de_outra_turma_nao_trava_o_lote(self):
+        aluno_id = Matricula.objects.filter(turma=self.dados['turma']).first().aluno_id
+        dados, _ = self.lancar([{'aluno_id': 999999, 'respostas': {}}, {'aluno_id': aluno_id, 'respostas': {}}])
+        self.assertFalse(dados['resultados'][0]['sucesso'])
+        self.assertTrue(dados['resultados'][1]['sucesso'])
+
+    def test_corrigir_uma_bolinha_grava_uma_linha(self):
+        aluno_id = Matricula.objects.filter(turma=self.dados['turma']).first().aluno_id
+        respostas = self.gabarito_com_acertos(4)
+        self.lancar([{'aluno_id': aluno_id, 'respostas': respostas}])
+        ids_antes = set(RespostaDetalhada.objects.filter(resultado__matricula__aluno_id=aluno_id).values_list('id', flat=True))
+
+        respostas['5'] = self.dados['itens'][4].resposta_correta
+        self.client.force_login(User.objects.get(username='professor'))
+        with CaptureQueriesContext(connection) as consultas:
+            self.client.post(
+                reverse('api_lancar_nota_ajax'),
+                json.dumps({'avaliacao_id': self.dados['avaliacao'].id, 'aluno_id': aluno_id, 'respostas': respostas}),
+                content_type='application/json'
+            )
+
+        escritas = [q['sql'] for q in consultas.captured_queries
+                    if 'core_respostadetalhada' in q['sql'] and q['sql'].split()[0] in ('INSERT', 'UPDATE', 'DELETE')]
+        self.assertEqual(len(escritas), 1)
+        self.assertTrue(escritas[0].startswith('UPDATE'))
+        self.assertEqual(
+            set(RespostaDetalhada.objects.filter(resultado__matricula__aluno_id=aluno_id).values_list('id', flat=True)), ids_antes
+        )
+        self.assertEqual(Resultado.objects.get(avaliacao=self.dados['avaliacao'], matricula__aluno_id=aluno_id).acertos, 5)
+
+
+class VetorRespostasTests(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.escola = semear_escola(qtd_turmas=1, alunos_por_turma=8, qtd_itens=10)
+        cls.dados = cls.escola['turmas'][0]
+
+    def test_lancamento_grava_vetor_e_mascara(self):
+        itens = self.dados['itens']
+        respostas = {'1': itens[0].resposta_correta, '3': 'X', '9': itens[8].resposta_correta}
+        vetor, mascara = empacotar(itens, respostas)
+        self.assertEqual(vetor, itens[0].resposta_correta + '.X' + '.' * 5 + itens[8].resposta_correta + '.')
+        self.assertEqual(mascara, bytes([0b00000001, 0b00000001]))
+        self.assertEqual(empacotar(itens, None), ('.' * 10, bytes(2)))
+
+    def test_mapa_do_vetor_igual_ao_das_linhas(self):
+        resultados = list(Resultado.objects.filter(avaliacao=self.dados['avaliacao']))
+        with CaptureQueriesContext(connection) as consultas:
+            do_vetor = mapa_acertos(resultados, self.dados['itens'])
+        self.assertEqual(len(consultas), 0)
+
+        # Lançamentos antigos (sem vetor) caem na tabela de respostas e dão o mesmo mapa
+        for r in resultados: r.respostas_vetor = ''
+        self.assertEqual(mapa_acertos(resultados, self.dados['itens']), do_vetor)
+
+
+class RecorrecaoGabaritoTests(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.escola = semear_escola(qtd_turmas=2, alunos_por_turma=10, qtd_itens=10)
+
+    def test_troca_de_gabarito_recorrige_prova_e_irmas(self):
+        origem, irma = self.escola['turmas']
+        # Todo mundo que marcou 'A' na questão 1 passa a ter acertado
+        dados = {f'resposta_{it.id}': ('A' if it.numero == 1 else it.resposta_correta) for it in origem['itens']}
+        dados['replicar_para_todos'] = 'on'
+        antes = {r.id: r.acertos for r in Resultado.objects.all()}
+
+        self.client.force_login(User.objects.get(username='gestao'))
+        self.client.post(reverse('definir_gabarito', args=[origem['avaliacao'].id]), dados)
+
+        for dados_turma in (origem, irma):
+            q1 = ItemGabarito.objects.get(avaliacao=dados_turma['avaliacao'], numero=1)
+            self.assertEqual(q1.resposta_correta, 'A')
+            self.assertEqual(
+                set(RespostaDetalhada.objects.filter(item_gabarito=q1, acertou=True).values_list('resposta_aluno', flat=True)), {'A'}
+            )
+            for r in Resultado.objects.filter(avaliacao=dados_turma['avaliacao']):
+                marcou = RespostaDetalhada.objects.get(resultado=r, item_gabarito=q1).resposta_aluno
+                esperado = antes[r.id] + (marcou == 'A') - (marcou == 'B')  # a questão 1 era 'B'
+                self.assertEqual(r.acertos, esperado)
+                self.assertEqual(r.acertos, RespostaDetalhada.objects.filter(resultado=r, acertou=True).count())
+                self.assertEqual(r.percentual, esperado * 10)
+                self.assertEqual(bin(int.from_bytes(bytes(r.acertos_mascara), 'little')).count('1'), esperado)
+
+
+class GravacaoEmLoteTests(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.escola = semear_escola(qtd_turmas=1, alunos_por_turma=4, qtd_itens=10)
+        cls.dados = cls.escola['turmas'][0]
+
+    def test_notas_por_tupla_com_ausente(self):
+        avaliacao = self.dados['avaliacao']
+        matriculas = list(Matricula.objects.filter(turma=self.dados['turma']).order_by('id'))
+        novo = Matricula.objects.create(aluno=Aluno.objects.create(nome_completo="Aluno Novo"), turma=self.dados['turma'])
+
+        with CaptureQueriesContext(connection) as consultas:
+            Resultado.objects.gravar_em_lote([
+                (avaliacao, matriculas[0], 8, 10), (avaliacao, matriculas[1], None, 10),
+                (avaliacao, matriculas[2], 2, 10), (avaliacao, novo, 5, 10),
+            ])
+        self.assertEqual(len(consultas), 1)
+
+        notas = {r.matricula_id: (r.acertos, r.percentual, r.status) for r in Resultado.objects.filter(avaliacao=avaliacao)}
+        self.assertEqual(notas[matriculas[0].id], (8, 80.0, 'ADQ'))
+        self.assertEqual(notas[matriculas[1].id], (None, None, None))
+        self.assertEqual(notas[matriculas[2].id], (2, 20.0, 'MCR'))
+        self.assertEqual(notas[novo.id], (5, 50.0, 'INT'))
+        self.assertEqual(len(notas), 5)
+
+
+class ConsolidacaoAposExclusaoTests(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.escola = semear_escola(qtd_turmas=1, alunos_por_turma=6, qtd_itens=4)
+        cls.dados = cls.escola['turmas'][0]
+
+    def test_apagar_turma_versiona_uma_vez_por_avaliacao(self):
+        avaliacao = self.dados['avaliacao']
+        versao = Avaliacao.objects.get(id=avaliacao.id).versao_dados
+        with self.captureOnCommitCallbacks(execute=True), CaptureQueriesContext(connection) as consultas:
+            Matricula.objects.filter(turma=self.dados['turma']).delete()
+        incrementos = [q for q in consultas.captured_queries if q['sql'].startswith('UPDATE "core_avaliacao"')]
+        self.assertEqual(len(incrementos), 1)
+        self.assertEqual(Avaliacao.objects.get(id=avaliacao.id).versao_dados, versao + 1)
+
+    def test_aluno_apagado_sai_da_tabela_fato(self):
+        from django.db.models import Sum
+
+        fatos = ProficienciaItem.objects.filter(avaliacao=self.dados['avaliacao'])
+        self.assertEqual(fatos.aggregate(s=Sum('total'))['s'], 6 * 4)
+        with self.captureOnCommitCallbacks(execute=True):
+            Matricula.objects.filter(turma=self.dados['turma']).first().aluno.delete()
+        self.assertEqual(fatos.aggregate(s=Sum('total'))['s'], 5 * 4)
+
+    def test_montar_prova_refaz_a_tabela_fato(self):
+        questao = Questao.objects.create(
+            disciplina=self.escola['disciplina'], enunciado="Nova", gabarito='A', descritor=self.dados['itens'][0].descritor
+        )
+        self.client.force_login(User.objects.get(username='gestao'))
+        self.client.post(reverse('montar_prova', args=[self.dados['avaliacao'].id]), {'questoes_selecionadas': [questao.id]})
+        from django.db.models import Sum
+        self.assertFalse(Resultado.objects.filter(avaliacao=self.dados['avaliacao']).exclude(respostas_vetor='').exists())
+        # A tabela-fato volta a bater com as respostas gravadas
+        self.assertEqual(
+            ProficienciaItem.objects.filter(avaliacao=self.dados['avaliacao']).aggregate(s=Sum('total'))['s'],
+            RespostaDetalhada.objects.filter(avaliacao=self.dados['avaliacao']).count()
+        )
+
+
+class EscopoProfessorTests(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.escola = semear_escola(qtd_turmas=1, alunos_por_turma=2, qtd_itens=3)
+        # Colega com turma, prova e notas próprias: nada disso pode aparecer para o 'professor'
+        colega = Professor.objects.create(usuario=User.objects.create_user('colega', password='senha'), nome_completo="Colega")
+        cls.turma_colega = Turma.objects.create(nome="9º Ano Z", ano_letivo=date.today().year)
+        alocacao = Alocacao.objects.create(professor=colega, disciplina=cls.escola['disciplina'], turma=cls.turma_colega)
+        cls.prova_colega = Avaliacao.objects.create(titulo="Prova do Colega", data_aplicacao=date.today(), alocacao=alocacao)
+        itens = [ItemGabarito.objects.create(avaliacao=cls.prova_colega, numero=n, resposta_correta='A') for n in (1, 2, 3)]
+        matricular_com_notas(cls.turma_colega, cls.prova_colega, itens, 2)
+
+    def listados(self, resposta):
+        """Ids de Avaliacao e de Turma em qualquer lista/queryset do contexto da tela."""
+        from django.db.models import QuerySet
+        ids = {Avaliacao: set(), Turma: set()}
+        for contexto in resposta.context:
+            for valores in contexto.dicts:
+                for valor in valores.values():
+                    if isinstance(valor, (QuerySet, list)):
+                        for obj in valor:
+                            if type(obj) in ids: ids[type(obj)].add(obj.id)
+        return ids
+
+    def test_professor_nao_ve_turmas_nem_provas_do_colega(self):
+        self.client.force_login(User.objects.get(username='professor'))
+        minha = self.escola['turmas'][0]
+        for nome in ('dashboard', 'gerenciar_avaliacoes', 'lancar_nota', 'area_professor', 'dashboard_aplicador'):
+            resposta = self.client.get(reverse(nome))
+            self.assertEqual(resposta.status_code, 200, nome)
+            ids = self.listados(resposta)
+            self.assertIn(minha['avaliacao'].id, ids[Avaliacao], nome)
+            self.assertNotIn(self.prova_colega.id, ids[Avaliacao], nome)
+            self.assertNotIn(self.turma_colega.id, ids[Turma], nome)
+            self.assertNotContains(resposta, "Prova do Colega")
+            self.assertNotContains(resposta, "9º Ano Z")
+
+        # Os indicadores do Dashboard só somam as notas da turma dele (2 alunos, não 4)
+        cache.clear()
+        self.assertEqual(self.client.get(reverse('dashboard')).context['total_avaliacoes_contagem'], 2)
+
+
+class EscolaSinteticaBenchmarkTests(TestCase):
+
+    def test_escola_gerada_e_todas_as_telas_medidas(self):
+        import tempfile
+        from io import StringIO
+        from pathlib import Path
+        from django.core.management import call_command
+
+        call_command(
+            'gerar_escola_sintetica', turmas=1, alunos=3, disciplinas=1, bimestres=1, questoes=5,
+            ausencia=0, forcar=True, stdout=StringIO(),
+        )
+        self.assertEqual(Turma.objects.count(), 1)
+        self.assertEqual(Matricula.objects.count(), 3)
+        self.assertEqual(Avaliacao.objects.count(), 1)
+        self.assertEqual(Resultado.objects.count(), 3)
+        self.assertEqual(RespostaDetalhada.objects.count(), 3 * 5)
+
+        User.objects.create_superuser('gestao', 'gestao@sami.local', 'senha')
+        with tempfile.TemporaryDirectory() as pasta:
+            saida = Path(pasta) / 'benchmark.json'
+            call_command('benchmark_telas', repeticoes=1, saida=str(saida), stdout=StringIO())
+            relatorio = json.loads(saida.read_text(encoding='utf-8'))
+        self.assertEqual(relatorio['escala']['resultados'], 3)
+        self.assertEqual(len(relatorio['telas']), 9)
+        self.assertEqual({t['tela']: t['status'] for t in relatorio['telas'] if t['status'] != 200}, {})
+
+
+class CacheDashboardTests(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.escola = semear_escola(qtd_turmas=2, alunos_por_turma=3, qtd_itens=4)
+
+    def test_mesma_tela_calcula_uma_vez_e_gravacao_troca_a_chave(self):
+        from unittest import mock
+        from . import views
+
+        cache.clear()
+        self.client.force_login(User.objects.get(username='gestao'))
+        url = reverse('dashboard')
+        with mock.patch('core.views.calcular_indicadores_dashboard', wraps=views.calcular_indicadores_dashboard) as calcular:
+            self.client.get(url)
+            with CaptureQueriesContext(connection) as consultas:
+                self.assertEqual(self.client.get(url).status_code, 200)
+            self.assertEqual(calcular.call_count, 1)
+            self.assertFalse([q for q in consultas.captured_queries if 'core_proficienciaitem' in q['sql']])
+
+            # Nota regravada: versão nova, conta de novo
+            resultado = Resultado.objects.filter(avaliacao=self.escola['turmas'][0]['avaliacao']).first()
+            resultado.acertos = 0
+            resultado.save()
+            self.client.get(url)
+            self.assertEqual(calcular.call_count, 2)
+
+            # Prova apagada: a turma dela muda de versão mesmo sem a avaliação existir no commit
+            turma = self.escola['turmas'][1]['turma']
+            versao = Turma.objects.get(id=turma.id).versao_dados
+            with self.captureOnCommitCallbacks(execute=True):
+                self.client.post(reverse('gerenciar_avaliacoes'), {'delete_id': self.escola['turmas'][1]['avaliacao'].id})
+            self.assertGreater(Turma.objects.get(id=turma.id).versao_dados, versao)
+            self.client.get(url)
+            self.assertEqual(calcular.call_count, 3)
+
+
+class PerfilAlunoTests(TestCase):
+
+    def test_habilidades_pelo_descritor_e_nao_pelo_codigo(self):
+        escola = semear_escola(qtd_turmas=1, alunos_por_turma=1, qtd_itens=5)
+        # Mesmo código em outra disciplina: o perfil não pode trocar a descrição
+        outra = Disciplina.objects.create(nome="Física", area_conhecimento=escola['disciplina'].area_conhecimento)
+        Descritor.objects.create(codigo="D01", descricao="Descritor de Física", disciplina=outra)
+        aluno = Matricula.objects.get(turma=escola['turmas'][0]['turma']).aluno
+
+        self.client.force_login(User.objects.get(username='gestao'))
+        contexto = self.client.get(reverse('perfil_aluno', args=[aluno.id])).context
+        habilidades = contexto['habilidades_fortes'] + contexto['habilidades_fracas']
+        self.assertEqual({h['descricao'] for h in habilidades if h['codigo'] == 'D01'}, {"Descritor 1"})
+
+
+class SincronizacaoOfflineTests(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.escola = semear_escola(qtd_turmas=1, alunos_por_turma=0)
+        cls.dados = cls.escola['turmas'][0]
+        cls.matriculas = [
+            Matricula.objects.create(aluno=Aluno.objects.create(nome_completo=f"Aluno Fila {i}"), turma=cls.dados['turma'])
+            for i in range(3)
+        ]
+
+    def sincronizar(self, cartoes):
+        self.client.force_login(User.objects.get(username='professor'))
+        resposta = self.client.post(
+            reverse('api_sincronizar_lancamentos'), json.dumps({'cartoes': cartoes}), content_type='application/json'
+        )
+        return {r['chave']: r for r in resposta.json()['resultados']}
+
+    def cartao(self, chave, matricula, base='', ausente=False, **alteracoes):
+        return {'chave': chave, 'avaliacao_id': self.dados['avaliacao'].id, 'aluno_id': matricula.aluno_id,
+                'alteracoes': {k.lstrip('q'): v for k, v in alteracoes.items()}, 'ausente': ausente, 'base': base}
+
+    def test_lote_aplicado_e_reenvio_idempotente(self):
+        q1 = self.dados['itens'][0].resposta_correta
+        cartoes = [
+            self.cartao('c1', self.matriculas[0], q1=q1, q2='X'),
+            self.cartao('c2', self.matriculas[1], ausente=True),
+        ]
+        primeira = self.sincronizar(cartoes)
+        self.assertEqual([r['status'] for r in primeira.values()], ['aplicado', 'aplicado'])
+        self.assertEqual(primeira['c1']['versao'], q1 + 'X' + '.' * 8)
+        self.assertEqual(primeira['c2']['versao'], '-')
+
+        # A resposta se perdeu na rede e o aparelho manda o mesmo lote de novo
+        segunda = self.sincronizar(cartoes)
+        self.assertEqual([r['status'] for r in segunda.values()], ['repetido', 'repetido'])
+        self.assertEqual(Resultado.objects.filter(avaliacao=self.dados['avaliacao']).count(), 2)
+        self.assertEqual(RespostaDetalhada.objects.filter(resultado__matricula=self.matriculas[0]).count(), 2)
+
+    def test_conflito_quando_outro_aparelho_corrigiu(self):
+        self.sincronizar([self.cartao('a1', self.matriculas[2], q1='A')])
+        # Segundo aparelho ainda tinha o aluno "sem lançamento" (base '')
+        dados = self.sincronizar([self.cartao('b1', self.matriculas[2], q1='B', q3='C')])['b1']
+        self.assertEqual(dados['status'], 'conflito')
+        self.assertEqual(dados['servidor']['respostas'], {'1': 'A'})
+        self.assertEqual(RespostaDetalhada.objects.get(resultado__matricula=self.matriculas[2]).resposta_aluno, 'A')
+
+        # Depois de conferir, o aparelho salva de novo a partir da versão do servidor
+        dados = self.sincronizar([self.cartao('b2', self.matriculas[2], base=dados['servidor']['versao'], q3='C')])['b2']
+        self.assertEqual(dados['status'], 'aplicado')
+        self.assertEqual(dados['versao'], 'A.C' + '.' * 7)
+
+    def test_reenvio_simultaneo_da_mesma_chave_nao_desfaz_o_lote(self):
+        from unittest import mock
+        from .models import LancamentoSincronizado
+        from .services.correcao import sincronizar_lancamentos
+
+        sincronizar_lancamentos([self.cartao('r1', self.matriculas[0], q1='A')])
+        # O outro envio da chave r1 passou pela consulta inicial antes deste gravar
+        filtrar = LancamentoSincronizado.objects.filter
+        sem_ver = lambda *a, **kw: LancamentoSincronizado.objects.none() if 'chave__in' in kw else filtrar(*a, **kw)
+        with mock.patch.object(LancamentoSincronizado.objects, 'filter', side_effect=sem_ver):
+            saida, _ = sincronizar_lancamentos([
+                self.cartao('r1', self.matriculas[0], base='A' + '.' * 9, q1='A'),
+                self.cartao('r2', self.matriculas[1], q1='B'),
+            ])
+        self.assertEqual([(r['chave'], r['status']) for r in saida], [('r1', 'repetido'), ('r2', 'aplicado')])
+        self.assertTrue(LancamentoSincronizado.objects.filter(chave='r2').exists())
+        self.assertEqual(Resultado.objects.filter(avaliacao=self.dados['avaliacao']).count(), 2)
+
+
+class ImportacaoRespostasTests(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.escola = semear_escola(qtd_turmas=1, alunos_por_turma=0, qtd_itens=3)
+        cls.dados = cls.escola['turmas'][0]
+        turma = cls.dados['turma']
+        cls.joao = Matricula.objects.create(aluno=Aluno.objects.create(nome_completo="JOÃO DA SILVA"), turma=turma, numero_chamada=1)
+        cls.maria = Matricula.objects.create(aluno=Aluno.objects.create(nome_completo="MARIA SOUZA"), turma=turma, numero_chamada=2)
+        cls.pedro = Matricula.objects.create(aluno=Aluno.objects.create(nome_completo="PEDRO LIMA"), turma=turma, numero_chamada=3)
+
+    def enviar(self, dados):
+        from django.core.files.uploadedfile import SimpleUploadedFile
+        self.client.force_login(User.objects.get(username='professor'))
+        arquivo = SimpleUploadedFile('respostas.csv', dados.encode('utf-8'), content_type='text/csv')
+        return self.client.post(reverse('importar_respostas', args=[self.dados['avaliacao'].id]), {'arquivo': arquivo})
+
+    def test_previa_nao_grava_e_confirmar_corrige_em_lote(self):
+        # Gabarito semeado: 1=B, 2=C, 3=D
+        resposta = self.enviar(
+            "MATRICULA;CHAMADA;NOME;AUSENTE;Q1;Q2;Q3\n"
+            f"{self.joao.id};;;;B;C;D\n"
+            ";2;;;b;a;\n"
+            ";;  joao da silva ;;A;A;A\n"
+            ";;Pedro Lima;S;;;\n"
+            ";;Fulano;;A;B;C\n"
+        )
+        previa = resposta.context['previa']
+        self.assertEqual([l['criterio'] for l in previa['linhas']], ['matrícula', 'nº de chamada', 'nome', 'nome', None])
+        self.assertIn('repetido', previa['linhas'][2]['erro'])
+        self.assertEqual(previa['linhas'][0]['acertos'], 3)
+        self.assertEqual(previa['linhas'][1]['acertos'], 1)
+        self.assertTrue(previa['linhas'][3]['ausente'])
+        self.assertEqual(previa['resumo']['validas'], 3)
+        self.assertFalse(Resultado.objects.filter(avaliacao=self.dados['avaliacao']).exists())
+
+        resposta = self.client.post(reverse('importar_respostas', args=[self.dados['avaliacao'].id]), {'confirmar': '1'})
+        self.assertRedirects(resposta, reverse('resultados_turma', args=[self.dados['avaliacao'].id]), fetch_redirect_response=False)
+        notas = dict(Resultado.objects.filter(avaliacao=self.dados['avaliacao']).values_list('matricula_id', 'acertos'))
+        self.assertEqual(notas, {self.joao.id: 3, self.maria.id: 1, self.pedro.id: None})
+        self.assertEqual(RespostaDetalhada.objects.filter(avaliacao=self.dados['avaliacao']).count(), 5)
+        self.assertEqual(Resultado.objects.get(matricula=self.maria).respostas_vetor, 'BA.')
+
+
+class CorrecaoLoteOMRTests(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.escola = semear_escola(qtd_turmas=2, alunos_por_turma=0, qtd_itens=3)
+        cls.dados = cls.escola['turmas'][0]
+        cls.matriculas = [
+            Matricula.objects.create(aluno=Aluno.objects.create(nome_completo=f"Aluno Lote {i}"), turma=cls.dados['turma'])
+            for i in range(2)
+        ]
+        cls.de_fora = Matricula.objects.create(aluno=Aluno.objects.create(nome_completo="Outra Turma"), turma=cls.escola['turmas'][1]['turma'])
+
+    def test_extrai_paginas_de_pdf_e_zip(self):
+        import io
+        import zipfile
+        from PIL import Image
+        from .services.omr_lote import extrair_paginas
+
+        fotos = []
+        for cor in ('white', 'gray'):
+            foto = io.BytesIO()
+            Image.new('RGB', (60, 80), cor).save(foto, 'JPEG')
+            fotos.append(foto.getvalue())
+
+        pdf = io.BytesIO()
+        Image.open(io.BytesIO(fotos[0])).save(pdf, 'PDF', save_all=True, append_images=[Image.open(io.BytesIO(fotos[1]))])
+        self.assertEqual([r for r, _ in extrair_paginas('turma.pdf', pdf.getvalue())], ['Página 1', 'Página 2'])
+        self.assertTrue(all(conteudo.startswith(b'\xff\xd8') for _, conteudo in extrair_paginas('turma.pdf', pdf.getvalue())))
+
+        pacote = io.BytesIO()
+        with zipfile.ZipFile(pacote, 'w') as z:
+            z.writestr('b.jpg', fotos[1])
+            z.writestr('a.jpg', fotos[0])
+            z.writestr('leia-me.txt', 'x')
+        self.assertEqual(extrair_paginas('fotos.zip', pacote.getvalue()), [('a.jpg', fotos[0]), ('b.jpg', fotos[1])])
+        with self.assertRaises(ValueError):
+            extrair_paginas('notas.docx', b'')
+
+        # ZIP-bomba: recusado pelo tamanho declarado, sem descompactar nada
+        from unittest import mock
+        bomba = io.BytesIO()
+        with zipfile.ZipFile(bomba, 'w', zipfile.ZIP_DEFLATED) as z:
+            z.writestr('foto.jpg', b'\0' * (2 * 1024 * 1024))
+        with mock.patch('core.services.omr_lote.LIMITE_BYTES_IMAGEM', 1024 * 1024), \
+                mock.patch('zipfile.ZipFile.read') as ler, self.assertRaises(ValueError):
+            extrair_paginas('bomba.zip', bomba.getvalue())
+        ler.assert_not_called()
+
+    def test_qr_liga_cartao_a_matricula_e_grava_em_lote(self):
+        from .services.omr_lote import aplicar_leituras
+        av = self.dados['avaliacao']
+        # Gabarito semeado: 1=B, 2=C, 3=D
+        leituras = [
+            {'pagina': 'p1', 'sucesso': True, 'qr_code': f"A{av.id}-M{self.matriculas[0].id}", 'respostas': {1: 'B', 2: 'C', 3: 'NULA'}},
+            {'pagina': 'p2', 'sucesso': True, 'qr_code': f"A{av.id}-M{self.matriculas[1].id}", 'respostas': {1: 'A'}},
+            {'pagina': 'p3', 'sucesso': True, 'qr_code': f"A{av.id}-M{self.matriculas[0].id}", 'respostas': {1: 'E'}},
+            {'pagina': 'p4', 'sucesso': True, 'qr_code': f"A{av.id}-M{self.de_fora.id}", 'respostas': {1: 'B'}},
+            {'pagina': 'p5', 'sucesso': True, 'qr_code': None, 'respostas': {1: 'B'}},
+            {'pagina': 'p6', 'sucesso': True, 'qr_code': f"A{self.escola['turmas'][1]['avaliacao'].id}-M{self.de_fora.id}", 'respostas': {}},
+            {'pagina': 'p7', 'sucesso': False, 'erro': 'Nenhuma marcação detectável.'},
+        ]
+        status = {s['pagina']: s for s in aplicar_leituras(leituras, av)}
+        self.assertEqual(
+            [status[p]['status'] for p in ('p1', 'p2', 'p3', 'p4', 'p5', 'p6', 'p7')],
+            ['corrigido', 'corrigido', 'repetido', 'matricula_invalida', 'sem_qr', 'outra_avaliacao', 'erro']
+        )
+        self.assertEqual((status['p1']['acertos'], status['p2']['acertos']), (2, 0))
+        self.assertEqual(Resultado.objects.get(matricula=self.matriculas[0]).respostas_vetor, 'BC*')
+        self.assertEqual(Resultado.objects.filter(avaliacao=av).count(), 2)
+
+    def test_folha_com_varios_cartoes_corrige_cada_aluno(self):
+        import cv2
+        from .services.cartoes_sinteticos import desenhar_cartao, desenhar_folha
+        from .services.layout_cartao import codigo_qr, layout_cartao
+        from .services.omr_lote import corrigir_lote
+
+        av, layout = self.dados['avaliacao'], layout_cartao(3)
+        alunos = [(self.matriculas[0], {1: 'B', 2: 'C', 3: 'D'}), (self.matriculas[1], {1: 'B'}), (self.de_fora, {1: 'B'})]
+        folha = desenhar_folha([desenhar_cartao(layout, codigo_qr(av.id, mat.id, 3), m, 3) for mat, m in alunos], 3)
+        eventos = list(corrigir_lote([('Página 1', cv2.imencode('.jpg', folha)[1].tobytes())], av, workers=1))
+
+        correcoes = {e['matricula_id']: e for e in eventos if e['tipo'] == 'correcao'}
+        self.assertEqual([e['pagina'] for e in eventos if e['tipo'] == 'leitura'], [f"Página 1 · cartão {n}" for n in (1, 2, 3)])
+        self.assertEqual((correcoes[self.matriculas[0].id]['acertos'], correcoes[self.matriculas[1].id]['acertos']), (3, 1))
+        self.assertEqual(correcoes[self.de_fora.id]['status'], 'matricula_invalida')
+        self.assertEqual(eventos[-1]['corrigidos'], 2)
+
+    def test_lote_na_tela_sem_fila_recusado(self):
+        from unittest import mock
+        from django.core.files.uploadedfile import SimpleUploadedFile
+        from django.test import override_settings
+
+        self.client.force_login(User.objects.get(username='professor'))
+        url = reverse('corrigir_cartoes_lote', args=[self.dados['avaliacao'].id])
+        with override_settings(OMR_FILA=False, OMR_LOTE_PROCESSOS=0), mock.patch('core.views.corrigir_lote') as lote:
+            resposta = self.client.post(url, {'arquivo': SimpleUploadedFile('turma.zip', b'PK')}).json()
+        self.assertFalse(resposta['sucesso'])
+        self.assertIn('OMR_FILA', resposta['erro'])
+        lote.assert_not_called()
+
+    def test_lote_pela_fila_lido_no_worker(self):
+        from io import StringIO
+        from unittest import mock
+        import cv2
+        from django.core.management import call_command
+        from .services.cartoes_sinteticos import desenhar_cartao, desenhar_folha
+        from .services.layout_cartao import codigo_qr, layout_cartao
+        from .services.omr_lote import corrigir_lote
+
+        av, layout = self.dados['avaliacao'], layout_cartao(3)
+        folha = desenhar_folha([desenhar_cartao(layout, codigo_qr(av.id, mat.id, 3), {1: 'B'}, 3) for mat in self.matriculas[:2]], 3)
+        paginas = [('Página 1', cv2.imencode('.jpg', folha)[1].tobytes()), ('Página 2', b'')]
+
+        # O worker_omr "roda" enquanto a view espera; no processo web nada de pool nem de OpenCV
+        def worker(_):
+            call_command('worker_omr', processos=1, uma_vez=True, stdout=StringIO())
+
+        with mock.patch('core.services.fila_omr.time.sleep', side_effect=worker), \
+                mock.patch('core.services.omr_lote.ProcessPoolExecutor') as pool, \
+                mock.patch('core.services.omr_lote.OMRScanner') as scanner:
+            eventos = list(corrigir_lote(paginas, av, fila=True, timeout=60))
+        pool.assert_not_called()
+        scanner.assert_not_called()
+
+        leituras = [e['pagina'] for e in eventos if e['tipo'] == 'leitura']
+        self.assertEqual(sorted(leituras), ['Página 1 · cartão 1', 'Página 1 · cartão 2', 'Página 2'])
+        self.assertEqual(eventos[-1]['corrigidos'], 2)
+        self.assertEqual(TarefaOMR.objects.get().status, 'CONCLUIDA')
+
+        # Sem worker rodando, a página estoura o prazo e vira erro em vez de prender a tela
+        with mock.patch('core.services.fila_omr.time.sleep'):
+            eventos = list(corrigir_lote(paginas[:1], av, fila=True, timeout=0))
+        self.assertEqual(eventos[-1]['por_status'], {'erro': 1})
+
+
+def foto_cartao(qr, marcadas, qtd_itens=10):
+    """Foto sintética de cartão: QR no canto e uma linha de 5 bolinhas por questão."""
+    import cv2
+    import numpy as np
+    import qrcode
+
+    img = np.full((1600, 1200, 3), 255, np.uint8)
+    img[40:260, 900:1120] = np.array(qrcode.make(qr).convert('RGB').resize((220, 220)))
+    for i in range(qtd_itens):
+        for j in range(5):
+            centro = (300 + j * 60, 350 + i * 60)
+            cv2.circle(img, centro, 18, (0, 0, 0), 2)
+            if marcadas.get(i + 1) == 'ABCDE'[j]:
+                cv2.circle(img, centro, 15, (0, 0, 0), -1)
+    return cv2.imencode('.jpg', img)[1].tobytes()
+
+
+class LeituraCartaoMemoriaTests(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.escola = semear_escola(qtd_turmas=1, alunos_por_turma=1)
+        cls.dados = cls.escola['turmas'][0]
+        cls.matricula = Matricula.objects.get(turma=cls.dados['turma'])
+
+    def test_upload_lido_da_memoria_sem_tocar_no_disco(self):
+        import os
+        from unittest import mock
+        from django.core.files.uploadedfile import SimpleUploadedFile
+
+        foto = foto_cartao(f"A{self.dados['avaliacao'].id}-M{self.matricula.id}", {1: 'B', 2: 'C'})
+        self.client.force_login(User.objects.get(username='professor'))
+        with mock.patch('cv2.imwrite') as imwrite, mock.patch('cv2.imread') as imread:
+            resposta = self.client.post(reverse('api_ler_cartao'), {
+                'foto': SimpleUploadedFile('cartao.jpg', foto, content_type='image/jpeg'),
+                'avaliacao_id': self.dados['avaliacao'].id,
+            }).json()
+        self.assertEqual(resposta['matricula_detected_id'], self.matricula.id)
+        self.assertEqual({k: resposta['respostas'][k] for k in ('1', '2')}, {'1': 'B', '2': 'C'})
+        imwrite.assert_not_called()
+        imread.assert_not_called()
+        self.assertFalse(os.path.exists('media/temp') and any(f.endswith('.jpg') for f in os.listdir('media/temp')))
+
+    def test_depuracao_por_amostra_grava_em_segundo_plano(self):
+        import os
+        import tempfile
+        from django.test import override_settings
+        from .services.omr_scanner import OMRScanner, gravador_debug
+
+        foto = foto_cartao("A1-M1", {1: 'A'})
+        with tempfile.TemporaryDirectory() as pasta, override_settings(OMR_DEBUG_DIR=pasta):
+            OMRScanner(debug_mode=True, amostra_debug=0).processar_cartao(foto)
+            OMRScanner(debug_mode=True, amostra_debug=1).processar_cartao(foto)
+            gravador_debug.fila.join()
+            arquivos = sorted(f.split('_', 1)[1] for f in os.listdir(pasta))
+        self.assertEqual(arquivos, ['01_warped.jpg', '02_thresh.jpg', '03_bolinhas.jpg', '04_final.jpg'])
+
+    def test_preenchimento_no_recorte_igual_ao_da_pagina_inteira(self):
+        import cv2
+        import numpy as np
+        from .services.omr_scanner import OMRScanner, KERNEL_MIOLO
+
+        thresh = (np.random.default_rng(7).random((300, 200)) > 0.5).astype(np.uint8) * 255
+        for centro in ((100, 150), (10, 12), (195, 290)):  # no meio e encostadas na borda
+            desenho = np.zeros_like(thresh)
+            cv2.circle(desenho, centro, 16, 255, -1)
+            c = cv2.findContours(desenho, cv2.RETR_EXTERNAL, cv2.CHAIN_APPROX_SIMPLE)[0][0]
+
+            mascara = cv2.erode(cv2.drawContours(np.zeros_like(thresh), [c], -1, 255, -1), KERNEL_MIOLO)
+            esperado = cv2.countNonZero(cv2.bitwise_and(thresh, mascara)) / cv2.countNonZero(mascara)
+            self.assertEqual(OMRScanner()._preenchimento(thresh, (c, *cv2.boundingRect(c))), esperado)
+
+    def test_cartao_antigo_segue_o_limiar_do_layout(self):
+        from unittest import mock
+        from .services.omr_scanner import OMRScanner
+
+        foto = foto_cartao("A1-M1", {1: 'B', 2: 'D'})
+        leitura = OMRScanner().processar_cartao(foto, qtd_questoes=10, checar_qualidade=False)
+        self.assertEqual({k: leitura['respostas'][k] for k in (1, 2)}, {1: 'B', 2: 'D'})
+        # Um limiar só para os dois leitores: subir LIMIAR_MARCADA vale também para o contorno antigo
+        with mock.patch('core.services.omr_scanner.LIMIAR_MARCADA', 1.0):
+            leitura = OMRScanner().processar_cartao(foto, qtd_questoes=10, checar_qualidade=False)
+        self.assertEqual(leitura['respostas'], {})
+
+
+class QualidadeFotoTests(TestCase):
+
+    def setUp(self):
+        import cv2
+        import numpy as np
+        self.foto = cv2.imdecode(np.frombuffer(foto_cartao("A1-M1", {1: 'A', 2: 'B'}), np.uint8), cv2.IMREAD_COLOR)
+
+    def test_foto_boa_passa_pela_triagem(self):
+        from .services.omr_scanner import OMRScanner
+        self.assertIsNone(OMRScanner().avaliar_qualidade(self.foto))
+
+    def test_foto_tremida_pequena_ou_com_reflexo_recusada(self):
+        import cv2
+        import numpy as np
+        from .services.omr_scanner import OMRScanner
+
+        papel_escuro = (self.foto * 0.85).astype(np.uint8)
+        com_reflexo = cv2.ellipse(papel_escuro.copy(), (600, 800), (300, 200), 0, 0, 360, (255, 255, 255), -1)
+        casos = {
+            'desfocada': cv2.GaussianBlur(self.foto, (0, 0), 8),
+            'resolucao': cv2.resize(self.foto, (240, 320)),
+            'reflexo': com_reflexo,
+        }
+        for motivo, foto in casos.items():
+            leitura = OMRScanner().processar_cartao(foto)
+            self.assertFalse(leitura['sucesso'])
+            self.assertTrue(leitura['refazer_foto'])
+            self.assertEqual(leitura['motivo'], motivo)
+        self.assertIsNone(OMRScanner().avaliar_qualidade(papel_escuro))
+
+    def test_api_responde_antes_de_ler_o_cartao(self):
+        import cv2
+        from unittest import mock
+        from django.core.files.uploadedfile import SimpleUploadedFile
+
+        semear_escola(qtd_turmas=1, alunos_por_turma=1)
+        tremida = cv2.imencode('.jpg', cv2.GaussianBlur(self.foto, (0, 0), 8))[1].tobytes()
+        self.client.force_login(User.objects.get(username='professor'))
+        with mock.patch('core.services.omr_scanner.OMRScanner.processar_cartao') as processar:
+            resposta = self.client.post(reverse('api_ler_cartao'), {
+                'foto': SimpleUploadedFile('cartao.jpg', tremida, content_type='image/jpeg'),
+            }).json()
+        processar.assert_not_called()
+        self.assertEqual(resposta['motivo'], 'desfocada')
+        self.assertIn('fotografe de novo', resposta['erro'])
+
+
+def ler_ou_derrubar(tarefa):
+    """ler_tarefa que mata o processo filho numa imagem 'derruba' (segfault do cv2, OOM)."""
+    import os
+    from .services.fila_omr import ler_tarefa
+    if bytes(tarefa[1]) == b'derruba':
+        os._exit(1)
+    return ler_tarefa(tarefa)
+
+
+class FilaOMRTests(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.escola = semear_escola(qtd_turmas=1, alunos_por_turma=1)
+        cls.dados = cls.escola['turmas'][0]
+        cls.matricula = Matricula.objects.get(turma=cls.dados['turma'])
+
+    def test_api_enfileira_e_worker_le(self):
+        from io import StringIO
+        from django.core.files.uploadedfile import SimpleUploadedFile
+        from django.core.management import call_command
+        from django.test import override_settings
+        from .services import fila_omr
+
+        foto = foto_cartao(f"A{self.dados['avaliacao'].id}-M{self.matricula.id}", {1: 'D', 2: 'A'})
+        self.client.force_login(User.objects.get(username='professor'))
+        with override_settings(OMR_FILA=True, OMR_FILA_ESPERA=0):
+            resposta = self.client.post(reverse('api_ler_cartao'), {
+                'foto': SimpleUploadedFile('cartao.jpg', foto, content_type='image/jpeg'),
+                'avaliacao_id': self.dados['avaliacao'].id,
+            })
+        self.assertEqual(resposta.status_code, 202)
+        tarefa_id = resposta.json()['tarefa_id']
+        self.assertEqual(self.client.get(reverse('api_resultado_leitura', args=[tarefa_id])).status_code, 202)
+
+        call_command('worker_omr', processos=1, uma_vez=True, stdout=StringIO())
+
+        leitura = self.client.get(reverse('api_resultado_leitura', args=[tarefa_id])).json()
+        self.assertEqual(leitura['matricula_detected_id'], self.matricula.id)
+        self.assertEqual({k: leitura['respostas'][k] for k in ('1', '2')}, {'1': 'D', '2': 'A'})
+        tarefa = TarefaOMR.objects.get(id=tarefa_id)
+        self.assertEqual(tarefa.status, 'CONCLUIDA')
+        self.assertEqual(bytes(tarefa.imagem), b'')
+        # Resultado de outra pessoa não aparece; sem login, nem tarefa sem dono
+        self.client.force_login(User.objects.get(username='gestao'))
+        self.assertEqual(self.client.get(reverse('api_resultado_leitura', args=[tarefa_id])).status_code, 404)
+        anonima = fila_omr.enfileirar(b'x', 10)
+        self.client.logout()
+        self.assertEqual(self.client.get(reverse('api_resultado_leitura', args=[anonima.id])).status_code, 302)
+
+    def test_processo_que_cai_nao_derruba_o_worker(self):
+        from io import StringIO
+        from unittest import mock
+        from django.core.management import call_command
+        from .services import fila_omr
+
+        envenenada = fila_omr.enfileirar(b'derruba', 10)
+        boa = fila_omr.enfileirar(b'x', 10)
+        saida = StringIO()
+        with mock.patch('core.management.commands.worker_omr.ler_tarefa', ler_ou_derrubar):
+            call_command('worker_omr', processos=2, uma_vez=True, stdout=saida)
+
+        # Na 1ª queda as duas voltam para a fila; a que cai de novo vira erro e o worker segue
+        self.assertIn('pool de leitura caiu', saida.getvalue())
+        self.assertEqual(TarefaOMR.objects.get(id=envenenada.id).status, 'ERRO')
+        self.assertIn(TarefaOMR.objects.get(id=boa.id).status, ('CONCLUIDA', 'ERRO'))
+        self.assertFalse(TarefaOMR.objects.filter(status__in=['PENDENTE', 'LENDO']).exists())
+
+    def test_cada_tarefa_reservada_uma_vez_e_travadas_voltam(self):
+        from datetime import timedelta
+        from django.utils import timezone
+        from .services import fila_omr
+
+        ids = [fila_omr.enfileirar(b'x', 10).id for _ in range(3)]
+        primeira = fila_omr.reservar(2)
+        segunda = fila_omr.reservar(2)
+        self.assertEqual([t[0] for t in primeira], ids[:2])
+        self.assertEqual([t[0] for t in segunda], ids[2:])
+        self.assertEqual(fila_omr.reservar(2), [])
+
+        TarefaOMR.objects.filter(id=ids[0]).update(iniciado_em=timezone.now() - timedelta(hours=1))
+        self.assertEqual(fila_omr.recuperar_travadas(), 1)
+        self.assertEqual([t[0] for t in fila_omr.reservar(5)], [ids[0]])
+
+
+def foto_cartao_layout(layout, qr, marcadas, px_por_ponto=4, angulo=6, lixo=False):
+    """
+    Cartão desenhado com o mesmo layout do PDF, girado sobre um fundo escuro (como numa foto).
+    Com `lixo`, a mesa ganha papéis claros com quadrados pretos parecidos com os marcadores.
+    """
+    import cv2
+    import numpy as np
+    from .services.cartoes_sinteticos import desenhar_cartao
+
+    img = desenhar_cartao(layout, qr, marcadas, px_por_ponto, tinta=30)
+    altura, largura = img.shape[:2]
+    fundo = np.full((int(altura * 1.4), int(largura * 1.4), 3), (70, 90, 110), np.uint8)
+    dy, dx = (fundo.shape[0] - altura) // 2, (fundo.shape[1] - largura) // 2
+    fundo[dy:dy + altura, dx:dx + largura] = img
+    if lixo:
+        lado = int(layout['marcador'] * px_por_ponto)
+        for x in range(0, fundo.shape[1] - 4 * lado, 4 * lado):
+            for y in (lado // 2, fundo.shape[0] - 4 * lado):
+                cv2.rectangle(fundo, (x, y), (x + 3 * lado, y + 3 * lado), (245, 245, 245), -1)
+                cv2.rectangle(fundo, (x + lado, y + lado), (x + 2 * lado, y + 2 * lado), (0, 0, 0), -1)
+    giro = cv2.getRotationMatrix2D((fundo.shape[1] / 2, fundo.shape[0] / 2), angulo, 1)
+    fundo = cv2.warpAffine(fundo, giro, fundo.shape[1::-1], borderValue=(70, 90, 110))
+    return cv2.imencode('.jpg', fundo)[1].tobytes()
+
+
+class LayoutCartaoTests(TestCase):
+
+    def test_corpus_sintetico_lido_e_conferido(self):
+        from .services.cartoes_sinteticos import conferir_leitura, gerar_corpus
+        from .services.omr_scanner import OMRScanner
+
+        scanner = OMRScanner()
+        for item in gerar_corpus(4, qtd_questoes=10, semente=7):
+            leitura = scanner.processar_cartao(item['jpg'], qtd_questoes=10)
+            self.assertEqual(leitura['qr_code'], item['qr'])
+            conferencia = conferir_leitura(item['verdade'], leitura['respostas'], 10)
+            self.assertEqual((conferencia['fp'], conferencia['fn']), (0, 0))
+            self.assertTrue({'qualidade', 'qr', 'marcadores', 'leitura'} <= set(scanner.tempos))
+
+    def test_conferencia_por_bolinha(self):
+        from .services.cartoes_sinteticos import conferir_leitura
+
+        verdade = {1: {'A'}, 2: {'B', 'C'}, 3: {'D'}}
+        conferencia = conferir_leitura(verdade, {'1': 'A', '2': 'NULA', '3': 'E', '4': 'NULA'}, 4)
+        self.assertEqual(conferencia, {'questoes': 4, 'certas': 2, 'vp': 3, 'fp': 2, 'fn': 1})
+
+    def test_leitura_pelas_coordenadas_do_layout(self):
+        from .services.layout_cartao import codigo_qr, layout_cartao
+        from .services.omr_scanner import OMRScanner
+
+        layout = layout_cartao(30)
+        marcadas = {n: 'ABCDE'[n % 5] for n in range(1, 31) if n % 7}
+        leitura = OMRScanner().processar_cartao(foto_cartao_layout(layout, codigo_qr(3, 8, 30), marcadas))
+        self.assertEqual(leitura['metodo'], 'layout')
+        self.assertEqual(leitura['qr_code'], 'A3-M8-L1-Q30')
+        self.assertEqual(leitura['respostas'], marcadas)
+
+    def test_marcadores_achados_mesmo_com_a_mesa_baguncada(self):
+        from .services.layout_cartao import codigo_qr, layout_cartao
+        from .services.omr_scanner import OMRScanner
+
+        layout = layout_cartao(20)
+        marcadas = {n: 'EDCBA'[n % 5] for n in range(1, 21)}
+        leitura = OMRScanner().processar_cartao(foto_cartao_layout(layout, codigo_qr(3, 8, 20), marcadas, lixo=True))
+        self.assertEqual(leitura['metodo'], 'layout')
+        self.assertEqual(leitura['respostas'], marcadas)
+
+    def test_cartao_antigo_endireitado_pelos_marcadores(self):
+        from .services.layout_cartao import layout_cartao
+        from .services.omr_scanner import OMRScanner
+
+        layout = layout_cartao(20)
+        marcadas = {n: 'ABCDE'[n % 5] for n in range(1, 21) if n % 4}
+        foto = foto_cartao_layout(layout, 'A3-M8', marcadas, angulo=9, lixo=True)
+        leitura = OMRScanner().processar_cartao(foto, qtd_questoes=20)
+        self.assertTrue(leitura['sucesso'])
+        self.assertEqual(leitura['qr_code'], 'A3-M8')
+        self.assertEqual(leitura['respostas'], marcadas)
+
+    def test_foto_de_cabeca_para_baixo_ou_deitada_endireitada_pelo_qr(self):
+        import cv2
+        import numpy as np
+        from .services.layout_cartao import codigo_qr, layout_cartao
+        from .services.omr_scanner import OMRScanner
+
+        layout = layout_cartao(20)
+        marcadas = {n: 'ABCDE'[(n * 3) % 5] for n in range(1, 21) if n % 6}
+        foto = cv2.imdecode(np.frombuffer(foto_cartao_layout(layout, codigo_qr(3, 8, 20), marcadas), np.uint8), cv2.IMREAD_COLOR)
+        for giro in (cv2.ROTATE_180, cv2.ROTATE_90_CLOCKWISE, cv2.ROTATE_90_COUNTERCLOCKWISE):
+            leitura = OMRScanner().processar_cartao(cv2.rotate(foto, giro))
+            self.assertEqual(leitura['metodo'], 'layout')
+            self.assertEqual(leitura['respostas'], marcadas)
+
+    def test_folha_com_quatro_cartoes_lida_de_uma_vez(self):
+        import cv2
+        from .services.cartoes_sinteticos import desenhar_cartao, desenhar_folha
+        from .services.layout_cartao import codigo_qr, layout_cartao
+        from .services.omr_scanner import OMRScanner
+
+        layout = layout_cartao(30)
+        marcadas = [{n: 'ABCDE'[(n + i) % 5] for n in range(1, 31) if (n + i) % 6} for i in range(4)]
+        folha = desenhar_folha([desenhar_cartao(layout, codigo_qr(3, 10 + i, 30), m, 3) for i, m in enumerate(marcadas)], 3)
+        # Folha digitalizada de cabeça para baixo: a ordem de leitura segue a imagem
+        leituras = OMRScanner().processar_folha(cv2.imencode('.jpg', cv2.rotate(folha, cv2.ROTATE_180))[1].tobytes())
+        self.assertEqual([l['qr_code'] for l in leituras], [codigo_qr(3, 10 + i, 30) for i in (3, 2, 1, 0)])
+        self.assertEqual([l['respostas'] for l in leituras], marcadas[::-1])
+
+    def test_cartao_da_folha_sem_qr_legivel_vira_erro_na_posicao(self):
+        import cv2
+        from .services.cartoes_sinteticos import desenhar_cartao, desenhar_folha
+        from .services.layout_cartao import codigo_qr, layout_cartao
+        from .services.omr_scanner import OMRScanner
+
+        layout = layout_cartao(10)
+        cartoes = [desenhar_cartao(layout, codigo_qr(3, 10 + i, 10), {1: 'A'}, 3) for i in range(3)]
+        qx, qy, lado = (int(v * 3) for v in layout['qr'])
+        topo = cartoes[0].shape[0] - qy - lado
+        for cartao in cartoes[1:]:
+            cartao[topo:topo + lado, qx:qx + lado] = 255  # QR apagado (borrão, dobra)
+        folha = desenhar_folha(cartoes, 3)
+
+        # Um QR lido, dois perdidos, a 4ª posição em branco (última folha da turma)
+        leituras = OMRScanner().processar_folha(cv2.imencode('.jpg', folha)[1].tobytes())
+        self.assertEqual([(l['posicao'], l['sucesso']) for l in leituras], [(1, True), (2, False), (3, False)])
+        self.assertEqual(leituras[0]['qr_code'], codigo_qr(3, 10, 10))
+        self.assertIn('Cartão 2 da folha', leituras[1]['erro'])
+
+        # Nenhum QR lido: ainda um erro por cartão impresso, não uma leitura só
+        cartoes[0][topo:topo + lado, qx:qx + lado] = 255
+        leituras = OMRScanner().processar_folha(cv2.imencode('.jpg', desenhar_folha(cartoes, 3))[1].tobytes())
+        self.assertEqual([(l['posicao'], l['sucesso']) for l in leituras], [(1, False), (2, False), (3, False)])
+
+    def test_qr_com_versao_do_layout_e_compativel_com_o_antigo(self):
+        from .services.layout_cartao import ler_codigo_qr
+
+        self.assertEqual(ler_codigo_qr('A3-M8-L1-Q30'), {'avaliacao_id': 3, 'matricula_id': 8, 'versao': 1, 'total_questoes': 30})
+        self.assertEqual(ler_codigo_qr('A3-M8')['versao'], None)
+        self.assertIsNone(ler_codigo_qr('cartao sem prova'))
+
+    def test_pdf_de_cartoes_marca_a_versao_do_layout(self):
+        import io
+        from pypdf import PdfReader
+
+        escola = semear_escola(qtd_turmas=1, alunos_por_turma=5)
+        self.client.force_login(User.objects.get(username='professor'))
+        resposta = self.client.get(reverse('gerar_cartoes_pdf', args=[escola['turmas'][0]['avaliacao'].id]))
+        pdf = PdfReader(io.BytesIO(b''.join(resposta.streaming_content)))
+        self.assertEqual(len(pdf.pages), 2)
+        self.assertEqual(pdf.metadata.get('/Keywords'), 'sami-layout-v1')
+
+    def test_cartao_recusa_prova_maior_que_o_layout(self):
+        from django.contrib.messages import get_messages
+        from .services.layout_cartao import MAX_QUESTOES, layout_cartao
+
+        # Até o limite, toda bolinha fica dentro do cartão e acima do QR do pé
+        layout = layout_cartao(MAX_QUESTOES)
+        _, qy, lado = layout['qr']
+        for questao in layout['questoes']:
+            for x, y in questao['bolinhas']:
+                self.assertGreater(y - layout['raio_bolinha'], qy + lado)
+                self.assertLess(x + layout['raio_bolinha'], layout['largura'])
+        with self.assertRaises(ValueError):
+            layout_cartao(MAX_QUESTOES + 1)
 
-# Create your tests here.
+        escola = semear_escola(qtd_turmas=1, alunos_por_turma=1, qtd_itens=MAX_QUESTOES + 1)
+        self.client.force_login(User.objects.get(username='professor'))
+        resposta = self.client.get(reverse('gerar_cartoes_pdf', args=[escola['turmas'][0]['avaliacao'].id]))
+        self.assertRedirects(resposta, reverse('gerenciar_avaliacoes'), fetch_redirect_response=False)
+        self.assertIn(f"até {MAX_QUESTOES} questões", str(list(get_messages(resposta.wsgi_request))[0]))
@@ -1,8 +1,8 @@
 import io
 import os
-import uuid
 import json
 import csv
+import logging
 import re
 import qrcode
 import unicodedata
@@ -13,6 +13,7 @@ from datetime import datetime
 from io import StringIO, BytesIO
 
 # Django Imports
+from django.conf import settings
 from django.contrib import messages
 from django.contrib.auth import logout, update_session_auth_hash
 from django.contrib.auth.decorators import login_required, user_passes_test
@@ -20,7 +21,7 @@ from django.core.paginator import Paginator
 from django.db.models import Avg, Count, Sum, Q, F, Prefetch
 from django.db import transaction
 from django.db.models.functions import Coalesce
-from django.http import FileResponse, JsonResponse, HttpResponse
+from django.http import FileResponse, JsonResponse, HttpResponse, StreamingHttpResponse
 from django.utils import timezone
 from django.shortcuts import render, redirect, get_object_or_404
 from django.template.loader import render_to_string
@@ -42,7 +43,7 @@ from .models import (
     Turma, Resultado, Avaliacao, Questao, Aluno, Disciplina, 
     RespostaDetalhada, ItemGabarito, Descritor, NDI, PlanoEnsino,
     TopicoPlano, ConfiguracaoSistema, Tutorial, CategoriaAjuda, Matricula,
-    Professor, Alocacao 
+    Professor, Alocacao, ProficienciaItem, TarefaOMR
 )
 from .forms import (
     AvaliacaoForm, ResultadoForm, GerarProvaForm, ImportarQuestoesForm, 
@@ -51,9 +52,26 @@ from .forms import (
 
 from .services.ai_generator import gerar_questao_ia
 from .services.omr_scanner import OMRScanner
+from .services.layout_cartao import layout_cartao, posicoes_na_folha, codigo_qr, ALTERNATIVAS
+from .services.cache_dashboard import chave_dashboard, versao_dados, obter_ou_calcular
+from .services.escopo import filtrar_escopo, pares_escopo
+from .services.vetor_respostas import mapa_acertos, letras_marcadas, descartar_vetores
+from .services.correcao import (
+    montar_sessao_lancamento, mesclar_alteracoes, sincronizar_lancamentos, recorrigir_avaliacoes, corrigir_turma,
+    gravar_correcoes, carregar_gabarito, contar_provas_lancadas
+)
+from .services.omr_lote import extrair_paginas, corrigir_lote, LIMITE_BYTES_LOTE
+from .services import fila_omr
+from .services.importacao_respostas import preparar_importacao, aplicar_importacao
+from .services.proficiencia import (
+    atualizar_proficiencia, sincronizar_descritores, proficiencia_por_descritor, ranking_por_item,
+    proficiencia_por_descritor_respostas, ranking_por_item_respostas
+)
 from django.core.exceptions import PermissionDenied
 from django.contrib.auth.decorators import user_passes_test, login_required
 
+logger = logging.getLogger(__name__)
+
 # ==============================================================================
 # 🛡️ CADEADOS DE SEGURANÇA (RBAC - ROLE-BASED ACCESS CONTROL)
 # ==============================================================================
@@ -192,67 +210,8 @@ def scanner_dificuldade(valor):
 # 📊 DASHBOARD OTIMIZADO 2.0 
 # ==============================================================================
 
-@user_passes_test(prof_ou_admin_check, login_url='/redirecionar/')
-def dashboard(request):
-    import json
-    from django.db.models import Avg, Count, Q
-    from django.db.models.functions import Coalesce
-
-    # --- 1. FILTROS ---
-    serie_id = request.GET.get('serie')
-    turma_id = request.GET.get('turma')
-    aluno_id = request.GET.get('aluno')
-    avaliacao_id = request.GET.get('avaliacao')
-    disciplina_id = request.GET.get('disciplina')
-    data_inicio = request.GET.get('data_inicio')
-    data_fim = request.GET.get('data_fim')
-    
-    # Base: Resultados
-    resultados = Resultado.objects.all()
-
-    # Listas para os filtros na tela (Dropdowns)
-    turmas_dropdown = Turma.objects.all().order_by('nome')
-    disciplinas_dropdown = Disciplina.objects.all().order_by('nome')
-    avaliacoes_dropdown = Avaliacao.objects.all().order_by('-data_aplicacao')
-
-    # 🔥 A MÁGICA DA SEGURANÇA (O CADEADO COMPARTILHADO AQUI TAMBÉM) 🔥
-    if hasattr(request.user, 'professor_perfil'):
-        perfil = request.user.professor_perfil
-        
-        alocacoes_do_prof = perfil.alocacoes.all()
-        
-        # Filtro para os resultados (Notas)
-        query_compartilhada_res = Q()
-        for aloc in alocacoes_do_prof:
-            query_compartilhada_res |= Q(avaliacao__alocacao__turma=aloc.turma, avaliacao__alocacao__disciplina=aloc.disciplina)
-            
-        # Filtro para a lista suspensa de provas (Avaliações)
-        query_compartilhada_av = Q()
-        for aloc in alocacoes_do_prof:
-            query_compartilhada_av |= Q(alocacao__turma=aloc.turma, alocacao__disciplina=aloc.disciplina)
-
-        if alocacoes_do_prof.exists():
-            resultados = resultados.filter(query_compartilhada_res)
-            avaliacoes_dropdown = avaliacoes_dropdown.filter(query_compartilhada_av).distinct()
-        else:
-            resultados = resultados.none()
-            avaliacoes_dropdown = avaliacoes_dropdown.none()
-        
-        # O professor só vê as turmas e disciplinas dele
-        turmas_dropdown = turmas_dropdown.filter(alocacoes__professor=perfil).distinct()
-        disciplinas_dropdown = disciplinas_dropdown.filter(alocacoes__professor=perfil).distinct()
-
-    # Aplica os filtros escolhidos pelo usuário
-    if disciplina_id: resultados = resultados.filter(avaliacao__alocacao__disciplina_id=disciplina_id)
-    if serie_id: resultados = resultados.filter(avaliacao__alocacao__turma__nome__startswith=serie_id)
-    if turma_id: resultados = resultados.filter(avaliacao__alocacao__turma_id=turma_id)
-    if aluno_id: resultados = resultados.filter(matricula__aluno_id=aluno_id)
-    if avaliacao_id: resultados = resultados.filter(avaliacao_id=avaliacao_id)
-    if data_inicio: resultados = resultados.filter(avaliacao__data_aplicacao__gte=data_inicio)
-    if data_fim: resultados = resultados.filter(avaliacao__data_aplicacao__lte=data_fim)
-
-    # --- 2. PROCESSAMENTO OTIMIZADO ---
-
+def calcular_indicadores_dashboard(resultados, fatos, aluno_id=None, avaliacao_id=None):
+    """Todos os números do Dashboard (KPIs, pizza, proficiência, rankings, evolução e heatmap)."""
     # A. KPI & PIZZA
     kpis = resultados.aggregate(
         total=Count('id'),
@@ -292,43 +251,31 @@ def dashboard(request):
     
     detalhes_pizza_json = json.dumps(detalhes_pizza)
 
-    # B. PROFICIÊNCIA POR DESCRITOR
-    respostas_base = RespostaDetalhada.objects.filter(resultado__in=resultados)
-    
-    stats_desc = respostas_base.annotate(
-        cod_final=Coalesce('item_gabarito__descritor__codigo', 'questao__descritor__codigo')
-    ).values('cod_final').annotate(
-        total=Count('id'),
-        acertos=Count('id', filter=Q(acertou=True))
-    ).order_by('cod_final')
+    # B. PROFICIÊNCIA POR DESCRITOR (lida da tabela-fato consolidada)
+    # A tabela-fato não guarda aluno: com filtro de aluno as respostas dele são lidas direto.
+    if aluno_id:
+        respostas_base = RespostaDetalhada.objects.filter(resultado__in=resultados)
+        stats_desc = proficiencia_por_descritor_respostas(respostas_base)
+        ranking_q = ranking_por_item_respostas(respostas_base)
+    else:
+        stats_desc = proficiencia_por_descritor(fatos)
+        ranking_q = ranking_por_item(fatos)
 
     labels_proficiencia = []
     dados_proficiencia = []
     
     for item in stats_desc:
-        cod = item['cod_final']
+        cod = item['cod']
         if cod: 
             perc = (item['acertos'] / item['total']) * 100 if item['total'] > 0 else 0
             labels_proficiencia.append(cod)
             dados_proficiencia.append(round(perc, 1))
 
     # C. RANKING DE QUESTÕES
-    ranking_q = respostas_base.annotate(
-        desc_final=Coalesce('item_gabarito__descritor__codigo', 'questao__descritor__codigo')
-    ).values(
-        'desc_final',
-        'questao__enunciado',
-        'item_gabarito__questao_banco__enunciado',
-        'item_gabarito__numero'
-    ).annotate(
-        total=Count('id'),
-        acertos=Count('id', filter=Q(acertou=True))
-    )
-
     lista_questoes = []
     for r in ranking_q:
         if r['total'] > 0:
-            texto = r['questao__enunciado'] or r['item_gabarito__questao_banco__enunciado'] or f"Questão {r.get('item_gabarito__numero')}"
+            texto = r['enunciado'] or r['enunciado_banco'] or f"Questão {r.get('numero')}"
             desc = r['desc_final'] or "Geral"
             perc = (r['acertos'] / r['total']) * 100
             lista_questoes.append({
@@ -355,14 +302,11 @@ def dashboard(request):
     if avaliacao_id:
         try:
             av = Avaliacao.objects.get(id=avaliacao_id)
-            itens_heatmap = ItemGabarito.objects.filter(avaliacao=av).select_related('descritor').order_by('numero')
-            res_heat = resultados.select_related('matricula__aluno').order_by('matricula__aluno__nome_completo')
+            itens_heatmap = list(ItemGabarito.objects.filter(avaliacao=av).select_related('descritor').order_by('numero'))
+            res_heat = list(resultados.select_related('matricula__aluno').order_by('matricula__aluno__nome_completo'))
             
-            respostas_all = RespostaDetalhada.objects.filter(resultado__in=res_heat).values('resultado_id', 'item_gabarito_id', 'acertou')
-            mapa_geral = {}
-            for r in respostas_all:
-                if r['resultado_id'] not in mapa_geral: mapa_geral[r['resultado_id']] = {}
-                mapa_geral[r['resultado_id']][r['item_gabarito_id']] = r['acertou']
+            # Matriz lida do vetor compacto de cada Resultado (mesma consulta)
+            mapa_geral = mapa_acertos(res_heat, itens_heatmap)
 
             for r in res_heat:
                 mapa_aluno = mapa_geral.get(r.id, {})
@@ -372,6 +316,87 @@ def dashboard(request):
                 matriz_calor.append(linha)
         except: pass
 
+    return {
+        'total_avaliacoes_contagem': count_avaliados,
+        'media_geral': media_geral, 'nivel_predominante': nivel_predominante, 'qtd_provas': qtd_provas,
+        'dados_pizza': dados_pizza, 'detalhes_pizza_json': detalhes_pizza_json,
+        'labels_evolucao': labels_evolucao, 'dados_evolucao': dados_evolucao,
+        'labels_proficiencia': labels_proficiencia, 'dados_proficiencia': dados_proficiencia,
+        'ranking_facil': ranking_facil, 'ranking_dificil': ranking_dificil,
+        'itens_heatmap': itens_heatmap, 'matriz_calor': matriz_calor,
+    }
+
+@user_passes_test(prof_ou_admin_check, login_url='/redirecionar/')
+def dashboard(request):
+    import json
+    from django.db.models import Avg, Count, Q
+    from django.db.models.functions import Coalesce
+
+    # --- 1. FILTROS ---
+    serie_id = request.GET.get('serie')
+    turma_id = request.GET.get('turma')
+    aluno_id = request.GET.get('aluno')
+    avaliacao_id = request.GET.get('avaliacao')
+    disciplina_id = request.GET.get('disciplina')
+    data_inicio = request.GET.get('data_inicio')
+    data_fim = request.GET.get('data_fim')
+    
+    # Base: Resultados
+    resultados = Resultado.objects.all()
+
+    # Listas para os filtros na tela (Dropdowns)
+    turmas_dropdown = Turma.objects.all().order_by('nome')
+    disciplinas_dropdown = Disciplina.objects.all().order_by('nome')
+    avaliacoes_dropdown = Avaliacao.objects.all().order_by('-data_aplicacao')
+
+    # 🔥 A MÁGICA DA SEGURANÇA (O CADEADO COMPARTILHADO AQUI TAMBÉM) 🔥
+    if hasattr(request.user, 'professor_perfil'):
+        perfil = request.user.professor_perfil
+        
+        # Notas e provas das turmas+disciplinas do professor (um EXISTS contra Alocacao)
+        resultados = filtrar_escopo(resultados, request, 'avaliacao__alocacao__turma', 'avaliacao__alocacao__disciplina')
+        avaliacoes_dropdown = filtrar_escopo(avaliacoes_dropdown, request)
+        
+        # O professor só vê as turmas e disciplinas dele
+        turmas_dropdown = turmas_dropdown.filter(alocacoes__professor=perfil).distinct()
+        disciplinas_dropdown = disciplinas_dropdown.filter(alocacoes__professor=perfil).distinct()
+
+    # Aplica os filtros escolhidos pelo usuário
+    if disciplina_id: resultados = resultados.filter(avaliacao__alocacao__disciplina_id=disciplina_id)
+    if serie_id: resultados = resultados.filter(avaliacao__alocacao__turma__nome__startswith=serie_id)
+    if turma_id: resultados = resultados.filter(avaliacao__alocacao__turma_id=turma_id)
+    if aluno_id: resultados = resultados.filter(matricula__aluno_id=aluno_id)
+    if avaliacao_id: resultados = resultados.filter(avaliacao_id=avaliacao_id)
+    if data_inicio: resultados = resultados.filter(avaliacao__data_aplicacao__gte=data_inicio)
+    if data_fim: resultados = resultados.filter(avaliacao__data_aplicacao__lte=data_fim)
+
+    # Tabela-fato de proficiência com os mesmos filtros (exceto aluno, que ela não guarda)
+    fatos = filtrar_escopo(ProficienciaItem.objects.all(), request, 'turma', 'disciplina')
+    if disciplina_id: fatos = fatos.filter(disciplina_id=disciplina_id)
+    if serie_id: fatos = fatos.filter(turma__nome__startswith=serie_id)
+    if turma_id: fatos = fatos.filter(turma_id=turma_id)
+    if avaliacao_id: fatos = fatos.filter(avaliacao_id=avaliacao_id)
+    if data_inicio: fatos = fatos.filter(avaliacao__data_aplicacao__gte=data_inicio)
+    if data_fim: fatos = fatos.filter(avaliacao__data_aplicacao__lte=data_fim)
+
+    # --- 2. PROCESSAMENTO (CACHE VERSIONADO) ---
+    # A chave muda sozinha quando qualquer nota/gabarito do escopo é alterado.
+    escopo = pares_escopo(request)
+    if escopo is not None:
+        turmas_versao = [turma_id] if turma_id else [t for t, _ in escopo]
+    else:
+        escopo = 'geral'
+        turmas_versao = [turma_id] if turma_id else None
+
+    chave = chave_dashboard(
+        (serie_id, turma_id, aluno_id, avaliacao_id, disciplina_id, data_inicio, data_fim),
+        escopo,
+        versao_dados(avaliacao_id=avaliacao_id, turma_ids=turmas_versao),
+    )
+    indicadores = obter_ou_calcular(
+        chave, lambda: calcular_indicadores_dashboard(resultados, fatos, aluno_id, avaliacao_id)
+    )
+
     # Contexto
     alunos_filtro = Aluno.objects.none()
     if turma_id: alunos_filtro = Aluno.objects.filter(matriculas__turma_id=turma_id, matriculas__status='CURSANDO')
@@ -388,14 +413,8 @@ def dashboard(request):
         'disciplinas': disciplinas_dropdown, 
         'avaliacoes_todas': avaliacoes_dropdown,
         'nome_filtro': nome_filtro,
-        'total_avaliacoes_contagem': count_avaliados,
-        'media_geral': media_geral, 'nivel_predominante': nivel_predominante, 'qtd_provas': qtd_provas,
-        'dados_pizza': dados_pizza, 'detalhes_pizza_json': detalhes_pizza_json,
-        'labels_evolucao': labels_evolucao, 'dados_evolucao': dados_evolucao,
-        'labels_proficiencia': labels_proficiencia, 'dados_proficiencia': dados_proficiencia,
-        'ranking_facil': ranking_facil, 'ranking_dificil': ranking_dificil,
-        'itens_heatmap': itens_heatmap, 'matriz_calor': matriz_calor,
     }
+    context.update(indicadores)
 
     return render(request, 'core/dashboard.html', context)
 
@@ -406,12 +425,12 @@ def api_raio_x(request):
     filtros = Q(acertou=False) 
     
     if descritor_cod: 
-        filtros &= (Q(item_gabarito__descritor__codigo=descritor_cod) | Q(questao__descritor__codigo=descritor_cod))
+        filtros &= Q(descritor__codigo=descritor_cod)
     
-    if request.GET.get('avaliacao'): filtros &= Q(resultado__avaliacao_id=request.GET.get('avaliacao'))
-    if request.GET.get('turma'): filtros &= Q(resultado__avaliacao__alocacao__turma_id=request.GET.get('turma'))
-    if request.GET.get('serie'): filtros &= Q(resultado__avaliacao__alocacao__turma__nome__startswith=request.GET.get('serie'))
-    if request.GET.get('disciplina'): filtros &= Q(resultado__avaliacao__alocacao__disciplina_id=request.GET.get('disciplina'))
+    if request.GET.get('avaliacao'): filtros &= Q(avaliacao_id=request.GET.get('avaliacao'))
+    if request.GET.get('turma'): filtros &= Q(avaliacao__alocacao__turma_id=request.GET.get('turma'))
+    if request.GET.get('serie'): filtros &= Q(avaliacao__alocacao__turma__nome__startswith=request.GET.get('serie'))
+    if request.GET.get('disciplina'): filtros &= Q(avaliacao__alocacao__disciplina_id=request.GET.get('disciplina'))
 
     erros = RespostaDetalhada.objects.filter(filtros).values(
         'resultado__matricula__aluno__nome_completo',
@@ -655,22 +674,9 @@ def gerenciar_avaliacoes(request):
     if hasattr(request.user, 'professor_perfil'):
         perfil = request.user.professor_perfil
         
-        # --- INÍCIO DA MÁGICA DO PODER COMPARTILHADO ---
-        # 1. Pegamos todas as gavetas (alocações) que esse professor possui
-        alocacoes_do_prof = perfil.alocacoes.all()
-        
-        # 2. Criamos uma regra flexível: "Combine as provas que tenham a mesma Turma E Disciplina dele"
-        query_compartilhada = Q()
-        for aloc in alocacoes_do_prof:
-            query_compartilhada |= Q(alocacao__turma=aloc.turma, alocacao__disciplina=aloc.disciplina)
-            
-        # 3. Aplicamos a regra! 
-        if query_compartilhada:
-            avaliacoes = avaliacoes.filter(query_compartilhada)
-        else:
-            # Se o professor não tiver nenhuma turma atrelada a ele, não vê nada
-            avaliacoes = avaliacoes.none() 
-        # --- FIM DA MÁGICA ---
+        # --- MÁGICA DO PODER COMPARTILHADO ---
+        # Provas com a mesma Turma E Disciplina de alguma alocação dele (sem alocação, não vê nada)
+        avaliacoes = filtrar_escopo(avaliacoes, request)
         
         turmas_dropdown = turmas_dropdown.filter(alocacoes__professor=perfil).distinct()
         turmas_ativas = turmas_ativas.filter(alocacoes__professor=perfil).distinct()
@@ -1148,6 +1154,12 @@ def montar_prova(request, avaliacao_id):
                     avaliacao=avaliacao, numero=i, questao_banco=questao,
                     resposta_correta=questao.gabarito, descritor=questao.descritor
                 )
+            # Gabarito recriado: as respostas herdam o descritor dos itens novos
+            sincronizar_descritores(avaliacao.id)
+            # Gabarito recriado: os vetores gravados apontam para as questões antigas
+            descartar_vetores(avaliacao.id)
+            # Gabarito recriado: os itens antigos saíram da tabela-fato
+            atualizar_proficiencia(avaliacao.id)
             messages.success(request, f'{len(questoes_ids)} questões vinculadas com sucesso!')
             return redirect('definir_gabarito', avaliacao_id=avaliacao.id)
         else:
@@ -1216,6 +1228,9 @@ def definir_gabarito(request, avaliacao_id):
                 ItemGabarito.objects.create(
                     avaliacao=avaliacao, numero=i, resposta_correta='A', descritor=desc_padrao
                 )
+            sincronizar_descritores(avaliacao.id)
+            descartar_vetores(avaliacao.id)
+            atualizar_proficiencia(avaliacao.id)
             return redirect('definir_gabarito', avaliacao_id=avaliacao.id)
         
         else:
@@ -1228,6 +1243,8 @@ def definir_gabarito(request, avaliacao_id):
                         if nova_resposta: item.resposta_correta = nova_resposta
                         if novo_descritor_id: item.descritor_id = novo_descritor_id
                         item.save()
+                    sincronizar_descritores(avaliacao.id)
+                    recorrigidas = [avaliacao.id]
 
                     if request.POST.get('replicar_para_todos') == 'on':
                         provas_irmas = Avaliacao.objects.filter(
@@ -1265,12 +1282,17 @@ def definir_gabarito(request, avaliacao_id):
                             for item_sobrando in itens_irma.values():
                                 item_sobrando.delete()
 
+                            sincronizar_descritores(irma.id)
+                            recorrigidas.append(irma.id)
                             count_replicas += 1
                         
                         messages.success(request, f"Gabarito salvo e replicado para {count_replicas} turmas de forma segura!")
                     else:
                         messages.success(request, "Gabarito salvo apenas para esta turma.")
 
+                    # 🔄 Notas já lançadas seguem o gabarito novo (esta prova e as irmãs)
+                    recorrigir_avaliacoes(recorrigidas)
+
             except Exception as e:
                 messages.error(request, f"Erro ao salvar: {e}")
 
@@ -1292,6 +1314,72 @@ def definir_gabarito(request, avaliacao_id):
     }
     return render(request, 'core/definir_gabarito.html', context)
 
+@user_passes_test(prof_ou_admin_check, login_url='/redirecionar/')
+def importar_respostas(request, avaliacao_id):
+    avaliacao = get_object_or_404(Avaliacao.objects.select_related('alocacao__turma', 'alocacao__disciplina'), id=avaliacao_id)
+    gabarito = carregar_gabarito(avaliacao)
+    chave_sessao = f'importacao_respostas_{avaliacao.id}'
+
+    if request.GET.get('baixar_modelo'):
+        # Modelo já com a turma: basta preencher as letras
+        if avaliacao.matricula_id:
+            matriculas = Matricula.objects.filter(id=avaliacao.matricula_id)
+        else:
+            matriculas = Matricula.objects.filter(turma=avaliacao.alocacao.turma, status='CURSANDO')
+        matriculas = matriculas.select_related('aluno').order_by('numero_chamada', 'aluno__nome_completo')
+        df_modelo = pd.DataFrame([
+            {'MATRICULA': m.id, 'CHAMADA': m.numero_chamada, 'NOME': m.aluno.nome_completo, 'AUSENTE': ''}
+            for m in matriculas
+        ], columns=['MATRICULA', 'CHAMADA', 'NOME', 'AUSENTE'])
+        for item in gabarito:
+            df_modelo[str(item.numero)] = ''
+
+        response = HttpResponse(content_type='application/vnd.openxmlformats-officedocument.spreadsheetml.sheet')
+        response['Content-Disposition'] = f'attachment; filename=respostas_avaliacao_{avaliacao.id}.xlsx'
+        df_modelo.to_excel(response, index=False)
+        return response
+
+    if not gabarito:
+        messages.error(request, "Defina o gabarito da prova antes de importar as respostas.")
+        return redirect('definir_gabarito', avaliacao_id=avaliacao.id)
+
+    if request.method == 'POST' and 'confirmar' in request.POST:
+        validas = request.session.pop(chave_sessao, None)
+        if not validas:
+            messages.warning(request, "A pré-visualização expirou. Envie a planilha novamente.")
+            return redirect('importar_respostas', avaliacao_id=avaliacao.id)
+        try:
+            gravados = aplicar_importacao(avaliacao, gabarito, validas)
+        except Exception as e:
+            messages.error(request, f"Erro ao gravar as respostas: {e}")
+            return redirect('importar_respostas', avaliacao_id=avaliacao.id)
+        messages.success(request, f"✅ {len(gravados)} cartões importados e corrigidos!")
+        return redirect('resultados_turma', avaliacao_id=avaliacao.id)
+
+    previa = None
+    if request.method == 'POST' and request.FILES.get('arquivo'):
+        try:
+            df = ler_planilha_inteligente(request.FILES['arquivo'])
+        except Exception as erro_leitura:
+            messages.error(request, f"Erro ao ler o arquivo. Verifique se não está corrompido: {erro_leitura}")
+            return redirect('importar_respostas', avaliacao_id=avaliacao.id)
+
+        # 🔎 Dry-run: corrige tudo e mostra, mas só grava no "Confirmar"
+        previa = preparar_importacao(df, avaliacao, gabarito)
+        if previa['erro']:
+            messages.error(request, previa['erro'])
+            return redirect('importar_respostas', avaliacao_id=avaliacao.id)
+        request.session[chave_sessao] = previa['validas']
+    elif request.method == 'POST':
+        messages.error(request, "Selecione um arquivo .XLSX ou .CSV.")
+
+    context = {
+        'avaliacao': avaliacao,
+        'gabarito': gabarito,
+        'previa': previa,
+    }
+    return render(request, 'core/importar_respostas.html', context)
+
 @user_passes_test(prof_ou_admin_check, login_url='/redirecionar/')
 def lancar_nota(request):
     avaliacao_id = request.GET.get('avaliacao_id')
@@ -1303,24 +1391,19 @@ def lancar_nota(request):
     total_matriculados = 0
     provas_lancadas = 0
 
+    sessao = None
+
     if avaliacao_id:
-        avaliacao_obj = get_object_or_404(Avaliacao, id=avaliacao_id)
-        itens = ItemGabarito.objects.filter(avaliacao=avaliacao_obj).order_by('numero')
+        avaliacao_obj = get_object_or_404(Avaliacao.objects.select_related('alocacao'), id=avaliacao_id)
+        itens = carregar_gabarito(avaliacao_obj)
         
-        if avaliacao_obj.matricula:
-            matriculas_turma = Matricula.objects.filter(id=avaliacao_obj.matricula.id)
+        if avaliacao_obj.matricula_id:
+            matriculas_turma = Matricula.objects.filter(id=avaliacao_obj.matricula_id).select_related('aluno')
         else:
             matriculas_turma = Matricula.objects.filter(
                 turma=avaliacao_obj.alocacao.turma, 
                 status='CURSANDO'
             ).select_related('aluno').order_by('aluno__nome_completo')
-            
-        # 🔥 MISSÃO 1: MÁGICA DA CONTAGEM
-        total_matriculados = matriculas_turma.count()
-        provas_lancadas = Resultado.objects.filter(
-            avaliacao=avaliacao_obj, 
-            matricula__in=matriculas_turma
-        ).count()
 
     # Bloco antigo de POST (mantido como fallback seguro)
     if request.method == 'POST' and avaliacao_obj:
@@ -1330,65 +1413,38 @@ def lancar_nota(request):
             return redirect(f'/lancar_nota/?avaliacao_id={avaliacao_id}')
 
         matricula_obj = get_object_or_404(Matricula, id=matricula_id)
-        resultado = Resultado.objects.filter(avaliacao=avaliacao_obj, matricula=matricula_obj).first()
         is_ausente = request.POST.get('ausente') == 'true'
 
-        if not resultado:
-            resultado = Resultado(
-                avaliacao=avaliacao_obj, matricula=matricula_obj, total_questoes=itens.count(),
-                acertos=None if is_ausente else 0, percentual=None if is_ausente else 0.0
-            )
-        else:
-            resultado.total_questoes = itens.count()
+        # Respostas por número da questão (o form manda resposta_<item.id> ou resposta_q<numero>)
+        respostas = None
+        if not is_ausente:
+            respostas = {
+                item.numero: request.POST.get(f'resposta_{item.id}') or request.POST.get(f'resposta_q{item.numero}') or ''
+                for item in itens
+            }
 
-        RespostaDetalhada.objects.filter(resultado=resultado).delete()
+        # Grava só as respostas que mudaram (ver services/correcao.py)
+        resultado = gravar_correcoes(avaliacao_obj, itens, [(matricula_obj, respostas)])[0]
 
         if is_ausente:
-            resultado.acertos = None
-            resultado.percentual = None
-            resultado.save()
             messages.warning(request, 'Aluno marcado como ausente (Pendente de 2ª Chamada).')
-            return redirect(f'/lancar_nota/?avaliacao_id={avaliacao_id}')
-
-        acertos_contagem = 0
-        objs_resposta = []
-        for item in itens:
-            resp_via_id = request.POST.get(f'resposta_{item.id}')
-            resp_via_num = request.POST.get(f'resposta_q{item.numero}')
-            resposta_aluno = resp_via_id if resp_via_id else resp_via_num
-            acertou = False
-            letra_final = ''
-
-            if resposta_aluno:
-                letra_final = resposta_aluno.strip().upper()
-                if letra_final == item.resposta_correta.upper():
-                    acertou = True
-                    acertos_contagem += 1
-                objs_resposta.append(RespostaDetalhada(
-                    resultado=resultado, item_gabarito=item, questao=item.questao_banco, 
-                    acertou=acertou, resposta_aluno=letra_final
-                ))
-
-        if objs_resposta: RespostaDetalhada.objects.bulk_create(objs_resposta)
-
-        resultado.acertos = acertos_contagem
-        qtd = resultado.total_questoes if resultado.total_questoes > 0 else 1
-        resultado.percentual = (acertos_contagem / qtd) * 100
-        resultado.save()
-        messages.success(request, f'Nota salva: {acertos_contagem}')
+        else:
+            messages.success(request, f'Nota salva: {resultado.acertos}')
         return redirect(f'/lancar_nota/?avaliacao_id={avaliacao_id}')
 
+    if avaliacao_obj:
+        # 📦 SESSÃO DE CORREÇÃO: gabarito + turma + o que já foi lançado, num JSON só.
+        # Trocar de aluno na tela não volta mais ao servidor.
+        matriculas_turma = list(matriculas_turma)
+        sessao = montar_sessao_lancamento(avaliacao_obj, itens, matriculas_turma)
+
+        # 🔥 MISSÃO 1: MÁGICA DA CONTAGEM
+        total_matriculados = len(matriculas_turma)
+        provas_lancadas = sum(1 for a in sessao['alunos'].values() if a['lancado'])
+
     avaliacoes_dropdown = Avaliacao.objects.all().order_by('-data_aplicacao')
     if hasattr(request.user, 'professor_perfil'):
-        perfil = request.user.professor_perfil
-        alocacoes_do_prof = perfil.alocacoes.all()
-        query_compartilhada = Q()
-        for aloc in alocacoes_do_prof:
-            query_compartilhada |= Q(alocacao__turma=aloc.turma, alocacao__disciplina=aloc.disciplina)
-        if query_compartilhada:
-            avaliacoes_dropdown = avaliacoes_dropdown.filter(query_compartilhada)
-        else:
-            avaliacoes_dropdown = avaliacoes_dropdown.none()
+        avaliacoes_dropdown = filtrar_escopo(avaliacoes_dropdown, request)
 
     return render(request, 'core/lancar_nota.html', {
         'avaliacao_selecionada': avaliacao_obj,
@@ -1396,7 +1452,8 @@ def lancar_nota(request):
         'matriculas': matriculas_turma, 
         'avaliacoes_todas': avaliacoes_dropdown,
         'total_matriculados': total_matriculados, # NOVO ENVIADO PRO HTML
-        'provas_lancadas': provas_lancadas        # NOVO ENVIADO PRO HTML
+        'provas_lancadas': provas_lancadas,       # NOVO ENVIADO PRO HTML
+        'sessao_lancamento': sessao,
     })
 
 
@@ -1416,11 +1473,7 @@ def api_lancar_nota_ajax(request):
                 else:
                     dados['nota'] = resultado.acertos
 
-                detalhes = RespostaDetalhada.objects.filter(resultado=resultado)
-                for r in detalhes:
-                    letra = r.resposta_aluno if r.resposta_aluno else ''
-                    if not letra and r.acertou: letra = r.item_gabarito.resposta_correta
-                    dados['respostas'][r.item_gabarito.numero] = letra
+                dados['respostas'] = letras_marcadas([resultado], carregar_gabarito(resultado.avaliacao)).get(resultado.id, {})
             return JsonResponse({'sucesso': True, 'dados': dados})
         except Exception as e:
             return JsonResponse({'sucesso': False, 'erro': str(e)})
@@ -1428,6 +1481,20 @@ def api_lancar_nota_ajax(request):
     if request.method == 'POST':
         try:
             data = json.loads(request.body)
+
+            # 🔥 MODO LOTE: a turma inteira num POST só ({'avaliacao_id', 'lancamentos': [...]})
+            if 'lancamentos' in data:
+                avaliacao = Avaliacao.objects.select_related('alocacao').get(id=data.get('avaliacao_id'))
+                try:
+                    resultados, provas_lancadas = corrigir_turma(avaliacao, data.get('lancamentos') or [])
+                except ValueError as e:
+                    return JsonResponse({'sucesso': False, 'erro': str(e)})
+                salvos = sum(1 for r in resultados if r['sucesso'])
+                return JsonResponse({
+                    'sucesso': True, 'msg': f'{salvos} de {len(resultados)} alunos lançados.',
+                    'resultados': resultados, 'provas_lancadas': provas_lancadas
+                })
+
             aluno_id = data.get('aluno_id')
             avaliacao_id = data.get('avaliacao_id')
             respostas_aluno = data.get('respostas')
@@ -1438,59 +1505,40 @@ def api_lancar_nota_ajax(request):
             
             if not matricula: return JsonResponse({'sucesso': False, 'erro': 'Matrícula ativa não encontrada.'})
             
-            gabarito = ItemGabarito.objects.filter(avaliacao=avaliacao).order_by('numero')
-            qtd_questoes = gabarito.count()
+            gabarito = carregar_gabarito(avaliacao)
+            if not gabarito: return JsonResponse({'sucesso': False, 'erro': 'Defina o gabarito antes de lançar notas.'})
 
-            if qtd_questoes == 0: return JsonResponse({'sucesso': False, 'erro': 'Defina o gabarito antes de lançar notas.'})
-            
-            resultado = Resultado.objects.filter(avaliacao=avaliacao, matricula=matricula).first()
-            if not resultado:
-                resultado = Resultado(
-                    avaliacao=avaliacao, matricula=matricula, total_questoes=qtd_questoes,
-                    acertos=None if is_ausente else 0, percentual=None if is_ausente else 0.0     
-                )
-                resultado.save() 
-            else:
-                resultado.total_questoes = qtd_questoes
-                resultado.save()
+            # A tela de lançamento manda só as questões alteradas
+            if 'alteracoes' in data and not is_ausente:
+                respostas_aluno = mesclar_alteracoes(avaliacao, matricula, gabarito, data.get('alteracoes') or {})
 
-            RespostaDetalhada.objects.filter(resultado=resultado).delete()
+            # Grava só as respostas que mudaram (ver services/correcao.py)
+            resultado = gravar_correcoes(avaliacao, gabarito, [(matricula, None if is_ausente else (respostas_aluno or {}))])[0]
 
             # 🔥 MISSÃO 1: Recalcular e enviar contagem atualizada para o JS
-            def get_provas_lancadas():
-                return Resultado.objects.filter(avaliacao=avaliacao, matricula__turma=avaliacao.alocacao.turma, matricula__status='CURSANDO').count()
-
             if is_ausente:
-                resultado.acertos = None
-                resultado.percentual = None
-                resultado.save()
-                return JsonResponse({'sucesso': True, 'msg': 'Aluno marcado como ausente.', 'is_ausente': True, 'provas_lancadas': get_provas_lancadas()})
-
-            acertos = 0
-            objs_resposta = []
-            for item in gabarito:
-                num_str = str(item.numero)
-                letra_aluno = respostas_aluno.get(num_str, '').upper()
-                acertou = False
-                if letra_aluno:
-                    if letra_aluno == item.resposta_correta:
-                        acertou = True
-                        acertos += 1
-                    objs_resposta.append(RespostaDetalhada(
-                        resultado=resultado, item_gabarito=item, questao=item.questao_banco,
-                        acertou=acertou, resposta_aluno=letra_aluno 
-                    ))
-            
-            RespostaDetalhada.objects.bulk_create(objs_resposta)
-            resultado.acertos = acertos
-            resultado.percentual = (acertos / qtd_questoes) * 100
-            resultado.save()
+                return JsonResponse({'sucesso': True, 'msg': 'Aluno marcado como ausente.', 'is_ausente': True, 'provas_lancadas': contar_provas_lancadas(avaliacao)})
 
-            return JsonResponse({'sucesso': True, 'msg': f'Nota salva: {acertos} acertos.', 'is_ausente': False, 'provas_lancadas': get_provas_lancadas()})
+            return JsonResponse({'sucesso': True, 'msg': f'Nota salva: {resultado.acertos} acertos.', 'is_ausente': False, 'acertos': resultado.acertos, 'provas_lancadas': contar_provas_lancadas(avaliacao)})
 
         except Exception as e:
             return JsonResponse({'sucesso': False, 'erro': f"Erro interno: {str(e)}"})
         
+@user_passes_test(prof_ou_admin_check, login_url='/redirecionar/')
+def api_sincronizar_lancamentos(request):
+    """
+    📶 FILA OFFLINE: a tela de lançamento guarda os cartões no aparelho (IndexedDB)
+    e manda em lotes quando a rede volta. Ver sincronizar_lancamentos.
+    """
+    if request.method != 'POST':
+        return JsonResponse({'sucesso': False, 'erro': 'Método não permitido.'}, status=405)
+    try:
+        data = json.loads(request.body)
+        resultados, provas_lancadas = sincronizar_lancamentos(data.get('cartoes') or [], usuario=request.user)
+        return JsonResponse({'sucesso': True, 'resultados': resultados, 'provas_lancadas': provas_lancadas})
+    except Exception as e:
+        return JsonResponse({'sucesso': False, 'erro': f"Erro interno: {str(e)}"})
+
 # ==============================================================================
 # 📋 GERENCIAMENTO GERAL
 # ==============================================================================
@@ -1865,24 +1913,22 @@ def gerar_relatorio_proficiencia(request):
 
     if not filtros_texto: filtros_texto.append("Visão Geral da Escola")
 
-    respostas_qs = RespostaDetalhada.objects.filter(resultado__in=resultados).select_related(
-        'item_gabarito__descritor', 'questao__descritor'
-    )
+    # Agregado no banco pelo descritor já gravado em cada resposta
+    respostas_qs = RespostaDetalhada.objects.filter(
+        resultado__in=resultados, descritor__isnull=False
+    ).values('descritor__codigo', 'descritor__descricao').annotate(
+        total=Count('id'), acertos=Count('id', filter=Q(acertou=True))
+    ).order_by()
 
     stats = {}
     total_itens_respondidos = 0
 
-    for resp in respostas_qs:
-        desc = None
-        if resp.item_gabarito and resp.item_gabarito.descritor: desc = resp.item_gabarito.descritor
-        elif resp.questao and resp.questao.descritor: desc = resp.questao.descritor
-        
-        if desc:
-            cod = desc.codigo
-            if cod not in stats: stats[cod] = {'desc': desc.descricao, 'total': 0, 'acertos': 0}
-            stats[cod]['total'] += 1
-            if resp.acertou: stats[cod]['acertos'] += 1
-            total_itens_respondidos += 1
+    for linha in respostas_qs:
+        cod = linha['descritor__codigo']
+        if cod not in stats: stats[cod] = {'desc': linha['descritor__descricao'], 'total': 0, 'acertos': 0}
+        stats[cod]['total'] += linha['total']
+        stats[cod]['acertos'] += linha['acertos']
+        total_itens_respondidos += linha['total']
 
     dados_ordenados = sorted(stats.items())
 
@@ -2086,31 +2132,20 @@ def perfil_aluno(request, aluno_id):
     media_geral = sum(notas_validas) / len(notas_validas) if notas_validas else 0.0
     ausencias = len(dados_evo) - len(notas_validas)
     
-    respostas = RespostaDetalhada.objects.filter(resultado__in=resultados).select_related('item_gabarito__descritor', 'questao__descritor')
-    stats_descritores = {}
-    
-    for resp in respostas:
-        desc = None
-        if resp.item_gabarito and resp.item_gabarito.descritor:
-            desc = resp.item_gabarito.descritor
-        elif resp.questao and resp.questao.descritor:
-            desc = resp.questao.descritor
-            
-        if desc:
-            cod = desc.codigo
-            if cod not in stats_descritores:
-                stats_descritores[cod] = {'obj': desc, 'acertos': 0, 'total': 0}
-            
-            stats_descritores[cod]['total'] += 1
-            if resp.acertou: stats_descritores[cod]['acertos'] += 1
-            
+    stats_descritores = RespostaDetalhada.objects.filter(
+        resultado__in=resultados, descritor__isnull=False
+    ).values('descritor_id', 'descritor__codigo', 'descritor__descricao', 'descritor__tema').annotate(
+        acertos=Count('id', filter=Q(acertou=True)), total=Count('id')
+    ).order_by()
+    # Agrupado pelo descritor (não pelo código): D1, D2... se repetem entre disciplinas
+
     lista_habilidades = []
-    for cod, dados in stats_descritores.items():
+    for dados in stats_descritores:
         perc = (dados['acertos'] / dados['total']) * 100 if dados['total'] > 0 else 0.0
         lista_habilidades.append({
-            'codigo': cod,
-            'descricao': dados['obj'].descricao,
-            'tema': dados['obj'].tema,
+            'codigo': dados['descritor__codigo'],
+            'descricao': dados['descritor__descricao'],
+            'tema': dados['descritor__tema'],
             'perc': round(perc, 1),
             'total_questoes': dados['total']
         })
@@ -2137,14 +2172,20 @@ def perfil_aluno(request, aluno_id):
 def mapa_calor(request, avaliacao_id):
     avaliacao = get_object_or_404(Avaliacao, id=avaliacao_id)
     
-    itens = ItemGabarito.objects.filter(avaliacao=avaliacao).select_related('descritor').order_by('numero')
-    resultados = Resultado.objects.filter(avaliacao=avaliacao).select_related('matricula__aluno').order_by('matricula__aluno__nome_completo')
+    itens = list(ItemGabarito.objects.filter(avaliacao=avaliacao).select_related('descritor').order_by('numero'))
+    resultados = list(Resultado.objects.filter(avaliacao=avaliacao).select_related('matricula__aluno').order_by('matricula__aluno__nome_completo'))
     
+    # Matriz {resultado_id: {item_id: acertou}} lida do vetor compacto de cada Resultado
+    respostas_por_resultado = mapa_acertos(resultados, itens)
+    acertos_por_item = {}
+    for mapa in respostas_por_resultado.values():
+        for item_id, acertou in mapa.items():
+            if acertou: acertos_por_item[item_id] = acertos_por_item.get(item_id, 0) + 1
+
     matriz_dados = []
     
     for res in resultados:
-        respostas = RespostaDetalhada.objects.filter(resultado=res)
-        mapa_respostas = {r.item_gabarito_id: r.acertou for r in respostas}
+        mapa_respostas = respostas_por_resultado.get(res.id, {})
         
         linha_questoes = []
         acertos_count = 0
@@ -2168,9 +2209,9 @@ def mapa_calor(request, avaliacao_id):
         })
 
     stats_questoes = []
-    total_alunos = resultados.count() or 1
+    total_alunos = len(resultados) or 1
     for item in itens:
-        qtd_acertos = RespostaDetalhada.objects.filter(item_gabarito=item, acertou=True).count()
+        qtd_acertos = acertos_por_item.get(item.id, 0)
         perc = (qtd_acertos / total_alunos) * 100
         stats_questoes.append({'numero': item.numero, 'perc': round(perc)})
 
@@ -2763,25 +2804,21 @@ def gerar_cartoes_pdf(request, avaliacao_id):
         
         buffer = io.BytesIO()
         c = canvas.Canvas(buffer, pagesize=A4)
-        width, height = A4
-        margin = 1 * cm
-        
-        card_w = (width - (3 * margin)) / 2
-        card_h = (height - (3 * margin)) / 2
-        
-        positions = [
-            (margin, height - margin - card_h), 
-            (margin + card_w + margin, height - margin - card_h),
-            (margin, margin),
-            (margin + card_w + margin, margin)
-        ]
         
         # Garante que sempre tenha um número válido de questões (fallback para 10)
         total_questoes = ItemGabarito.objects.filter(avaliacao=avaliacao).count()
         if total_questoes == 0:
             total_questoes = 10 
 
-        limite_coluna_1 = 15 
+        # 📐 Geometria única (layout_cartao): o leitor de cartões usa as mesmas coordenadas
+        try:
+            layout = layout_cartao(total_questoes)
+        except ValueError as e:
+            messages.error(request, f"Não dá para gerar os cartões: {e}")
+            return redirect('gerenciar_avaliacoes')
+        card_w, card_h = layout['largura'], layout['altura']
+        positions = posicoes_na_folha()
+        c.setKeywords(f"sami-layout-v{layout['versao']}")
         
         aluno_idx = 0
         
@@ -2804,13 +2841,12 @@ def gerar_cartoes_pdf(request, avaliacao_id):
                 c.setDash([])
 
                 c.setFillColor(colors.black)
-                marker_size = 15
-                c.rect(pos_x + 10, pos_y + card_h - 10 - marker_size, marker_size, marker_size, fill=1, stroke=0)
-                c.rect(pos_x + card_w - 10 - marker_size, pos_y + card_h - 10 - marker_size, marker_size, marker_size, fill=1, stroke=0)
-                c.rect(pos_x + 10, pos_y + 10, marker_size, marker_size, fill=1, stroke=0)
-                c.rect(pos_x + card_w - 10 - marker_size, pos_y + 10, marker_size, marker_size, fill=1, stroke=0)
+                marker_size = layout['marcador']
+                for centro_x, centro_y in layout['marcadores']:
+                    c.rect(pos_x + centro_x - marker_size / 2, pos_y + centro_y - marker_size / 2, marker_size, marker_size, fill=1, stroke=0)
 
-                qr_data = f"A{avaliacao.id}-M{mat.id}" 
+                qr_data = codigo_qr(avaliacao.id, mat.id, total_questoes, layout['versao'])
+                qr_x, qr_y, qr_lado = layout['qr']
                 
                 # 🔥 BLINDAGEM 3: Geração Segura do QR Code (Try/Except isolado)
                 try:
@@ -2824,13 +2860,13 @@ def gerar_cartoes_pdf(request, avaliacao_id):
                     qr_buffer.seek(0)
                     qr_img_reader = ImageReader(qr_buffer)
                     
-                    c.drawImage(qr_img_reader, pos_x + card_w - 70, pos_y + 20, width=50, height=50)
+                    c.drawImage(qr_img_reader, pos_x + qr_x, pos_y + qr_y, width=qr_lado, height=qr_lado)
                 except Exception as e:
                     logger.error(f"Erro ao gerar QR Code para {qr_data}: {e}")
                     # Desenha um quadrado de aviso caso o QR Code falhe, mas não corrompe o resto
-                    c.rect(pos_x + card_w - 70, pos_y + 20, 50, 50, stroke=1, fill=0)
+                    c.rect(pos_x + qr_x, pos_y + qr_y, qr_lado, qr_lado, stroke=1, fill=0)
                     c.setFont("Helvetica", 6)
-                    c.drawString(pos_x + card_w - 65, pos_y + 40, "ERRO QR")
+                    c.drawString(pos_x + qr_x + 5, pos_y + qr_y + 20, "ERRO QR")
                 
                 c.setFillColor(colors.black)
                 c.setFont("Helvetica-Bold", 11)
@@ -2843,32 +2879,16 @@ def gerar_cartoes_pdf(request, avaliacao_id):
                 c.setFont("Helvetica", 8)
                 c.drawString(pos_x + 35, pos_y + card_h - 70, f"Turma: {nome_turma} | Matrícula: {mat.id}")
                 
-                y_start = pos_y + card_h - 95
-                x_col1 = pos_x + 30
-                x_col2 = pos_x + card_w/2 + 10 
-                
                 c.setFont("Helvetica", 9)
                 
-                for q_num in range(1, total_questoes + 1):
-                    if q_num <= limite_coluna_1:
-                        curr_x = x_col1
-                        curr_y = y_start - ((q_num - 1) * 16)
-                    else:
-                        idx_col2 = q_num - limite_coluna_1 - 1
-                        curr_x = x_col2
-                        curr_y = y_start - (idx_col2 * 16)
-                        if curr_y < (pos_y + 80): 
-                            curr_x = x_col2 - 20 
-
-                    c.drawString(curr_x, curr_y, str(q_num).zfill(2))
+                for questao in layout['questoes']:
+                    curr_x, curr_y = questao['rotulo']
+                    c.drawString(pos_x + curr_x, pos_y + curr_y, str(questao['numero']).zfill(2))
                     
-                    opcoes = ['A', 'B', 'C', 'D', 'E']
-                    for i, opt in enumerate(opcoes):
-                        bubble_x = curr_x + 25 + (i * 14)
-                        bubble_y = curr_y + 3
-                        c.circle(bubble_x, bubble_y, 5.5, stroke=1, fill=0)
+                    for opt, (bubble_x, bubble_y) in zip(ALTERNATIVAS, questao['bolinhas']):
+                        c.circle(pos_x + bubble_x, pos_y + bubble_y, layout['raio_bolinha'], stroke=1, fill=0)
                         c.setFont("Helvetica", 6)
-                        c.drawCentredString(bubble_x, bubble_y - 2, opt)
+                        c.drawCentredString(pos_x + bubble_x, pos_y + bubble_y - 2, opt)
                         c.setFont("Helvetica", 9)
 
                 aluno_idx += 1
@@ -2928,9 +2948,17 @@ def gerenciar_ndi(request):
     # Só busca os alunos e permite salvar se as DUAS opções estiverem selecionadas
     if turma_selecionada and disciplina_selecionada:
         matriculas = Matricula.objects.filter(turma=turma_selecionada, status='CURSANDO').select_related('aluno').order_by('aluno__nome_completo')
+        # Diários já salvos da turma no bimestre, numa consulta só
+        ndis_existentes = {
+            ndi.matricula_id: ndi for ndi in NDI.objects.filter(
+                matricula__in=matriculas, bimestre=bimestre, disciplina=disciplina_selecionada
+            )
+        }
         
         if request.method == 'POST':
             salvos = 0
+            novos, alterados = [], []
+            campos_nota = ['nota_frequencia', 'nota_atividade', 'nota_comportamento', 'nota_prova_parcial', 'nota_prova_bimestral']
             
             for mat in matriculas:
                 freq = processar_nota(request.POST.get(f'freq_{mat.id}'))
@@ -2943,28 +2971,31 @@ def gerenciar_ndi(request):
                 tem_alguma_nota = any(n is not None for n in [freq, atv, comp, pp, pb])
                 
                 # Verifica se o aluno já tinha um diário salvo antes (para permitir que o professor apague notas)
-                ndi_existente = NDI.objects.filter(matricula=mat, bimestre=bimestre, disciplina=disciplina_selecionada).first()
+                ndi_existente = ndis_existentes.get(mat.id)
 
-                if tem_alguma_nota or ndi_existente:
-                    NDI.objects.update_or_create(
+                if ndi_existente:
+                    for campo, valor in zip(campos_nota, [freq, atv, comp, pp, pb]):
+                        setattr(ndi_existente, campo, valor)
+                    alterados.append(ndi_existente)
+                    salvos += 1
+                elif tem_alguma_nota:
+                    novos.append(NDI(
                         matricula=mat, bimestre=bimestre, disciplina=disciplina_selecionada,
-                        defaults={
-                            'nota_frequencia': freq,
-                            'nota_atividade': atv,
-                            'nota_comportamento': comp,
-                            'nota_prova_parcial': pp,
-                            'nota_prova_bimestral': pb
-                        }
-                    )
+                        nota_frequencia=freq, nota_atividade=atv, nota_comportamento=comp,
+                        nota_prova_parcial=pp, nota_prova_bimestral=pb
+                    ))
                     salvos += 1
 
+            with transaction.atomic():
+                if novos: NDI.objects.bulk_create(novos)
+                if alterados: NDI.objects.bulk_update(alterados, campos_nota)
+
             messages.success(request, f"Sucesso! Diário atualizado. {salvos} registros salvos com sucesso no sistema.")
             return redirect(f"{request.path}?turma={turma_id}&disciplina={disciplina_id}&bimestre={bimestre}")
 
         # Busca as notas para preencher a tela
         for mat in matriculas:
-            ndi = NDI.objects.filter(matricula=mat, bimestre=bimestre, disciplina=disciplina_selecionada).first()
-            alunos_data.append({'obj': mat, 'ndi': ndi})
+            alunos_data.append({'obj': mat, 'ndi': ndis_existentes.get(mat.id)})
 
     return render(request, 'core/gerenciar_ndi.html', {
         'turmas': turmas_qs,
@@ -3257,80 +3288,110 @@ def gerenciar_descritores(request):
     }
     return render(request, 'core/gerenciar_descritores.html', context)
 
-@user_passes_test(prof_ou_admin_check, login_url='/redirecionar/')
-def upload_correcao_cartao(request, avaliacao_id):
-    avaliacao = get_object_or_404(Avaliacao, id=avaliacao_id)
-    
-    if request.method == 'POST' and request.FILES.get('foto_cartao'):
-        foto = request.FILES['foto_cartao']
-        path = f"media/temp/{foto.name}"
-        os.makedirs(os.path.dirname(path), exist_ok=True)
-        with open(path, 'wb+') as destination:
-            for chunk in foto.chunks():
-                destination.write(chunk)
-        pass 
-
-    matriculas = Matricula.objects.filter(turma=avaliacao.alocacao.turma, status='CURSANDO')
-    return render(request, 'core/professor/upload_cartao.html', {'avaliacao': avaliacao, 'matriculas': matriculas})
+def _identificar_aluno_do_cartao(resultado):
+    """Completa a leitura com o aluno do QR (A39-M559): matricula_detected_id e aluno_nome."""
+    if resultado.get('qr_code'):
+        try:
+            codigo = resultado['qr_code'] 
+            partes = codigo.split('-') 
+            
+            for p in partes:
+                if p.startswith('M'):
+                    matricula_id = int(p[1:])
+                    try:
+                        mat = Matricula.objects.get(id=matricula_id)
+                        resultado['matricula_detected_id'] = mat.id 
+                        resultado['aluno_nome'] = mat.aluno.nome_completo
+                    except Matricula.DoesNotExist:
+                        logger.warning(f"Matrícula {matricula_id} do QR não encontrada.")
+
+                elif p.startswith('U'):
+                    aluno_id = int(p[1:])
+                    resultado['aluno_detectado_id'] = aluno_id
+                    
+        except Exception as e:
+            logger.warning(f"Erro ao interpretar QR Code '{codigo}': {e}")
+    return resultado
 
 @csrf_exempt 
 def api_ler_cartao(request):
     if request.method == 'POST' and request.FILES.get('foto'):
-        path = ""
         try:
             
             foto = request.FILES['foto']
             avaliacao_id = request.POST.get('avaliacao_id')
-            
-            nome_unico = f"{uuid.uuid4().hex}_{foto.name}"
-            path = f"media/temp/{nome_unico}"
-            os.makedirs(os.path.dirname(path), exist_ok=True)
-            with open(path, 'wb+') as destination:
-                for chunk in foto.chunks():
-                    destination.write(chunk)
+
+            # Decodifica direto dos pedaços do upload: nada passa pelo disco.
+            # Foto tremida/pequena/com reflexo volta na hora para o aplicador refazer
+            scanner = OMRScanner()
+            imagem, problema = scanner.checar_foto(foto)
+            if problema:
+                return JsonResponse(problema)
 
             qtd_questoes = 10
             if avaliacao_id:
                 qtd = ItemGabarito.objects.filter(avaliacao_id=avaliacao_id).count()
                 if qtd > 0: qtd_questoes = qtd
 
-            scanner = OMRScanner()
-            resultado = scanner.processar_cartao(path, qtd_questoes=qtd_questoes)
-            
-            if resultado.get('qr_code'):
-                try:
-                    codigo = resultado['qr_code'] 
-                    partes = codigo.split('-') 
-                    
-                    for p in partes:
-                        if p.startswith('M'):
-                            matricula_id = int(p[1:])
-                            try:
-                                mat = Matricula.objects.get(id=matricula_id)
-                                resultado['matricula_detected_id'] = mat.id 
-                                resultado['aluno_nome'] = mat.aluno.nome_completo
-                            except Matricula.DoesNotExist:
-                                print(f"Matrícula {matricula_id} não encontrada.")
-
-                        elif p.startswith('U'):
-                            aluno_id = int(p[1:])
-                            resultado['aluno_detectado_id'] = aluno_id
-                            
-                except Exception as e:
-                    print(f"Erro ao interpretar QR Code '{codigo}': {e}")
-
-            if os.path.exists(path):
-                os.remove(path)
+            if settings.OMR_FILA and request.user.is_authenticated:
+                # Leitura no worker_omr: espera um pouco; se não der tempo, a tela consulta depois
+                # (só quem está logado consulta depois; envio anônimo segue lido na hora)
+                tarefa = fila_omr.enfileirar(b''.join(foto.chunks()), qtd_questoes, request.user)
+                resultado = fila_omr.aguardar(tarefa.id, settings.OMR_FILA_ESPERA)
+                if resultado is None:
+                    return JsonResponse({'sucesso': True, 'pendente': True, 'tarefa_id': tarefa.id}, status=202)
+            else:
+                resultado = scanner.processar_cartao(imagem, qtd_questoes=qtd_questoes, checar_qualidade=False)
 
-            return JsonResponse(resultado)
+            return JsonResponse(_identificar_aluno_do_cartao(resultado))
 
         except Exception as e:
-            if os.path.exists(path):
-                os.remove(path)
             return JsonResponse({'sucesso': False, 'erro': str(e)})
 
     return JsonResponse({'sucesso': False, 'erro': 'Nenhuma imagem enviada'})
 
+@login_required
+def api_resultado_leitura(request, tarefa_id):
+    """Consulta de uma leitura que ficou na fila (api_ler_cartao respondeu 202 com o tarefa_id)."""
+    # Só quem enviou a foto consulta (a leitura traz o nome do aluno); tarefa sem dono ninguém vê
+    tarefa = TarefaOMR.objects.filter(id=tarefa_id, usuario_id=request.user.id).values('status', 'resultado').first()
+    if tarefa is None:
+        return JsonResponse({'sucesso': False, 'erro': 'Leitura não encontrada (expirada?). Envie a foto de novo.'}, status=404)
+    if tarefa['status'] in ('PENDENTE', 'LENDO'):
+        return JsonResponse({'sucesso': True, 'pendente': True, 'tarefa_id': tarefa_id}, status=202)
+    return JsonResponse(_identificar_aluno_do_cartao(tarefa['resultado'] or {'sucesso': False, 'erro': 'Falha na leitura.'}))
+
+@user_passes_test(prof_ou_admin_check, login_url='/redirecionar/')
+def corrigir_cartoes_lote(request, avaliacao_id):
+    """Turma inteira digitalizada de uma vez (PDF/ZIP): devolve o andamento página a página (NDJSON)."""
+    avaliacao = get_object_or_404(Avaliacao.objects.select_related('alocacao__turma'), id=avaliacao_id)
+
+    if request.method == 'POST':
+        arquivo = request.FILES.get('arquivo')
+        if not arquivo:
+            return JsonResponse({'sucesso': False, 'erro': 'Nenhum arquivo enviado'})
+        if not settings.OMR_FILA and settings.OMR_LOTE_PROCESSOS <= 0:
+            return JsonResponse({'sucesso': False, 'erro': 'Correção em lote desligada neste servidor: ligue a fila de leitura (OMR_FILA e o worker_omr) ou use o comando corrigir_lote_omr.'})
+        if arquivo.size > LIMITE_BYTES_LOTE:
+            return JsonResponse({'sucesso': False, 'erro': f"Arquivo maior que {LIMITE_BYTES_LOTE // 2**20} MB; divida o envio."})
+        try:
+            paginas = extrair_paginas(arquivo.name, arquivo.read())
+        except Exception as e:
+            return JsonResponse({'sucesso': False, 'erro': str(e)})
+
+        # Nada de pool do tamanho da máquina dentro do gunicorn: com a fila ligada quem lê é o worker_omr;
+        # sem ela, só se liberado, com no máximo OMR_LOTE_PROCESSOS processos (o comando corrigir_lote_omr usa todos)
+        lote = corrigir_lote(
+            paginas, avaliacao, workers=settings.OMR_LOTE_PROCESSOS,
+            fila=settings.OMR_FILA, usuario=request.user, timeout=settings.OMR_LOTE_ESPERA,
+        )
+        eventos = (json.dumps(evento, ensure_ascii=False) + '\n' for evento in lote)
+        response = StreamingHttpResponse(eventos, content_type='application/x-ndjson')
+        response['X-Accel-Buffering'] = 'no'  # nginx: entrega cada linha assim que sai
+        return response
+
+    return render(request, 'core/corrigir_cartoes_lote.html', {'avaliacao': avaliacao})
+
 def central_ajuda(request):
     if request.user.is_authenticated and request.user.is_staff:
         tutoriais = Tutorial.objects.filter(publico__in=['PROF', 'TODOS'])
@@ -3367,25 +3428,24 @@ def dashboard_aluno(request):
         if notas_validas:
             media_geral = sum(notas_validas) / len(notas_validas)
 
-    respostas = RespostaDetalhada.objects.filter(resultado__in=resultados)
+    respostas = RespostaDetalhada.objects.filter(
+        resultado__in=resultados, descritor__isnull=False
+    ).values('descritor__codigo', 'descritor__descricao').annotate(
+        total=Count('id'), acertos=Count('id', filter=Q(acertou=True))
+    ).order_by()
     analise_descritores = {}
 
-    for resp in respostas:
-        if resp.questao and resp.questao.descritor:
-            desc = resp.questao.descritor
-            cod = desc.codigo
-            
-            if cod not in analise_descritores:
-                analise_descritores[cod] = {
-                    'codigo': cod,
-                    'descricao': desc.descricao,
-                    'total': 0,
-                    'acertos': 0
-                }
-            
-            analise_descritores[cod]['total'] += 1
-            if resp.acertou:
-                analise_descritores[cod]['acertos'] += 1
+    for linha in respostas:
+        cod = linha['descritor__codigo']
+        if cod not in analise_descritores:
+            analise_descritores[cod] = {
+                'codigo': cod,
+                'descricao': linha['descritor__descricao'],
+                'total': 0,
+                'acertos': 0
+            }
+        analise_descritores[cod]['total'] += linha['total']
+        analise_descritores[cod]['acertos'] += linha['acertos']
 
     lista_habilidades = []
     for cod, dados in analise_descritores.items():
@@ -3578,15 +3638,7 @@ def area_professor(request):
         ).order_by('nome')
         
         # 🔥 A MÁGICA DO PODER COMPARTILHADO (AQUI ESTAVA O BLOQUEIO)
-        alocacoes_do_prof = perfil.alocacoes.all()
-        query_compartilhada = Q()
-        for aloc in alocacoes_do_prof:
-            query_compartilhada |= Q(alocacao__turma=aloc.turma, alocacao__disciplina=aloc.disciplina)
-            
-        if query_compartilhada:
-            avaliacoes_base = Avaliacao.objects.filter(query_compartilhada).distinct()
-        else:
-            avaliacoes_base = Avaliacao.objects.none()
+        avaliacoes_base = filtrar_escopo(Avaliacao.objects.all(), request)
         
         provas_recentes = avaliacoes_base.order_by('-data_aplicacao')[:5]
         avaliacoes_totais = avaliacoes_base.order_by('-data_aplicacao')
@@ -3691,18 +3743,9 @@ def dashboard_aplicador(request):
         return redirect('dashboard')
 
     # 🔥 A MÁGICA DO PODER COMPARTILHADO (AGORA PLUGADA NO QG) 🔥
-    alocacoes_do_prof = perfil.alocacoes.all()
-    query_compartilhada = Q()
-    
-    for aloc in alocacoes_do_prof:
-        # O Aplicador enxergará todas as provas das turmas e matérias vinculadas a ele
-        query_compartilhada |= Q(alocacao__turma=aloc.turma, alocacao__disciplina=aloc.disciplina)
-        
-    if query_compartilhada:
-        # O distinct() garante que a prova não apareça duplicada
-        avaliacoes = Avaliacao.objects.filter(query_compartilhada).order_by('-data_aplicacao').distinct()
-    else:
-        avaliacoes = Avaliacao.objects.none()
+    # O Aplicador enxerga todas as provas das turmas e matérias vinculadas a ele.
+    # EXISTS não multiplica linhas, então não precisa de distinct()
+    avaliacoes = filtrar_escopo(Avaliacao.objects.all(), request).order_by('-data_aplicacao')
 
     # Quais provas já têm algum resultado lançado?
     provas_com_nota = avaliacoes.annotate(qtd_resultados=Count('resultado')).filter(qtd_resultados__gt=0).count()
@@ -3720,7 +3763,7 @@ def dashboard_aplicador(request):
     nome_exibicao = perfil.nome_completo.split("-")[0].strip() if perfil.nome_completo else "Aplicador"
     
     # Vasculha as alocações para ver quais turmas ele atende
-    turmas_aplicador = list(set([aloc.turma.nome for aloc in alocacoes_do_prof]))
+    turmas_aplicador = list(Turma.objects.filter(alocacoes__professor=perfil).values_list('nome', flat=True).distinct())
     turmas_texto = " e ".join(turmas_aplicador) if turmas_aplicador else "Nenhuma turma vinculada"
 
     context = {
@@ -3754,7 +3797,9 @@ def dashboard_pca(request):
     # ==========================================
     # ABA 1: VISÃO DOCENTE (Monitorar Professores)
     # ==========================================
-    alocacoes = Alocacao.objects.filter(disciplina__in=disciplinas_da_area).select_related('professor', 'turma', 'disciplina')
+    alocacoes = Alocacao.objects.filter(disciplina__in=disciplinas_da_area).select_related(
+        'professor', 'turma', 'disciplina'
+    ).annotate(qtd_provas=Count('avaliacoes'))
     
     professores_stats = {}
     for aloc in alocacoes:
@@ -3770,9 +3815,8 @@ def dashboard_pca(request):
         professores_stats[prof_id]['turmas'].add(aloc.turma.nome)
         professores_stats[prof_id]['disciplinas'].add(aloc.disciplina.nome)
         
-        # Quantas provas esse professor deu nessa turma/disciplina?
-        qtd_provas = Avaliacao.objects.filter(alocacao=aloc).count()
-        professores_stats[prof_id]['provas_aplicadas'] += qtd_provas
+        # Quantas provas esse professor deu nessa turma/disciplina? (já contado na consulta)
+        professores_stats[prof_id]['provas_aplicadas'] += aloc.qtd_provas
 
     # Formatando para mandar pro HTML
     lista_professores = []
@@ -3787,10 +3831,11 @@ def dashboard_pca(request):
     # ==========================================
     resultados_area = Resultado.objects.filter(avaliacao__alocacao__disciplina__in=disciplinas_da_area)
     
-    # Desempenho médio de cada Disciplina da Área dele
+    # Desempenho médio de cada Disciplina da Área dele (uma agregação para todas)
+    medias_disciplina = dict(resultados_area.values_list('avaliacao__alocacao__disciplina_id').annotate(media=Avg('percentual')).order_by())
     proficiencia_disciplinas = []
     for disc in disciplinas_da_area:
-        media = resultados_area.filter(avaliacao__alocacao__disciplina=disc).aggregate(Avg('percentual'))['percentual__avg']
+        media = medias_disciplina.get(disc.id)
         proficiencia_disciplinas.append({
             'nome': disc.nome,
             'media': round(media / 10, 1) if media else 0.0
@@ -3991,22 +4036,18 @@ def resultados_turma(request, avaliacao_id):
     avaliacao = get_object_or_404(Avaliacao, id=avaliacao_id)
     
     # 1. Puxa o esqueleto da prova (As colunas do Mapa de Calor)
-    itens = ItemGabarito.objects.filter(avaliacao=avaliacao).order_by('numero')
+    itens = list(ItemGabarito.objects.filter(avaliacao=avaliacao).order_by('numero'))
     
     # 2. Puxa os Resultados
-    resultados_banco = Resultado.objects.filter(avaliacao=avaliacao).select_related('matricula__aluno', 'matricula__turma').order_by('matricula__aluno__nome_completo')
+    resultados_banco = list(Resultado.objects.filter(avaliacao=avaliacao).select_related('matricula__aluno', 'matricula__turma').order_by('matricula__aluno__nome_completo'))
     
-    total_alunos = resultados_banco.count()
-    media_turma = resultados_banco.aggregate(Avg('percentual'))['percentual__avg']
+    total_alunos = len(resultados_banco)
+    percentuais = [r.percentual for r in resultados_banco if r.percentual is not None]
+    media_turma = sum(percentuais) / len(percentuais) if percentuais else None
     media_turma = round(media_turma / 10, 1) if media_turma else 0.0
     
-    # 3. OTIMIZAÇÃO EXTREMA: Puxa todas as respostas da turma de uma vez só!
-    respostas_all = RespostaDetalhada.objects.filter(resultado__in=resultados_banco).values('resultado_id', 'item_gabarito_id', 'acertou')
-    mapa_geral = {}
-    for resp in respostas_all:
-        if resp['resultado_id'] not in mapa_geral:
-            mapa_geral[resp['resultado_id']] = {}
-        mapa_geral[resp['resultado_id']][resp['item_gabarito_id']] = resp['acertou']
+    # 3. OTIMIZAÇÃO EXTREMA: as respostas vêm no vetor compacto de cada Resultado (mesma consulta)
+    mapa_geral = mapa_acertos(resultados_banco, itens)
     
     # 4. Monta a lista final juntando a Nota com o Mapa de Calor
     lista_resultados = []
@@ -4057,16 +4098,11 @@ def baixar_relatorio_raiox_pdf(request, avaliacao_id):
     from django.db.models import Avg
 
     avaliacao = get_object_or_404(Avaliacao, id=avaliacao_id)
-    itens = ItemGabarito.objects.filter(avaliacao=avaliacao).order_by('numero')
-    resultados_banco = Resultado.objects.filter(avaliacao=avaliacao).select_related('matricula__aluno').order_by('matricula__aluno__nome_completo')
+    itens = list(ItemGabarito.objects.filter(avaliacao=avaliacao).order_by('numero'))
+    resultados_banco = list(Resultado.objects.filter(avaliacao=avaliacao).select_related('matricula__aluno').order_by('matricula__aluno__nome_completo'))
 
-    # OTIMIZAÇÃO: Cria o Mapa de Calor direto do Banco
-    respostas_all = RespostaDetalhada.objects.filter(resultado__in=resultados_banco).values('resultado_id', 'item_gabarito_id', 'acertou')
-    mapa_geral = {}
-    for resp in respostas_all:
-        if resp['resultado_id'] not in mapa_geral:
-            mapa_geral[resp['resultado_id']] = {}
-        mapa_geral[resp['resultado_id']][resp['item_gabarito_id']] = resp['acertou']
+    # OTIMIZAÇÃO: Mapa de Calor direto do vetor compacto de cada Resultado
+    mapa_geral = mapa_acertos(resultados_banco, itens)
 
     buffer = io.BytesIO()
     # Criando documento em formato PAISAGEM
@@ -4085,14 +4121,15 @@ def baixar_relatorio_raiox_pdf(request, avaliacao_id):
     elements.append(Paragraph(nome_escola, titulo_style))
     elements.append(Paragraph("RAIO-X E MAPA DE CALOR DA TURMA", ParagraphStyle('T2', parent=titulo_style, fontSize=12)))
     
-    media_turma = resultados_banco.aggregate(Avg('percentual'))['percentual__avg']
+    percentuais = [r.percentual for r in resultados_banco if r.percentual is not None]
+    media_turma = sum(percentuais) / len(percentuais) if percentuais else None
     media_turma = round(media_turma / 10, 1) if media_turma else 0.0
 
     info_texto = f"TURMA: {avaliacao.alocacao.turma.nome} &nbsp;|&nbsp; DISCIPLINA: {avaliacao.alocacao.disciplina.nome.upper()} &nbsp;|&nbsp; DATA: {avaliacao.data_aplicacao.strftime('%d/%m/%Y')} &nbsp;|&nbsp; MÉDIA GERAL: {media_turma}"
     elements.append(Paragraph(info_texto, sub_style))
 
     # 2. Estruturando o Esqueleto da Tabela
-    num_qs = itens.count()
+    num_qs = len(itens)
     if num_qs == 0:
         num_qs = 1
 
@@ -90,6 +90,15 @@ DATABASES = {
 if 'DATABASE_URL' in os.environ:
     DATABASES['default'] = dj_database_url.config(conn_max_age=600)
 
+# Cache do Dashboard: com REDIS_URL, um Redis compartilhado por todos os workers do gunicorn
+# (a trava de obter_ou_calcular só evita cálculo repetido entre processos assim).
+# Sem ele, LocMem: cada processo guarda e calcula o seu (bom para desenvolvimento)
+REDIS_URL = config('REDIS_URL', default='')
+if REDIS_URL:
+    CACHES = {'default': {'BACKEND': 'django.core.cache.backends.redis.RedisCache', 'LOCATION': REDIS_URL}}
+else:
+    CACHES = {'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'}}
+
 # Password validation
 # https://docs.djangoproject.com/en/6.0/ref/settings/#auth-password-validators
 
@@ -139,4 +148,20 @@ STATIC_URL = 'static/'
 import os
 
 MEDIA_URL = '/media/'
-MEDIA_ROOT = os.path.join(BASE_DIR, 'media')
\ No newline at end of file
+MEDIA_ROOT = os.path.join(BASE_DIR, 'media')
+# --- LEITOR DE CARTÕES (OMR) ---
+# Imagens de depuração desligadas em produção; quando ligadas, só uma amostra dos cartões é gravada
+OMR_DEBUG = config('OMR_DEBUG', default=False, cast=bool)
+OMR_DEBUG_AMOSTRA = config('OMR_DEBUG_AMOSTRA', default=0.1, cast=float)
+OMR_DEBUG_DIR = os.path.join(MEDIA_ROOT, 'temp', 'debug')
+# Fila de leitura: com OMR_FILA ligada, api_ler_cartao só enfileira e o comando worker_omr lê.
+# A view espera até OMR_FILA_ESPERA segundos (a leitura leva ~0,1 s); depois disso devolve o id
+# da tarefa e a tela consulta sozinha, sem prender o worker do gunicorn
+OMR_FILA = config('OMR_FILA', default=False, cast=bool)
+OMR_FILA_ESPERA = config('OMR_FILA_ESPERA', default=1.0, cast=float)
+OMR_WORKER_PROCESSOS = config('OMR_WORKER_PROCESSOS', default=0, cast=int)
+# Lote pela tela (corrigir_cartoes_lote): com OMR_FILA as páginas vão para o worker_omr e a view
+# espera até OMR_LOTE_ESPERA segundos no total. Sem fila o envio é recusado, a não ser que
+# OMR_LOTE_PROCESSOS > 0 libere a leitura dentro da requisição (instalação pequena, sem worker)
+OMR_LOTE_PROCESSOS = config('OMR_LOTE_PROCESSOS', default=0, cast=int)
+OMR_LOTE_ESPERA = config('OMR_LOTE_ESPERA', default=600, cast=int)
@@ -34,6 +34,7 @@ urlpatterns = [
     path('gerar-prova-inteligente/', views.gerar_prova_pdf, name='gerar_prova_inteligente'),
 
     path('definir_gabarito/<int:avaliacao_id>/', views.definir_gabarito, name='definir_gabarito'),
+    path('avaliacao/<int:avaliacao_id>/importar-respostas/', views.importar_respostas, name='importar_respostas'),
     path('montar_prova/<int:avaliacao_id>/', views.montar_prova, name='montar_prova'),
     path('baixar_prova/<int:avaliacao_id>/', views.baixar_prova_existente, name='baixar_prova_existente'),
     path('gerar_cartoes/<int:avaliacao_id>/', views.gerar_cartoes_pdf, name='gerar_cartoes_pdf'),
@@ -77,9 +78,12 @@ urlpatterns = [
     path('api/filtrar_alunos/', views.api_filtrar_alunos, name='api_filtrar_alunos_alt'),
     path('api/gerar-questao/', views.api_gerar_questao, name='api_gerar_questao'),
     path('api/ler-cartao/', views.api_ler_cartao, name='api_ler_cartao'),
+    path('api/ler-cartao/<int:tarefa_id>/', views.api_resultado_leitura, name='api_resultado_leitura'),
+    path('avaliacao/<int:avaliacao_id>/corrigir-lote/', views.corrigir_cartoes_lote, name='corrigir_cartoes_lote'),
     path('api/mover-topico/<int:id>/<str:novo_status>/', views.mover_topico, name='mover_topico'),
     path('api/toggle-topico/<int:id>/', views.toggle_topico, name='toggle_topico'),
     path('api/lancar-notas-ajax/', views.api_lancar_nota_ajax, name='api_lancar_nota_ajax'),
+    path('api/lancar-notas-ajax/sincronizar/', views.api_sincronizar_lancamentos, name='api_sincronizar_lancamentos'),
     path('api/raio-x/', views.api_raio_x, name='api_raio_x'),
 
     # --- passar de ano ---